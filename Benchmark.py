@@ -0,0 +1,554 @@
+"""Performance benchmarks for CheckMyGrade.
+
+    python Benchmark.py analytics --rows 100000 1000000 10000000
+    python Benchmark.py memory --rows 100000
+    python Benchmark.py cipher --rows 1000000
+    python Benchmark.py loadtest --rows 10000 --clients 50 --requests 200
+    python Benchmark.py startup --rows 100000 1000000
+    python Benchmark.py suite --rows 1000 10000 100000 --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import gc
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from TOPMODULE import (CheckMyGradeApp, CSVHandler, CSVStore, DataStore, Grade, GradeAnalytics, LoginUser,
+                       OffsetIndex, PasswordHasher, StudentRecord, Table, TextSecurity, np)
+
+
+def synthetic_columns(rows, courses=50, seed=0):
+    rng = random.Random(seed)
+    course_ids = [f"C{i:03d}" for i in range(courses)]
+    return ([rng.choice(course_ids) for _ in range(rows)],
+            [rng.randint(0, 100) for _ in range(rows)])
+
+
+def per_course_loop(course_column, marks_column):
+    """The Grade.get_course_statistics approach, once per course."""
+    result = {}
+    for course_id in sorted(set(course_column)):
+        marks = [m for c, m in zip(course_column, marks_column) if c == course_id]
+        sorted_marks = sorted(marks)
+        result[course_id] = {
+            'count': len(marks),
+            'mean': sum(marks) / len(marks),
+            'median': sorted_marks[len(sorted_marks) // 2],
+            'min': sorted_marks[0],
+            'max': sorted_marks[-1],
+        }
+    return result
+
+
+def bench_analytics(sizes, courses):
+    if np is None:
+        print("NumPy is not installed; skipping analytics benchmark.")
+        return
+
+    print(f"{'Rows':>10}{'Loop (s)':>12}{'Encode (s)':>12}{'Vector (s)':>12}{'Speedup':>10}")
+    for rows in sizes:
+        course_column, marks_column = synthetic_columns(rows, courses)
+
+        start = time.perf_counter()
+        expected = per_course_loop(course_column, marks_column)
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        analytics = GradeAnalytics.from_columns(course_column, marks_column)
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        summary = analytics.summary()
+        vector_time = time.perf_counter() - start
+
+        for course_id, stats in expected.items():
+            got = summary[course_id]
+            assert (got['count'], got['median'], got['min'], got['max']) == \
+                (stats['count'], stats['median'], stats['min'], stats['max']), course_id
+            assert abs(got['mean'] - stats['mean']) < 1e-9, course_id
+
+        print(f"{rows:>10}{loop_time:>12.4f}{encode_time:>12.4f}{vector_time:>12.4f}"
+              f"{loop_time / vector_time:>9.1f}x")
+
+
+def write_students_csv(path, rows, courses=50, seed=0):
+    course_column, marks_column = synthetic_columns(rows, courses, seed)
+    CSVHandler.save_data(path, ({
+        'Email address': f"student_{i}@mycsu.edu",
+        'First name': f"First{i}",
+        'Last name': f"Last{i}",
+        'Course.id': course_id,
+        'grades': 'ABCDF'[min(4, (100 - marks) // 10)],
+        'Marks': marks,
+    } for i, (course_id, marks) in enumerate(zip(course_column, marks_column))),
+        CSVHandler.STUDENT_FIELDS)
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size, elapsed
+
+
+def bench_memory(rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'students.csv')
+        write_students_csv(path, rows)
+
+        def dict_reader():
+            with open(path, 'r') as f:
+                return list(csv.DictReader(f))
+
+        layouts = [
+            ("list of DictReader dicts", dict_reader),
+            ("Table of dicts", lambda: Table(path, 'Email address', CSVHandler.STUDENT_FIELDS,
+                                             indexes=('Course.id',))),
+            ("Table of StudentRecord", lambda: Table(path, 'Email address', CSVHandler.STUDENT_FIELDS,
+                                                     indexes=('Course.id',),
+                                                     record_type=StudentRecord)),
+        ]
+        print(f"{'Layout':<26}{'MiB':>10}{'MiB/100k':>10}{'B/row':>8}{'Load (s)':>10}")
+        for name, build in layouts:
+            size, elapsed = measure(build)
+            print(f"{name:<26}{size / 2**20:>10.1f}{size / 2**20 * 100_000 / rows:>10.1f}"
+                  f"{size / rows:>8.0f}{elapsed:>10.3f}")
+
+
+def char_loop_convert(text, shift):
+    """TextSecurity._convert before it used str.translate."""
+    result = ""
+    for ch in text:
+        if ch.isupper():
+            result += chr((ord(ch) + shift - 65) % 26 + 65)
+        elif ch.islower():
+            result += chr((ord(ch) + shift - 97) % 26 + 97)
+        else:
+            result += ch
+    return result
+
+
+def bench_cipher(rows):
+    rng = random.Random(0)
+    alphabet = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+    passwords = [''.join(rng.choices(alphabet, k=rng.randint(8, 16))) for _ in range(rows)]
+    cipher = TextSecurity(3)
+
+    start = time.perf_counter()
+    expected = [char_loop_convert(p, 3) for p in passwords]
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encrypted = list(cipher.encrypt_many(passwords))
+    batch_time = time.perf_counter() - start
+    assert encrypted == expected
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'login.csv')
+        CSVHandler.save_data(path, ({'User id': f"user_{i}@mycsu.edu", 'Password': e, 'Role': 'student'}
+                                    for i, e in enumerate(encrypted)), CSVHandler.LOGIN_FIELDS)
+        start = time.perf_counter()
+        rotated = LoginUser.rotate_cipher(7, path)
+        rotate_time = time.perf_counter() - start
+        assert rotated == rows
+
+    print(f"{'Rows':>10}{'Char loop (s)':>15}{'translate (s)':>15}{'Speedup':>10}{'Rotate file (s)':>17}")
+    print(f"{rows:>10}{loop_time:>15.3f}{batch_time:>15.3f}{loop_time / batch_time:>9.1f}x"
+          f"{rotate_time:>17.3f}")
+
+
+def write_data_dir(path, rows, courses=50):
+    """students, courses, professors (prof_<i> teaches C<i>) and login CSVs for
+    a synthetic data directory. Every login shares one hash of 'default' so
+    seeding skips the KDF."""
+    write_students_csv(os.path.join(path, 'students.csv'), rows, courses)
+    CSVHandler.save_data(os.path.join(path, 'courses.csv'), ({
+        'Course_id': f"C{i:03d}", 'Course_name': f"Course {i}", 'Credits': 3, 'Description': ''
+    } for i in range(courses)), CSVHandler.COURSE_FIELDS)
+    CSVHandler.save_data(os.path.join(path, 'professors.csv'), ({
+        'Professor_id': f"prof_{i}@mycsu.edu", 'Professor Name': f"Prof {i}", 'Rank': 'Senior',
+        'Course.id': f"C{i:03d}"
+    } for i in range(courses)), CSVHandler.PROFESSOR_FIELDS)
+    default = PasswordHasher.hash('default')
+    logins = [(f"student_{i}@mycsu.edu", 'student') for i in range(rows)]
+    logins += [(f"prof_{i}@mycsu.edu", 'professor') for i in range(courses)]
+    CSVHandler.save_data(os.path.join(path, 'login.csv'), ({
+        'User id': user, 'Password': default, 'Role': role
+    } for user, role in logins), CSVHandler.LOGIN_FIELDS)
+
+
+async def http_request(reader, writer, method, path, body=None, token=''):
+    data = json.dumps(body).encode() if body is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: bench\r\nAuthorization: Bearer {token}\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line == b'\r\n':
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    payload = await reader.readexactly(length)
+    return status, payload
+
+
+async def load_client(host, port, seed, members, requests, ready, latencies, errors):
+    """One keep-alive connection. Every tenth client is the professor of a
+    course and reads and grades its students; the rest are students reading
+    their own record, report and course statistics. Clients log in first and
+    wait at the ready barrier, so the timed phase excludes the initial KDFs."""
+    rng = random.Random(seed)
+    courses = sorted(members)
+    reader, writer = await asyncio.open_connection(host, port)
+    if seed % 10 == 0:
+        course = seed // 10 % len(courses)
+        user, students = f"prof_{course}@mycsu.edu", members[courses[course]]
+    else:
+        course = rng.randrange(len(courses))
+        user = f"student_{rng.choice(members[courses[course]])}@mycsu.edu"
+    login = ('POST', '/login', {'email': user, 'password': 'default'})
+    try:
+        status, payload = await http_request(reader, writer, *login)
+        token = json.loads(payload)['token']
+        await ready.wait()
+        for _ in range(requests):
+            pick = rng.random()
+            if user.startswith('prof_'):
+                email = f"student_{rng.choice(students)}@mycsu.edu"
+                if pick < 0.7:
+                    args = ('GET', f"/students/{email}")
+                else:
+                    args = ('PUT', f"/students/{email}/marks", {'marks': rng.randint(0, 100)})
+            elif pick < 0.50:
+                args = ('GET', f"/students/{user}/report")
+            elif pick < 0.85:
+                args = ('GET', f"/students/{user}")
+            elif pick < 0.95:
+                args = ('GET', f"/courses/{courses[course]}/stats")
+            else:
+                args = login
+            start = time.perf_counter()
+            status, _ = await http_request(reader, writer, *args, token=token)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append((args[:2], status))
+    finally:
+        writer.close()
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on {host}:{port} did not start")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def bench_loadtest(rows, clients, requests, courses=50, target=None):
+    """Drive `TOPMODULE.py serve` (started here on synthetic data unless
+    target is host:port) with concurrent keep-alive clients."""
+    with tempfile.TemporaryDirectory() as tmp:
+        server = None
+        if target:
+            host, port = target.rsplit(':', 1)
+            port = int(port)
+        else:
+            write_data_dir(tmp, rows, courses)
+            host, port = '127.0.0.1', free_port()
+            server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__) or '.',
+                                                                    'TOPMODULE.py'),
+                                       '--data-dir', tmp, 'serve', '--port', str(port)],
+                                      stdout=subprocess.DEVNULL)
+        try:
+            wait_for_port(host, port)
+            members = {}
+            for i, course_id in enumerate(synthetic_columns(rows, courses)[0]):
+                members.setdefault(course_id, []).append(i)
+            latencies, errors = [], []
+
+            async def run():
+                ready = asyncio.Barrier(clients + 1)
+                clients_done = asyncio.gather(*(
+                    load_client(host, port, seed, members, requests, ready, latencies, errors)
+                    for seed in range(clients)))
+                await ready.wait()
+                start = time.perf_counter()
+                await clients_done
+                return time.perf_counter() - start
+
+            elapsed = asyncio.run(run())
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"{'Clients':>8}{'Requests':>10}{'Errors':>8}{'Req/s':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}"
+          f"{'Max (ms)':>10}")
+    print(f"{clients:>8}{total:>10}{len(errors):>8}{total / elapsed:>10.0f}"
+          f"{latencies[total // 2] * 1000:>10.2f}{latencies[int(total * 0.99)] * 1000:>10.2f}"
+          f"{latencies[-1] * 1000:>10.2f}")
+
+
+def time_operation(run, repeat, warmup):
+    """Seconds per call of run(i) over repeat timed calls after warmup
+    untimed ones; i counts every call, so operations can pick fresh keys."""
+    for i in range(warmup):
+        run(i)
+    times = []
+    for i in range(warmup, warmup + repeat):
+        gc.collect()
+        start = time.perf_counter()
+        run(i)
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times), 'mean': statistics.fmean(times),
+            'max': max(times)}
+
+
+def suite_operations(app, rows, courses, batch):
+    """(name, run) pairs for the data paths the console uses. Console output
+    is discarded; add_student and delete_student work on fresh emails, so
+    the dataset is the same size for every run."""
+    rng = random.Random(1)
+    student = lambda: f"student_{rng.randrange(rows)}@mycsu.edu"
+    added = []
+
+    def quiet(fn):
+        def run(i):
+            with contextlib.redirect_stdout(io.StringIO()):
+                fn(i)
+        return run
+
+    def add_student(i):
+        email = f"bench_{i}@mycsu.edu"
+        app.service.add_student(email, 'Bench', str(i), 'C000', rng.randint(0, 100))
+        added.append(email)
+
+    def bulk_update(i):
+        marks = {student(): rng.randint(0, 100) for _ in range(batch)}
+        app.store.students.update_many({email: {'Marks': m, 'grades': Grade.calculate_grade(m)}
+                                        for email, m in marks.items()})
+
+    return [
+        ('login', lambda i: app.service.authenticate(student(), 'default')),
+        ('display_records', quiet(lambda i: app.student.display_records(student()))),
+        ('display_grade_report', quiet(lambda i: Grade.display_grade_report(student()))),
+        ('get_course_statistics', quiet(lambda i: Grade.get_course_statistics(f"C{i % courses:03d}"))),
+        ('add_student', add_student),
+        ('delete_student', lambda i: app.service.delete_student(added.pop())),
+        (f'bulk_update_{batch}', bulk_update),
+    ]
+
+
+def bench_suite(sizes, repeat=5, warmup=1, backend=None, courses=50, batch=1000, only=None):
+    """Time every data-path operation on synthetic data directories of each
+    size; returns the JSON-ready results."""
+    if only and 'delete_student' in only:
+        only = {*only, 'add_student'}  # deletes the students it adds
+    results = []
+    print(f"{'Operation':<24}{'Rows':>10}{'Min (ms)':>11}{'Median (ms)':>13}{'Max (ms)':>11}")
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            write_data_dir(tmp, rows, courses)
+            try:
+                app = CheckMyGradeApp(backend, tmp)
+                for name, run in suite_operations(app, rows, courses, min(batch, rows)):
+                    if only and name not in only:
+                        continue
+                    timing = time_operation(run, repeat, warmup)
+                    results.append({'operation': name, 'rows': rows, **timing})
+                    print(f"{name:<24}{rows:>10}{timing['min'] * 1000:>11.3f}"
+                          f"{timing['median'] * 1000:>13.3f}{timing['max'] * 1000:>11.3f}")
+            finally:
+                CSVHandler.compact_all()
+                DataStore.active = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': backend or 'csv',
+        'repeat': repeat,
+        'warmup': warmup,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+
+def compare_results(baseline, current, threshold=1.25):
+    """[(operation, rows, baseline median, current median, ratio)] for every
+    measurement in both runs, and the subset slower than threshold x."""
+    before = {(r['operation'], r['rows']): r['median'] for r in baseline['results']}
+    rows = [(r['operation'], r['rows'], before[r['operation'], r['rows']], r['median'],
+             r['median'] / before[r['operation'], r['rows']])
+            for r in current['results'] if (r['operation'], r['rows']) in before]
+    return rows, [row for row in rows if row[4] > threshold]
+
+
+def print_comparison(rows, threshold):
+    print(f"\n{'Operation':<24}{'Rows':>10}{'Before (ms)':>13}{'After (ms)':>12}{'Ratio':>8}")
+    for name, size, before, after, ratio in rows:
+        flag = '  REGRESSION' if ratio > threshold else ''
+        print(f"{name:<24}{size:>10}{before * 1000:>13.3f}{after * 1000:>12.3f}{ratio:>7.2f}x{flag}")
+
+
+def bench_startup(sizes, courses=50):
+    """Opening a CSVStore and answering a first ranking query, parsing the
+    CSVs versus loading the binary snapshot."""
+    print(f"{'Rows':>10}{'Parse (s)':>12}{'Save snap (s)':>15}{'Snapshot (s)':>14}{'Speedup':>10}"
+          f"{'Snap MiB':>10}{'CSV MiB':>9}")
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            write_data_dir(tmp, rows, courses)
+            gc.collect()
+            start = time.perf_counter()
+            store = CSVStore(tmp, snapshot=False)
+            expected = store.top_students(10)
+            parse_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            store.save_snapshot()
+            save_time = time.perf_counter() - start
+            del store
+            gc.collect()
+
+            start = time.perf_counter()
+            store = CSVStore(tmp)
+            assert store.top_students(10) == expected
+            load_time = time.perf_counter() - start
+
+            snap_size = os.path.getsize(store.snapshot_path())
+            csv_size = sum(os.path.getsize(os.path.join(tmp, f"{name}.csv"))
+                           for name in ('students', 'professors', 'courses', 'login'))
+            print(f"{rows:>10}{parse_time:>12.3f}{save_time:>15.3f}{load_time:>14.3f}"
+                  f"{parse_time / load_time:>9.1f}x{snap_size / 2**20:>10.1f}{csv_size / 2**20:>9.1f}")
+
+
+def bench_lookup(sizes, lookups=1000, courses=50):
+    """Reading one student's row: loading the store first versus a lazy
+    store, which reads just the row through the offset index of students.csv."""
+    print(f"{'Rows':>10}{'Load + get (s)':>16}{'Save (s)':>10}{'Index MiB':>11}"
+          f"{'Lookup (us)':>13}{'Rebuild (s)':>13}")
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            emails = [f"student_{i}@mycsu.edu" for i in random.Random(2).choices(range(rows), k=lookups)]
+            write_data_dir(tmp, rows, courses)
+            filename = os.path.join(tmp, 'students.csv')
+
+            start = time.perf_counter()
+            expected = CSVStore(tmp, snapshot=False).students.get(emails[0]).to_dict()
+            load_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            CSVHandler.save_data(filename, CSVHandler.iter_rows(filename), CSVHandler.STUDENT_FIELDS)
+            save_time = time.perf_counter() - start
+
+            store = CSVStore(tmp, lazy=True)
+            assert store.students.get(emails[0]).to_dict() == expected
+            times = []
+            for email in emails:
+                start = time.perf_counter()
+                store.students.get(email)
+                times.append(time.perf_counter() - start)
+            assert store.students.rows is None
+
+            os.remove(OffsetIndex.path(filename))
+            start = time.perf_counter()
+            CSVHandler.lookup(filename, 'Email address', emails[0])
+            rebuild_time = time.perf_counter() - start
+            print(f"{rows:>10}{load_time:>16.3f}{save_time:>10.3f}"
+                  f"{os.path.getsize(OffsetIndex.path(filename)) / 2**20:>11.1f}"
+                  f"{statistics.median(times) * 1e6:>13.1f}{rebuild_time:>13.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CheckMyGrade benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+    analytics = commands.add_parser('analytics',
+                                    help="per-course loop vs vectorized GradeAnalytics")
+    analytics.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    analytics.add_argument('--courses', type=int, default=50)
+    memory = commands.add_parser('memory', help="resident size of loaded student rows")
+    memory.add_argument('--rows', type=int, default=100_000)
+    cipher = commands.add_parser('cipher', help="Caesar encryption and login.csv key rotation")
+    cipher.add_argument('--rows', type=int, default=1_000_000)
+    loadtest = commands.add_parser('loadtest', help="requests/s and latency of the HTTP server")
+    loadtest.add_argument('--rows', type=int, default=10_000)
+    loadtest.add_argument('--clients', type=int, default=50)
+    loadtest.add_argument('--requests', type=int, default=200, help="requests per client")
+    loadtest.add_argument('--target', help="host:port of a running server (default: start one)")
+    startup = commands.add_parser('startup', help="cold start from the CSVs vs the binary snapshot")
+    startup.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    lookup = commands.add_parser('lookup', help="single-row reads through the offset index")
+    lookup.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    suite = commands.add_parser('suite', help="every data-path operation at several dataset sizes")
+    suite.add_argument('--rows', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    suite.add_argument('--repeat', type=int, default=5)
+    suite.add_argument('--warmup', type=int, default=1)
+    suite.add_argument('--backend', choices=['csv', 'sqlite'])
+    suite.add_argument('--batch', type=int, default=1000, help="rows changed per bulk update")
+    suite.add_argument('--only', nargs='+', help="operations to run (default: all)")
+    suite.add_argument('--output', help="write the results as JSON")
+    suite.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    suite.add_argument('--threshold', type=float, default=1.25,
+                       help="median slowdown that counts as a regression (default 1.25x)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'analytics':
+        bench_analytics(args.rows, args.courses)
+    elif args.command == 'memory':
+        bench_memory(args.rows)
+    elif args.command == 'cipher':
+        bench_cipher(args.rows)
+    elif args.command == 'loadtest':
+        bench_loadtest(args.rows, args.clients, args.requests, target=args.target)
+    elif args.command == 'startup':
+        bench_startup(args.rows)
+    elif args.command == 'lookup':
+        bench_lookup(args.rows)
+    elif args.command == 'suite':
+        results = bench_suite(args.rows, args.repeat, args.warmup, args.backend, batch=args.batch,
+                              only=args.only)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        if args.compare:
+            with open(args.compare) as f:
+                rows, regressions = compare_results(json.load(f), results, args.threshold)
+            print_comparison(rows, args.threshold)
+            if regressions:
+                print(f"{len(regressions)} regression(s) over {args.threshold}x")
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
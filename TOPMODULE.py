@@ -1,86 +1,2696 @@
 import csv
+import os
+import sys
+import errno
+import glob
+import io
+import json
+import logging
 import time
+import math
+import atexit
+import hmac
+import mmap
+import zlib
+import struct
+import pstats
+import cProfile
+import operator
+import itertools
+import functools
+import base64
+import bisect
 import hashlib
+import secrets
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
 from datetime import datetime
+from urllib.parse import unquote
+
+try:
+    import fcntl
+except ImportError:  # advisory locking is only available on POSIX
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:  # only needed for GradeAnalytics
+    np = None
+
+
+class Metrics:
+    """Call counts, latency histograms, bytes and rows for the hot paths:
+    CSVHandler I/O, LoginUser auth, menu actions and HTTP requests.
+
+    Off unless $CHECKMYGRADE_METRICS is set: '1' prints the report when the
+    process exits, any other value is a file the report is written to as
+    JSON (read it back with `python TOPMODULE.py metrics <file>`). While off,
+    a timed call costs one flag check."""
+    ENV = 'CHECKMYGRADE_METRICS'
+    # Upper bounds in seconds of the latency buckets; the last one is open.
+    BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0, float('inf'))
+    COUNTERS = ('rows', 'bytes_read', 'bytes_written', 'errors')
+    enabled = False
+    ops = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _op(name):
+        op = Metrics.ops.get(name)
+        if op is None:
+            op = Metrics.ops[name] = {'count': 0, 'seconds': 0.0, 'max': 0.0,
+                                      'histogram': [0] * len(Metrics.BUCKETS),
+                                      **dict.fromkeys(Metrics.COUNTERS, 0)}
+        return op
+
+    @staticmethod
+    def record(name, seconds, **counters):
+        """One call of name that took seconds, plus optional counters."""
+        with Metrics._lock:
+            op = Metrics._op(name)
+            op['count'] += 1
+            op['seconds'] += seconds
+            op['max'] = max(op['max'], seconds)
+            op['histogram'][bisect.bisect_left(Metrics.BUCKETS, seconds)] += 1
+            for counter, value in counters.items():
+                op[counter] += value
+
+    @staticmethod
+    def add(name, **counters):
+        """Add to the counters of name without recording a call."""
+        if not Metrics.enabled:
+            return
+        with Metrics._lock:
+            op = Metrics._op(name)
+            for counter, value in counters.items():
+                op[counter] += value
+
+    @staticmethod
+    @contextmanager
+    def _measure(name):
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            Metrics.record(name, time.perf_counter() - start, errors=1)
+            raise
+        Metrics.record(name, time.perf_counter() - start)
+
+    _OFF = nullcontext()
+
+    @staticmethod
+    def measure(name):
+        """Context manager recording the time spent in its block as name."""
+        return Metrics._measure(name) if Metrics.enabled else Metrics._OFF
+
+    @staticmethod
+    def timed(name):
+        """Decorator recording every call of the function as name."""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not Metrics.enabled:
+                    return func(*args, **kwargs)
+                with Metrics._measure(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    @staticmethod
+    def reset():
+        with Metrics._lock:
+            Metrics.ops = {}
+
+    @staticmethod
+    def snapshot():
+        """{name: {count, seconds, mean, max, histogram, counters}} sorted by
+        total time; histogram maps each bucket's upper bound to its calls."""
+        with Metrics._lock:
+            ops = {name: dict(op) for name, op in Metrics.ops.items()}
+        labels = [f"<={b * 1000:g}ms" for b in Metrics.BUCKETS[:-1]] + [f">{Metrics.BUCKETS[-2] * 1000:g}ms"]
+        for op in ops.values():
+            op['mean'] = op['seconds'] / op['count'] if op['count'] else 0.0
+            op['histogram'] = dict(zip(labels, op['histogram']))
+        return dict(sorted(ops.items(), key=lambda item: -item[1]['seconds']))
+
+    @staticmethod
+    def display(snapshot):
+        print(f"{'Operation':<30}{'Calls':>8}{'Total (s)':>11}{'Mean (ms)':>11}{'Max (ms)':>10}"
+              f"{'Rows':>10}{'Read (KiB)':>12}{'Written (KiB)':>15}")
+        for name, op in snapshot.items():
+            print(f"{name:<30}{op['count']:>8}{op['seconds']:>11.3f}{op['mean'] * 1000:>11.3f}"
+                  f"{op['max'] * 1000:>10.3f}{op['rows']:>10}{op['bytes_read'] / 1024:>12.1f}"
+                  f"{op['bytes_written'] / 1024:>15.1f}")
+            counts = ", ".join(f"{label} {n}" for label, n in op['histogram'].items() if n)
+            if counts:
+                print(f"{'':<30}{counts}")
+
+    @staticmethod
+    def dump(path):
+        with open(path, 'w') as f:
+            json.dump(Metrics.snapshot(), f, indent=2)
+
+    @staticmethod
+    def enable_from_env():
+        target = os.environ.get(Metrics.ENV, '')
+        if target in ('', '0'):
+            return
+        Metrics.enabled = True
+        if target == '1':
+            atexit.register(lambda: Metrics.display(Metrics.snapshot()))
+        else:
+            atexit.register(Metrics.dump, target)
+
+    @staticmethod
+    @contextmanager
+    def profiled(profile_path=None, trace_memory=False, limit=15):
+        """Run the block under cProfile (stats saved to profile_path and the
+        top functions by cumulative time printed) and/or tracemalloc (peak
+        and the top allocating lines printed)."""
+        profiler = cProfile.Profile() if profile_path else None
+        if trace_memory:
+            tracemalloc.start()
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(profile_path)
+                pstats.Stats(profiler).sort_stats('cumulative').print_stats(limit)
+            if trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics('lineno')[:limit]
+                tracemalloc.stop()
+                print(f"Memory: {current / 2**20:.1f} MiB current, {peak / 2**20:.1f} MiB peak")
+                for stat in top:
+                    print(stat)
+
+Metrics.enable_from_env()
 
 
 class TextSecurity:
+    _tables = {}
+
     def __init__(self, shift):
         self.shift = shift % 26
+        self._encrypt_table = TextSecurity.table(self.shift)
+        self._decrypt_table = TextSecurity.table(26 - self.shift)
+
+    @staticmethod
+    def table(shift):
+        """str.translate table shifting ASCII letters by shift, built once."""
+        shift %= 26
+        if shift not in TextSecurity._tables:
+            upper = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+            lower = upper.lower()
+            TextSecurity._tables[shift] = str.maketrans(
+                upper + lower, upper[shift:] + upper[:shift] + lower[shift:] + lower[:shift])
+        return TextSecurity._tables[shift]
+
+    def _convert(self, text, shift):
+        return text.translate(TextSecurity.table(shift))
+
+    def encrypt(self, text):
+        return text.translate(self._encrypt_table)
+
+    def decrypt(self, text):
+        return text.translate(self._decrypt_table)
+
+    def encrypt_many(self, texts):
+        table = self._encrypt_table
+        return (text.translate(table) for text in texts)
+
+    def decrypt_many(self, texts):
+        table = self._decrypt_table
+        return (text.translate(table) for text in texts)
+
+class PasswordHasher:
+    """Salted password hashes stored as '<algorithm>$<params>$<salt>$<hash>'
+    with base64 salt and hash. The KDF parameters live in each entry, so they
+    can be raised later and older entries still verify (and get rehashed)."""
+    SCRYPT_PARAMS = (2 ** 14, 8, 1)  # n, r, p
+    PBKDF2_ITERATIONS = 600_000
+    SALT_BYTES = 16
+    HASH_BYTES = 32
+    PREFIXES = ('scrypt$', 'pbkdf2_sha256$')
+
+    @staticmethod
+    def algorithm():
+        # hashlib.scrypt is missing when Python is built without OpenSSL 1.1+.
+        return 'scrypt' if hasattr(hashlib, 'scrypt') else 'pbkdf2_sha256'
+
+    @staticmethod
+    def _derive(algorithm, params, password, salt, length):
+        if algorithm == 'scrypt':
+            n, r, p = params
+            return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                                  maxmem=256 * r * n + 2 ** 20, dklen=length)
+        if algorithm == 'pbkdf2_sha256':
+            (iterations,) = params
+            return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations, length)
+        raise ValueError(f"Unknown password hash algorithm '{algorithm}'")
+
+    @staticmethod
+    def current_params():
+        if PasswordHasher.algorithm() == 'scrypt':
+            return PasswordHasher.SCRYPT_PARAMS
+        return (PasswordHasher.PBKDF2_ITERATIONS,)
+
+    @staticmethod
+    @Metrics.timed('auth.hash')
+    def hash(password):
+        algorithm = PasswordHasher.algorithm()
+        params = PasswordHasher.current_params()
+        salt = os.urandom(PasswordHasher.SALT_BYTES)
+        digest = PasswordHasher._derive(algorithm, params, password, salt, PasswordHasher.HASH_BYTES)
+        return '$'.join([algorithm, ','.join(map(str, params)),
+                         base64.b64encode(salt).decode(), base64.b64encode(digest).decode()])
+
+    @staticmethod
+    def is_hashed(stored):
+        return stored.startswith(PasswordHasher.PREFIXES)
+
+    @staticmethod
+    @Metrics.timed('auth.kdf_verify')
+    def verify(password, stored):
+        try:
+            algorithm, params, salt, digest = stored.split('$')
+            params = tuple(int(p) for p in params.split(','))
+            salt = base64.b64decode(salt)
+            expected = base64.b64decode(digest)
+            actual = PasswordHasher._derive(algorithm, params, password, salt, len(expected))
+        except ValueError:
+            return False
+        return hmac.compare_digest(actual, expected)
+
+    @staticmethod
+    def needs_rehash(stored):
+        if not PasswordHasher.is_hashed(stored):
+            return True
+        algorithm, params = stored.split('$')[:2]
+        return (algorithm != PasswordHasher.algorithm()
+                or params != ','.join(map(str, PasswordHasher.current_params())))
+
+class VerificationCache:
+    """Bounded LRU of recent successful logins so repeated authentication skips
+    the KDF. Entries hold an HMAC of the password under a per-process random
+    key, never the password, and are keyed by the stored hash so a password
+    change invalidates them."""
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.entries = OrderedDict()
+        self._key = os.urandom(32)
+        self._lock = threading.Lock()
+
+    def _tag(self, password):
+        return hmac.new(self._key, password.encode(), 'sha256').digest()
+
+    def check(self, user_id, stored, password):
+        tag = self._tag(password)
+        with self._lock:
+            cached = self.entries.get((user_id, stored))
+            if cached is None or not hmac.compare_digest(cached, tag):
+                return False
+            self.entries.move_to_end((user_id, stored))
+            return True
+
+    def add(self, user_id, stored, password):
+        tag = self._tag(password)
+        with self._lock:
+            self.entries[(user_id, stored)] = tag
+            self.entries.move_to_end((user_id, stored))
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+class OffsetIndex:
+    """On-disk index from the key column of a CSV to the byte offset of each
+    row, kept in '<file>.idx' and rewritten whenever the CSV is saved. find()
+    maps the CSV and parses only the row it needs, so a lookup reads a few
+    index entries and one row whatever the size of the file.
+
+    The file is HEAD followed by one sorted uint64 per row: the top 24 bits
+    of the key's CRC32 above the row's 40-bit offset. A lookup binary
+    searches for the key's hash and checks the rows that share it. The
+    header holds the inode, size and mtime of the CSV it describes and where
+    its indexed rows end; rows appended after that (see extend) are found
+    by parsing just the tail of the file."""
+    MAGIC = b'CMGIDX1\0'
+    # magic, CSV inode, size, mtime_ns, end of indexed rows, header length, key position, entries
+    HEAD = struct.Struct('<8sQQQQQQQ')
+    ENTRY = struct.Struct('<Q')
+    OFFSET_BITS = 40
+    # Past this many appended bytes a lookup rebuilds the index rather than parse the tail.
+    TAIL_LIMIT = 1 << 20
+
+    class Recorder:
+        """Stands in for the file under a csv writer, which writes each row
+        with a single write() call. The rows are held until flush(), which
+        writes them to the file and notes their lengths in bytes."""
+
+        def __init__(self, f):
+            self.f = f
+            self.lines = []
+            self.write = self.lines.append
+            self.lengths = array('I')
+
+        def flush(self):
+            if all(map(str.isascii, self.lines)):
+                self.lengths.extend(map(len, self.lines))
+            else:
+                self.lengths.extend(len(line.encode('utf-8')) for line in self.lines)
+            self.f.writelines(self.lines)
+            self.lines.clear()
+
+        def offsets(self):
+            return array('Q', itertools.accumulate(self.lengths[:-1], initial=0))
+
+    @staticmethod
+    def path(filename):
+        return filename + '.idx'
+
+    @staticmethod
+    def _hash(value):
+        return zlib.crc32(value.encode('utf-8')) >> 8
+
+    @staticmethod
+    def _records(mm, start, end):
+        """(offset, bytes) of each whole record in mm[start:end]; a quoted
+        field may span lines, so a record ends at a newline after an even
+        number of quotes."""
+        mm.seek(start)
+        position = start
+        while position < end:
+            offset = position
+            line = mm.readline()
+            position += len(line)
+            while line.count(b'"') % 2 and position < end:
+                more = mm.readline()
+                position += len(more)
+                line += more
+            if not line.endswith(b'\n'):
+                return  # row torn by a crash mid-append
+            yield offset, line
+
+    @staticmethod
+    def _parse(records):
+        """(offset, values) of each record."""
+        offsets = deque()
+
+        def lines():
+            for offset, line in records:
+                offsets.append(offset)
+                yield line.decode('utf-8')
+
+        for values in csv.reader(lines()):
+            yield offsets.popleft(), values
+
+    @staticmethod
+    def write(filename, st, header_length, key_position, keys, offsets):
+        """Index the rows with these keys and offsets in the CSV whose
+        os.stat() is st."""
+        if st.st_size >> OffsetIndex.OFFSET_BITS:
+            return
+        entries = [key_hash >> 8 << OffsetIndex.OFFSET_BITS | offset
+                   for key_hash, offset in zip(map(zlib.crc32, map(str.encode, keys)), offsets)]
+        entries.sort()
+        entries = array('Q', entries)
+        if sys.byteorder == 'big':
+            entries.byteswap()
+        path = OffsetIndex.path(filename)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(OffsetIndex.HEAD.pack(OffsetIndex.MAGIC, st.st_ino, st.st_size, st.st_mtime_ns,
+                                              st.st_size, header_length, key_position, len(entries)))
+                f.write(entries.tobytes())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    @staticmethod
+    def extend(filename, before, after):
+        """Rows were appended to the CSV, taking its os.stat() from before to
+        after: an index that was valid before stays valid, and the new rows
+        are left to the tail scan."""
+        try:
+            with open(OffsetIndex.path(filename), 'r+b') as f:
+                magic, ino, size, mtime, *rest = OffsetIndex.HEAD.unpack(f.read(OffsetIndex.HEAD.size))
+                if (magic, ino, size, mtime) == (OffsetIndex.MAGIC, before.st_ino, before.st_size,
+                                                 before.st_mtime_ns):
+                    f.seek(0)
+                    f.write(OffsetIndex.HEAD.pack(magic, after.st_ino, after.st_size, after.st_mtime_ns, *rest))
+        except (OSError, struct.error):
+            pass
+
+    @staticmethod
+    def find(filename, key, value):
+        """(header, values) of the CSV row whose key column equals value, as
+        the file is now (its journal is not applied); values is None when
+        there is no such row. A missing or stale index is rebuilt from one
+        scan of the file."""
+        try:
+            f = open(filename, 'rb')
+        except FileNotFoundError:
+            return None, None
+        with f:
+            st = os.fstat(f.fileno())
+            if not st.st_size:
+                return None, None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header_line = mm.readline()
+                header = next(csv.reader([header_line.decode('utf-8')]), [])
+                if key not in header:
+                    return header, None
+                position = header.index(key)
+                values = OffsetIndex._probe(filename, st, mm, len(header_line), header, position, value)
+                if values is False:
+                    values = OffsetIndex._rebuild(filename, st, mm, len(header_line), header, position, value)
+        return header, values
+
+    @staticmethod
+    def _probe(filename, st, mm, header_length, header, position, value):
+        """The row's values through the index, None when it is not there, or
+        False when the index does not describe the CSV as it is now."""
+        head, entry, bits = OffsetIndex.HEAD, OffsetIndex.ENTRY, OffsetIndex.OFFSET_BITS
+        try:
+            with open(OffsetIndex.path(filename), 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+                magic, ino, size, mtime, end, length, key_position, count = head.unpack_from(index)
+                if (magic, ino, size, mtime, length, key_position) != (
+                        OffsetIndex.MAGIC, st.st_ino, st.st_size, st.st_mtime_ns, header_length, position) \
+                        or size - end > OffsetIndex.TAIL_LIMIT:
+                    return False
+                # Appended rows come after the indexed ones, so they win a repeated key.
+                found = None
+                for _, values in OffsetIndex._parse(OffsetIndex._records(mm, end, size)):
+                    if len(values) == len(header) and values[position] == value:
+                        found = values
+                if found:
+                    return found
+
+                target = OffsetIndex._hash(value)
+                low, high = 0, count
+                while low < high:
+                    middle = (low + high) // 2
+                    if entry.unpack_from(index, head.size + 8 * middle)[0] >> bits < target:
+                        low = middle + 1
+                    else:
+                        high = middle
+                # Rows sharing the hash follow in file order; a repeated key's last row wins.
+                for i in range(low, count):
+                    packed, = entry.unpack_from(index, head.size + 8 * i)
+                    if packed >> bits != target:
+                        break
+                    for _, values in OffsetIndex._parse(itertools.islice(
+                            OffsetIndex._records(mm, packed & ((1 << bits) - 1), end), 1)):
+                        if len(values) == len(header) and values[position] == value:
+                            found = values
+                return found
+        except (OSError, ValueError, struct.error):
+            return False
+
+    @staticmethod
+    def _rebuild(filename, st, mm, header_length, header, position, value):
+        """Scan the whole CSV for the row, writing a new index on the way."""
+        keys, offsets, found = [], array('Q'), None
+        for offset, values in OffsetIndex._parse(OffsetIndex._records(mm, header_length, st.st_size)):
+            if len(values) != len(header):
+                continue
+            keys.append(values[position])
+            offsets.append(offset)
+            if values[position] == value:
+                found = values
+        try:
+            OffsetIndex.write(filename, st, header_length, position, keys, offsets)
+        except OSError:
+            pass  # read-only data directory: scan again next time
+        return found
+
+class CSVHandler:
+    STUDENT_FIELDS = ['Email address', 'First name', 'Last name', 'Course.id', 'grades', 'Marks']
+    COURSE_FIELDS = ['Course_id', 'Course_name', 'Credits', 'Description']
+    PROFESSOR_FIELDS = ['Professor_id', 'Professor Name', 'Rank', 'Course.id']
+    LOGIN_FIELDS = ['User id', 'Password', 'Role']
+    # Courses beyond the one on a student's or professor's own row, one row
+    # per (person, course); the key is "<email>/<Course.id>".
+    ENROLLMENT_FIELDS = ['Enrollment id', 'Email address', 'Course.id', 'grades', 'Marks']
+    TEACHING_FIELDS = ['Assignment id', 'Professor_id', 'Course.id']
+
+    # Updates and deletes are appended to '<file>.journal' and folded back into
+    # the CSV once this many entries have accumulated, or when the process exits.
+    JOURNAL_LIMIT = 200
+    _journal_counts = {}
+    _pending = {}
+    _locks = {}
+
+    # Parsed rows of recently loaded files by absolute path, each stored with
+    # the file_version it was read at. load_data serves a file from here while
+    # the CSV and its journal keep the same inode, size and mtime.
+    CACHE_FILES = 16
+    _cache = OrderedDict()
+    cache_hits = 0
+    cache_misses = 0
+
+    # Files that keep an OffsetIndex, by name, and the key column it is on.
+    OFFSET_KEYS = {'students.csv': 'Email address', 'login.csv': 'User id'}
+
+    @staticmethod
+    def journal_path(filename):
+        return filename + '.journal'
+
+    @staticmethod
+    @contextmanager
+    def locked(filename, shared=False):
+        """Advisory fcntl lock on '<file>.lock', shared between processes and
+        re-entrant within one process. Only writers create the lock file: a
+        shared lock on a file no writer has locked yet, or in a directory
+        that cannot hold the lock file, reads without one."""
+        if fcntl is None:
+            yield
+            return
+
+        path = os.path.abspath(filename) + '.lock'
+        held = CSVHandler._locks.get(path)
+        if held:
+            held[1] += 1
+            try:
+                yield
+            finally:
+                held[1] -= 1
+            return
+
+        try:
+            fd = os.open(path, os.O_RDONLY if shared else os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            if not shared or e.errno not in (errno.ENOENT, errno.EACCES, errno.EROFS):
+                raise
+            fd = None
+        if fd is None:
+            yield
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            CSVHandler._locks[path] = [fd, 1]
+            try:
+                yield
+            finally:
+                del CSVHandler._locks[path]
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def file_version(filename):
+        """Identity of the CSV and its journal on disk, used to notice writes
+        made by other processes."""
+        version = []
+        for path in (filename, CSVHandler.journal_path(filename)):
+            try:
+                st = os.stat(path)
+                version.append((st.st_ino, st.st_size, st.st_mtime_ns))
+            except FileNotFoundError:
+                version.append(None)
+        return tuple(version)
+
+    @staticmethod
+    @Metrics.timed('csv.load_data')
+    def load_data(filename):
+        """Rows of a CSV with its journal applied, as a new list of new dicts
+        the caller may change. Unchanged files are not parsed again."""
+        path = os.path.abspath(filename)
+        cache = CSVHandler._cache
+        with CSVHandler.locked(filename, shared=True):
+            version = CSVHandler.file_version(filename)
+            cached = cache.get(path)
+            if cached and cached[0] == version:
+                CSVHandler.cache_hits += 1
+                cache.move_to_end(path)
+                rows = cached[1]
+            else:
+                CSVHandler.cache_misses += 1
+                rows = tuple(CSVHandler.iter_rows(filename))
+                cache[path] = (version, rows)
+                cache.move_to_end(path)
+                while len(cache) > CSVHandler.CACHE_FILES:
+                    cache.popitem(last=False)
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def invalidate(filename):
+        CSVHandler._cache.pop(os.path.abspath(filename), None)
+
+    @staticmethod
+    def cache_stats():
+        return {'hits': CSVHandler.cache_hits, 'misses': CSVHandler.cache_misses,
+                'files': len(CSVHandler._cache)}
+
+    @staticmethod
+    def clear_cache():
+        CSVHandler._cache.clear()
+        CSVHandler.cache_hits = CSVHandler.cache_misses = 0
+
+    @staticmethod
+    def iter_rows(filename, columns=None):
+        """Yield the rows of a CSV one at a time, with its journal applied.
+
+        Rows are dicts, or tuples of the named columns when columns is given
+        (no dict is built for rows the journal does not touch). The file and
+        journal are opened together under the shared lock and the CSV is read
+        only up to its size at that moment, so the scan sees one consistent
+        version even if writers append or replace the file meanwhile.
+        """
+        with CSVHandler.locked(filename, shared=True):
+            try:
+                f = open(filename, 'rb')
+            except FileNotFoundError:
+                f = None
+            try:
+                entries = CSVHandler._read_journal(filename)
+            except FileNotFoundError:
+                entries = []
+            size = os.fstat(f.fileno()).st_size if f else 0
+        return CSVHandler._iter_snapshot(f, size, entries, columns)
+
+    @staticmethod
+    def _iter_snapshot(f, size, entries, columns):
+        start, reader = time.perf_counter(), None
+        try:
+            lines = CSVHandler._snapshot_lines(f, size) if f else iter(())
+            reader = csv.reader(lines)
+            header = next(reader, None)
+            if header is None:
+                if not entries:
+                    return
+                header = list(entries[0]['row'])
+            if columns is None:
+                project = lambda values: dict(zip(header, values))
+            else:
+                positions = [header.index(c) for c in columns]
+                project = lambda values: tuple(values[i] for i in positions)
+
+            ops = {}
+            if entries:
+                key_position = header.index(entries[0]['field'])
+                for index, entry in enumerate(entries):
+                    ops.setdefault(entry['key'], []).append((index, entry))
+
+            tail = []
+            for values in reader:
+                if len(values) != len(header):
+                    continue  # row torn by a crash mid-append
+                if ops and values[key_position] in ops:
+                    row, seq = CSVHandler._apply_ops(ops.pop(values[key_position]),
+                                                     dict(zip(header, values)))
+                    if row is None:
+                        continue
+                    values = [row.get(h, '') for h in header]
+                    if seq is not None:
+                        tail.append((seq, values))
+                        continue
+                yield project(values)
+
+            # Keys the journal inserted (or deleted and re-inserted) go last,
+            # in the order they were inserted.
+            for key_ops in ops.values():
+                row, seq = CSVHandler._apply_ops(key_ops, None)
+                if row is not None:
+                    tail.append((seq, [row.get(h, '') for h in header]))
+            for _, values in sorted(tail, key=lambda item: item[0]):
+                yield project(values)
+        finally:
+            if Metrics.enabled and reader is not None:
+                # Wall time from open to the last row, including the consumer.
+                Metrics.record('csv.scan', time.perf_counter() - start, rows=max(reader.line_num - 1, 0),
+                               bytes_read=min(f.tell(), size) if f else 0)
+            if f:
+                f.close()
+
+    @staticmethod
+    def _snapshot_lines(f, size):
+        consumed = 0
+        for line in f:
+            consumed += len(line)
+            if consumed > size:
+                break
+            yield line.decode('utf-8')
+
+    @staticmethod
+    def _apply_ops(key_ops, row):
+        """Replay one key's journal entries; returns the final row (None if
+        deleted) and the journal index it was last inserted at (None if it
+        kept its original position)."""
+        seq = None
+        for index, entry in key_ops:
+            if entry['op'] == 'insert':
+                if row is None:
+                    row, seq = entry['row'], index
+            elif entry['op'] == 'update':
+                if row is not None:
+                    row = entry['row']
+            elif entry['op'] == 'delete':
+                row = None
+        return row, seq
+
+    @staticmethod
+    def find_first(filename, predicate):
+        """First row matching predicate, stopping the scan as soon as it is found."""
+        rows = CSVHandler.iter_rows(filename)
+        try:
+            return next((row for row in rows if predicate(row)), None)
+        finally:
+            rows.close()
+
+    @staticmethod
+    @Metrics.timed('csv.lookup')
+    def lookup(filename, key, value):
+        """The row whose key column equals value, with the journal applied,
+        or None. Only that row is read from the CSV (see OffsetIndex)."""
+        with CSVHandler.locked(filename, shared=True):
+            header, values = OffsetIndex.find(filename, key, value)
+            try:
+                entries = CSVHandler._read_journal(filename)
+            except FileNotFoundError:
+                entries = []
+        row = dict(zip(header, values)) if values else None
+        ops = [(index, entry) for index, entry in enumerate(entries) if entry['key'] == value]
+        if ops:
+            row = CSVHandler._apply_ops(ops, row)[0]
+        return dict(row) if row is not None else None
+
+    @staticmethod
+    def iter_columns(filename, columns):
+        return CSVHandler.iter_rows(filename, columns)
+
+    @staticmethod
+    @Metrics.timed('csv.read_journal')
+    def _read_journal(filename):
+        entries = []
+        with open(CSVHandler.journal_path(filename), 'r') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue  # blank or torn line
+            if Metrics.enabled:
+                Metrics.add('csv.read_journal', rows=len(entries), bytes_read=os.fstat(f.fileno()).st_size)
+        return entries
+
+    @staticmethod
+    @Metrics.timed('csv.save_data')
+    def save_data(filename, data, fieldnames):
+        # Write a sibling temp file and rename it over the original so readers
+        # and crashes only ever see the old or the new file, never a torn one.
+        key = CSVHandler.OFFSET_KEYS.get(os.path.basename(filename))
+        if key not in fieldnames:
+            key = None
+        with CSVHandler.locked(filename):
+            directory = os.path.dirname(os.path.abspath(filename))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp',
+                                            prefix='.' + os.path.basename(filename))
+            try:
+                with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+                    if key:
+                        out, keys, rows = OffsetIndex.Recorder(f), [], iter(data)
+                        writer = csv.DictWriter(out, fieldnames=fieldnames)
+                        writer.writeheader()
+                        while chunk := list(itertools.islice(rows, 8192)):
+                            keys.extend(str(row[key]) for row in chunk)
+                            writer.writerows(chunk)
+                            out.flush()
+                        out.flush()  # the header, when there are no rows
+                    else:
+                        writer = csv.DictWriter(f, fieldnames=fieldnames)
+                        writer.writeheader()
+                        writer.writerows(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    if Metrics.enabled:
+                        Metrics.add('csv.save_data', bytes_written=os.fstat(f.fileno()).st_size)
+                try:
+                    os.chmod(tmp_path, os.stat(filename).st_mode & 0o777)
+                except FileNotFoundError:
+                    os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, filename)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except FileNotFoundError:
+                    pass
+                raise
+            CSVHandler._clear_journal(filename)
+            if key and len(out.lengths) == len(keys) + 1:
+                try:
+                    OffsetIndex.write(filename, os.stat(filename), out.lengths[0], fieldnames.index(key),
+                                      keys, out.offsets()[1:])
+                except OSError:
+                    pass  # the stale index is rebuilt by the next lookup
+
+    @staticmethod
+    def append_row(filename, row, fieldnames, key):
+        CSVHandler.append_rows(filename, [row], fieldnames, key)
+
+    @staticmethod
+    @Metrics.timed('csv.append_rows')
+    def append_rows(filename, rows, fieldnames, key):
+        with CSVHandler.locked(filename):
+            # Once a journal exists inserts must go through it too, otherwise a
+            # replayed delete could remove a row that was re-added afterwards.
+            if CSVHandler.journal_length(filename):
+                CSVHandler.log_changes(filename, 'insert', rows, key, fieldnames)
+                return
+
+            try:
+                before = os.stat(filename)
+            except FileNotFoundError:
+                before = None
+            new_file = before is None or before.st_size == 0
+            with open(filename, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                if new_file:
+                    writer.writeheader()
+                start = f.tell()
+                writer.writerows({k: row.get(k) for k in fieldnames} for row in rows)
+                f.flush()
+                os.fsync(f.fileno())
+                if Metrics.enabled:
+                    Metrics.add('csv.append_rows', rows=len(rows), bytes_written=f.tell() - start)
+            if before is not None and os.path.basename(filename) in CSVHandler.OFFSET_KEYS:
+                OffsetIndex.extend(filename, before, os.stat(filename))
+            CSVHandler.invalidate(filename)
+
+    @staticmethod
+    def log_change(filename, op, row, key, fieldnames):
+        CSVHandler.log_changes(filename, op, [row], key, fieldnames)
+
+    @staticmethod
+    def log_changes(filename, op, rows, key, fieldnames):
+        CSVHandler.log_ops(filename, [(op, row) for row in rows], key, fieldnames)
+
+    @staticmethod
+    @Metrics.timed('csv.log_ops')
+    def log_ops(filename, ops, key, fieldnames):
+        """Append (op, row) entries, which may mix inserts, updates and
+        deletes, to the journal in one write."""
+        lines = [json.dumps({
+            'op': op,
+            'field': key,
+            'key': row[key],
+            'row': {k: '' if row.get(k) is None else str(row[k]) for k in fieldnames}
+        }) + '\n' for op, row in ops]
+        with CSVHandler.locked(filename):
+            count = CSVHandler.journal_length(filename) + len(lines)
+            journal = CSVHandler.journal_path(filename)
+            with open(journal, 'a') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            CSVHandler.invalidate(filename)
+            if Metrics.enabled:
+                Metrics.add('csv.log_ops', rows=len(lines), bytes_written=sum(map(len, lines)))
+
+            CSVHandler._remember_count(filename, count)
+            CSVHandler._pending[filename] = fieldnames
+            if count >= CSVHandler.JOURNAL_LIMIT:
+                CSVHandler.compact(filename, fieldnames)
+
+    @staticmethod
+    def _journal_signature(filename):
+        try:
+            st = os.stat(CSVHandler.journal_path(filename))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size)
+
+    @staticmethod
+    def _remember_count(filename, count):
+        CSVHandler._journal_counts[filename] = (CSVHandler._journal_signature(filename), count)
+
+    @staticmethod
+    def journal_length(filename):
+        # The cached count is only trusted while the journal on disk is the
+        # one we counted; another process may have appended to or compacted it.
+        signature = CSVHandler._journal_signature(filename)
+        if signature is None:
+            return 0
+        cached = CSVHandler._journal_counts.get(filename)
+        if cached and cached[0] == signature:
+            return cached[1]
+        count = len(CSVHandler._read_journal(filename))
+        CSVHandler._journal_counts[filename] = (signature, count)
+        return count
+
+    @staticmethod
+    @Metrics.timed('csv.compact')
+    def compact(filename, fieldnames):
+        with CSVHandler.locked(filename):
+            if CSVHandler.journal_length(filename):
+                CSVHandler.save_data(filename, CSVHandler.iter_rows(filename), fieldnames)
+        CSVHandler._pending.pop(filename, None)
+
+    @staticmethod
+    def compact_all():
+        for filename, fieldnames in list(CSVHandler._pending.items()):
+            CSVHandler.compact(filename, fieldnames)
+
+    @staticmethod
+    def _clear_journal(filename):
+        try:
+            os.remove(CSVHandler.journal_path(filename))
+        except FileNotFoundError:
+            pass
+        CSVHandler._journal_counts.pop(filename, None)
+        CSVHandler._pending.pop(filename, None)
+        CSVHandler.invalidate(filename)
+
+    @staticmethod
+    def iter_students():
+        return CSVHandler.iter_rows('students.csv')
+
+    @staticmethod
+    def load_students():
+        return CSVHandler.load_data('students.csv')
+
+    @staticmethod
+    def save_students(students):
+        CSVHandler.save_data('students.csv', students, CSVHandler.STUDENT_FIELDS)
+
+    @staticmethod
+    def iter_courses():
+        return CSVHandler.iter_rows('courses.csv')
+
+    @staticmethod
+    def load_courses():
+        return CSVHandler.load_data('courses.csv')
+
+    @staticmethod
+    def save_courses(courses):
+        CSVHandler.save_data('courses.csv', courses, CSVHandler.COURSE_FIELDS)
+
+    @staticmethod
+    def iter_professors():
+        return CSVHandler.iter_rows('professors.csv')
+
+    @staticmethod
+    def load_professors():
+        return CSVHandler.load_data('professors.csv')
+
+    @staticmethod
+    def save_professors(professors):
+        CSVHandler.save_data('professors.csv', professors, CSVHandler.PROFESSOR_FIELDS)
+
+    @staticmethod
+    def iter_login():
+        return CSVHandler.iter_rows('login.csv')
+
+    @staticmethod
+    def load_login():
+        return CSVHandler.load_data('login.csv')
+
+
+    @staticmethod
+    def save_login(data):
+        header = CSVHandler.LOGIN_FIELDS
+        filtered_data = [{key: row[key] for key in header} for row in data]
+        CSVHandler.save_data('login.csv', filtered_data, header)
+
+atexit.register(CSVHandler.compact_all)
+
+class Record:
+    """Compact row: one __slots__ attribute per CSV column instead of a dict,
+    still read and written as row['Column name'] like a csv.DictReader row.
+    Columns listed in INTERNED repeat a few values, so they are interned and
+    every row shares the same string objects."""
+    __slots__ = ()
+    FIELDS = ()
+    INTERNED = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._slot_of = dict(zip(cls.FIELDS, cls.__slots__))
+        cls._interned = frozenset(cls._slot_of[f] for f in cls.INTERNED)
+        cls._keys = dict.fromkeys(cls.FIELDS).keys()
+        # Slot descriptors' setters, paired with whether the column is interned;
+        # __init__ runs once per loaded row, so it avoids per-field lookups.
+        cls._setters = [(getattr(cls, slot).__set__, slot in cls._interned)
+                        for slot in cls.__slots__]
+
+    def __init__(self, *values):
+        for (setter, interned), value in zip(self._setters, values):
+            setter(self, sys.intern(value) if interned and type(value) is str else value)
+
+    def _set(self, slot, value):
+        if slot in self._interned and type(value) is str:
+            value = sys.intern(value)
+        object.__setattr__(self, slot, value)
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Records for rows given one sequence of values per field. Each slot
+        is filled by one map() over its column instead of an __init__ call
+        per row, which is what makes loading a large table fast."""
+        count = len(columns[0]) if columns else 0
+        records = list(map(object.__new__, itertools.repeat(cls, count)))
+        for slot, column in zip(cls.__slots__, columns):
+            if slot in cls._interned:
+                column = map(sys.intern, column)
+            deque(map(getattr(cls, slot).__set__, records, column), maxlen=0)
+        return records
+
+    @classmethod
+    def to_columns(cls, records):
+        """The inverse of from_columns: one list of values per field."""
+        return [list(map(operator.attrgetter(slot), records)) for slot in cls.__slots__]
+
+    @classmethod
+    def from_mapping(cls, row):
+        if isinstance(row, cls):
+            return row
+        return cls(*(row.get(field, '') for field in cls.FIELDS))
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, self._slot_of[field])
+        except KeyError:
+            raise KeyError(field) from None
+
+    def __setitem__(self, field, value):
+        self._set(self._slot_of[field], value)
+
+    def get(self, field, default=None):
+        slot = self._slot_of.get(field)
+        return default if slot is None else getattr(self, slot)
+
+    def update(self, changes):
+        for field, value in changes.items():
+            self[field] = value
+
+    def keys(self):
+        return self._keys
+
+    def values(self):
+        return [getattr(self, slot) for slot in self.__slots__]
+
+    def items(self):
+        return list(zip(self.FIELDS, self.values()))
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __contains__(self, field):
+        return field in self._slot_of
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class StudentRecord(Record):
+    __slots__ = ('email', 'first_name', 'last_name', 'course_id', 'grades', 'marks')
+    FIELDS = CSVHandler.STUDENT_FIELDS
+    INTERNED = ('Course.id', 'grades', 'Marks')
+
+class ProfessorRecord(Record):
+    __slots__ = ('professor_id', 'name', 'rank', 'course_id')
+    FIELDS = CSVHandler.PROFESSOR_FIELDS
+    INTERNED = ('Rank', 'Course.id')
+
+class CourseRecord(Record):
+    __slots__ = ('course_id', 'name', 'credits', 'description')
+    FIELDS = CSVHandler.COURSE_FIELDS
+    INTERNED = ('Course_id', 'Credits')
+
+class LoginRecord(Record):
+    __slots__ = ('user_id', 'password', 'role')
+    FIELDS = CSVHandler.LOGIN_FIELDS
+    INTERNED = ('Role',)
+
+class EnrollmentRecord(Record):
+    __slots__ = ('enrollment_id', 'email', 'course_id', 'grades', 'marks')
+    FIELDS = CSVHandler.ENROLLMENT_FIELDS
+    INTERNED = ('Course.id', 'grades', 'Marks')
+
+class TeachingRecord(Record):
+    __slots__ = ('assignment_id', 'professor_id', 'course_id')
+    FIELDS = CSVHandler.TEACHING_FIELDS
+    INTERNED = ('Course.id',)
+
+class Table:
+    """One CSV file held in memory with a primary-key index and optional
+    secondary indexes. Inserts are appended to the CSV; updates and deletes
+    go to its change journal, so each mutation costs one record of I/O.
+
+    The file version is checked before every read and, under the file lock,
+    before every write, so several processes can share one data directory.
+
+    Aggregates are objects with load(rows, saved, columns), add(row) and
+    remove(row) that are kept in step with the rows, like the secondary
+    indexes.
+
+    With a record_type (a Record subclass) rows are held as compact records
+    built straight from the column tuples, instead of dicts.
+
+    A table created with load=False is filled on first use, by loader(table)
+    when it is set and returns True, otherwise from the CSV. Until then get()
+    and `in` on a file with an offset index (CSVHandler.OFFSET_KEYS) read just
+    the one row through CSVHandler.lookup; the row returned is a copy.
+    """
+
+    def __init__(self, filename, key, fieldnames, indexes=(), aggregates=(), record_type=None, load=True):
+        self.filename = filename
+        self.key = key
+        self.fieldnames = fieldnames
+        self.index_fields = tuple(indexes)
+        self.aggregates = tuple(aggregates)
+        self.record_type = record_type
+        self.rows = self.version = self.loader = None
+        self.offset_indexed = CSVHandler.OFFSET_KEYS.get(os.path.basename(filename)) == key
+        if load:
+            self.reload()
+
+    def _record(self, row):
+        return self.record_type.from_mapping(row) if self.record_type else row
+
+    def reload(self):
+        with CSVHandler.locked(self.filename, shared=True):
+            version = CSVHandler.file_version(self.filename)
+            if self.record_type:
+                columns = list(zip(*CSVHandler.iter_rows(self.filename, self.fieldnames)))
+            else:
+                rows = list(CSVHandler.iter_rows(self.filename))
+        if self.record_type:
+            self.load_columns(columns or [()] * len(self.fieldnames), version)
+        else:
+            self.load(rows, version)
+
+    def load_columns(self, columns, version, orders=None):
+        """load() from one sequence of values per field."""
+        self.load(self.record_type.from_columns(columns), version, orders, columns)
+
+    def load(self, rows, version, orders=None, columns=None):
+        """Replace the contents with rows (records or dicts, in file order)
+        read at version. orders maps an aggregate's position to the state
+        it saved with save(), so it can skip sorting; columns
+        are the same rows field by field, if the caller has them."""
+        self.version = version
+        if columns is None:
+            columns = [[row[field] for row in rows] if field in (self.key, *self.index_fields) else None
+                       for field in self.fieldnames]
+        columns = dict(zip(self.fieldnames, columns))
+        self.rows = dict(zip(columns[self.key], rows))
+        if len(self.rows) != len(rows):
+            # A key repeated in the file: the last row wins.
+            self.load(list(self.rows.values()), version)
+            return
+        self.indexes = {field: {} for field in self.index_fields}
+        for field, index in self.indexes.items():
+            for value, key, row in zip(columns[field], columns[self.key], rows):
+                bucket = index.get(value)
+                if bucket is None:
+                    bucket = index[value] = {}
+                bucket[key] = row
+        columns = {field: values for field, values in columns.items() if values is not None}
+        for position, aggregate in enumerate(self.aggregates):
+            aggregate.load(rows, (orders or {}).get(position), columns)
+
+    def refresh(self):
+        if self.rows is None and self.loader is not None and self.loader(self):
+            return
+        if CSVHandler.file_version(self.filename) != self.version:
+            self.reload()
+
+    def _index(self, row):
+        for field in self.index_fields:
+            self.indexes[field].setdefault(row[field], {})[row[self.key]] = row
+        for aggregate in self.aggregates:
+            aggregate.add(row)
+
+    def _unindex(self, row):
+        for aggregate in self.aggregates:
+            aggregate.remove(row)
+        for field in self.index_fields:
+            bucket = self.indexes[field].get(row[field])
+            if bucket is not None:
+                bucket.pop(row[self.key], None)
+                if not bucket:
+                    del self.indexes[field][row[field]]
+
+    def __contains__(self, key):
+        if self.rows is None and self.offset_indexed:
+            return CSVHandler.lookup(self.filename, self.key, key) is not None
+        self.refresh()
+        return key in self.rows
+
+    def __len__(self):
+        self.refresh()
+        return len(self.rows)
+
+    def get(self, key):
+        if self.rows is None and self.offset_indexed:
+            row = CSVHandler.lookup(self.filename, self.key, key)
+            return None if row is None else self._record(row)
+        self.refresh()
+        return self.rows.get(key)
+
+    def find(self, field, value):
+        self.refresh()
+        return list(self.indexes[field].get(value, {}).values())
+
+    def all(self):
+        self.refresh()
+        return list(self.rows.values())
+
+    def keys(self):
+        self.refresh()
+        return list(self.rows)
+
+    def last(self):
+        self.refresh()
+        return next(reversed(self.rows.values()), None)
+
+    def insert(self, row):
+        with CSVHandler.locked(self.filename):
+            self.refresh()
+            if row[self.key] in self.rows:
+                return False
+            row = self._record(row)
+            self.rows[row[self.key]] = row
+            self._index(row)
+            CSVHandler.append_row(self.filename, row, self.fieldnames, self.key)
+            self.version = CSVHandler.file_version(self.filename)
+        return True
+
+    def insert_many(self, rows):
+        """Insert rows whose keys are new with a single append; returns the
+        number inserted."""
+        with CSVHandler.locked(self.filename):
+            self.refresh()
+            added = []
+            for row in rows:
+                if row[self.key] not in self.rows:
+                    row = self._record(row)
+                    self.rows[row[self.key]] = row
+                    self._index(row)
+                    added.append(row)
+            if added:
+                CSVHandler.append_rows(self.filename, added, self.fieldnames, self.key)
+                self.version = CSVHandler.file_version(self.filename)
+        return len(added)
+
+    def update(self, key, changes):
+        with CSVHandler.locked(self.filename):
+            self.refresh()
+            row = self.rows.get(key)
+            if row is None:
+                return None
+            self._unindex(row)
+            row.update(changes)
+            self._index(row)
+            CSVHandler.log_change(self.filename, 'update', row, self.key, self.fieldnames)
+            self.version = CSVHandler.file_version(self.filename)
+        return row
+
+    def update_many(self, changes):
+        """Apply {key: changes} to many rows and write the file once."""
+        with CSVHandler.locked(self.filename):
+            self.refresh()
+            updated = 0
+            for key, change in changes.items():
+                row = self.rows.get(key)
+                if row is None:
+                    continue
+                self._unindex(row)
+                row.update(change)
+                self._index(row)
+                updated += 1
+            if updated:
+                CSVHandler.save_data(self.filename, list(self.rows.values()), self.fieldnames)
+                self.version = CSVHandler.file_version(self.filename)
+        return updated
+
+    def delete(self, key):
+        with CSVHandler.locked(self.filename):
+            self.refresh()
+            row = self.rows.pop(key, None)
+            if row is None:
+                return None
+            self._unindex(row)
+            CSVHandler.log_change(self.filename, 'delete', row, self.key, self.fieldnames)
+            self.version = CSVHandler.file_version(self.filename)
+        return row
+
+    def delete_many(self, keys):
+        """Delete the rows with these keys with a single journal append;
+        returns the deleted rows."""
+        with CSVHandler.locked(self.filename):
+            self.refresh()
+            deleted = []
+            for key in keys:
+                row = self.rows.pop(key, None)
+                if row is not None:
+                    self._unindex(row)
+                    deleted.append(row)
+            if deleted:
+                CSVHandler.log_changes(self.filename, 'delete', deleted, self.key, self.fieldnames)
+                self.version = CSVHandler.file_version(self.filename)
+        return deleted
+
+    def values(self, field):
+        """Distinct values of an indexed field."""
+        self.refresh()
+        return list(self.indexes[field])
+
+    def apply_changes(self, changes):
+        """Set each key's row to the given full row, or delete it for None,
+        whatever its current state, with a single journal append. Applying
+        the same changes twice leaves the same table."""
+        with CSVHandler.locked(self.filename):
+            self.refresh()
+            ops = []
+            for key, row in changes.items():
+                old = self.rows.get(key)
+                if row is None:
+                    if old is not None:
+                        self._unindex(self.rows.pop(key))
+                        ops.append(('delete', old))
+                elif old is None:
+                    row = self._record(row)
+                    self.rows[key] = row
+                    self._index(row)
+                    ops.append(('insert', row))
+                else:
+                    self._unindex(old)
+                    old.update(row)
+                    self._index(old)
+                    ops.append(('update', old))
+            if ops:
+                CSVHandler.log_ops(self.filename, ops, self.key, self.fieldnames)
+                self.version = CSVHandler.file_version(self.filename)
+        return len(ops)
+
+    def save(self):
+        with CSVHandler.locked(self.filename):
+            CSVHandler.save_data(self.filename, list(self.rows.values()), self.fieldnames)
+            self.version = CSVHandler.file_version(self.filename)
+
+class CourseStats:
+    """Running aggregates for the marks of one course: count, sum, a sorted
+    multiset of marks for min/max/median/percentiles, and a grade histogram."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.marks = []
+        self.grades = Counter()
+
+    def add(self, marks, grade):
+        self.grades[grade] += 1
+        if marks is not None:
+            self.count += 1
+            self.total += marks
+            bisect.insort(self.marks, marks)
+
+    def remove(self, marks, grade):
+        self.grades[grade] -= 1
+        if not self.grades[grade]:
+            del self.grades[grade]
+        if marks is not None:
+            self.count -= 1
+            self.total -= marks
+            del self.marks[bisect.bisect_left(self.marks, marks)]
+
+    def percentile(self, p):
+        """Nearest-rank percentile, p in 0-100."""
+        if not self.marks:
+            return None
+        rank = max(1, math.ceil(p / 100 * self.count))
+        return self.marks[min(rank, self.count) - 1]
+
+    def summary(self):
+        if not self.count:
+            return None
+        return {
+            'count': self.count,
+            'average': self.total / self.count,
+            'median': self.marks[self.count // 2],
+            'min': self.marks[0],
+            'max': self.marks[-1],
+            'grades': dict(self.grades)
+        }
+
+    @staticmethod
+    def combined_summary(a, b):
+        """summary() of the marks of two CourseStats (either may be None)
+        taken together, without merging their mark lists."""
+        if a is None or b is None:
+            stats = a or b
+            return stats.summary() if stats else None
+        count = a.count + b.count
+        if not count:
+            return None
+        half = count // 2
+        i = SortedIndex.split(a.marks, b.marks, half)
+        j = half - i
+        median = min(a.marks[i] if i < a.count else math.inf, b.marks[j] if j < b.count else math.inf)
+        return {
+            'count': count,
+            'average': (a.total + b.total) / count,
+            'median': median,
+            'min': min(a.marks[:1] + b.marks[:1]),
+            'max': max(a.marks[-1:] + b.marks[-1:]),
+            'grades': dict(a.grades + b.grades)
+        }
+
+class CourseStatsIndex:
+    """Table aggregate keeping one CourseStats per Course.id."""
+
+    def __init__(self):
+        self.courses = {}
+
+    @staticmethod
+    def _marks(row):
+        marks = str(row['Marks'])
+        return int(marks) if marks.isdigit() else None
+
+    def clear(self):
+        self.courses = {}
+
+    FIELDS = ('Course.id', 'grades', 'Marks')
+
+    def load(self, rows, saved=None, columns=None):
+        # Marks are collected per course and sorted once, not inserted one by one.
+        self.clear()
+        if columns and all(field in columns for field in self.FIELDS):
+            values = zip(*(columns[field] for field in self.FIELDS))
+        else:
+            values = ((row['Course.id'], row['grades'], row['Marks']) for row in rows)
+        for course_id, grade, marks in values:
+            stats = self.courses.get(course_id)
+            if stats is None:
+                stats = self.courses[course_id] = CourseStats()
+            stats.grades[grade] += 1
+            marks = marks if type(marks) is str else str(marks)
+            if marks.isdigit():
+                stats.marks.append(int(marks))
+        for stats in self.courses.values():
+            stats.marks.sort()
+            stats.count = len(stats.marks)
+            stats.total = sum(stats.marks)
+
+    def add(self, row):
+        stats = self.courses.get(row['Course.id'])
+        if stats is None:
+            stats = self.courses[row['Course.id']] = CourseStats()
+        stats.add(self._marks(row), row['grades'])
+
+    def remove(self, row):
+        stats = self.courses.get(row['Course.id'])
+        if stats is not None:
+            stats.remove(self._marks(row), row['grades'])
+            if not stats.grades:
+                del self.courses[row['Course.id']]
+
+    def get(self, course_id):
+        return self.courses.get(course_id)
+
+class SortedIndex:
+    """Table aggregate holding primary keys in sort_key order, over the whole
+    table (group None) and per group_field value, so top-k, rank, range and
+    page queries take O(log n + k). Entries are (*sort_key(row), key), or the
+    bare key when sort_key returns (); rows whose sort_key is None are left
+    out. Adds made while a file is loaded (from clear until the first read)
+    are appended and each group is sorted once on its next query; later adds
+    are inserted in place, so a batch of updates never re-sorts a group."""
+
+    def __init__(self, key, sort_key, group_field=None):
+        self.key = key
+        self.sort_key = sort_key
+        self.group_field = group_field
+        self.groups = {}
+        self.unsorted = set()
+        self.loading = True
+
+    def _entry(self, row):
+        sort_key = self.sort_key(row)
+        if sort_key is None:
+            return None
+        return (*sort_key, row[self.key]) if sort_key else row[self.key]
+
+    def _group_names(self, row):
+        return (None, row[self.group_field]) if self.group_field else (None,)
+
+    def clear(self):
+        self.groups = {}
+        self.unsorted = set()
+        self.loading = True
+
+    def load(self, rows, saved=None, columns=None):
+        """Rebuild from rows. saved is what save() returned for the same rows:
+        the row position of every entry in sorted order and, unless None,
+        the entries themselves, so nothing is sorted or recomputed. columns
+        may give the group field's values without reading every row."""
+        self.clear()
+        if saved is None:
+            for row in rows:
+                self.add(row)
+            return
+        positions, entries = saved
+        if entries is None:
+            entries = [self._entry(rows[position]) for position in positions]
+        if entries:
+            self.groups[None] = entries
+        if self.group_field:
+            groups, field = self.groups, self.group_field
+            names = (columns or {}).get(field) or [row[field] for row in rows]
+            for position, entry in zip(positions, entries):
+                name = names[position]
+                group = groups.get(name)
+                if group is None:
+                    group = groups[name] = []
+                group.append(entry)
+
+    def save(self, position_of):
+        """(row positions, entries) of every entry in sorted order, given
+        {key: row position}, for load()."""
+        entries = list(self.entries(None))
+        keys = map(operator.itemgetter(-1), entries) if entries and isinstance(entries[0], tuple) else entries
+        return list(map(position_of.__getitem__, keys)), entries
+
+    def add(self, row):
+        entry = self._entry(row)
+        if entry is not None:
+            self.add_entry(entry, self._group_names(row))
+
+    def add_entry(self, entry, group_names):
+        for name in group_names:
+            entries = self.groups.setdefault(name, [])
+            if not entries or entry >= entries[-1] or name in self.unsorted:
+                entries.append(entry)
+            elif self.loading:
+                entries.append(entry)
+                self.unsorted.add(name)
+            else:
+                bisect.insort(entries, entry)
+
+    def remove(self, row):
+        entry = self._entry(row)
+        if entry is not None:
+            self.remove_entry(entry, self._group_names(row))
+
+    def remove_entry(self, entry, group_names):
+        for name in group_names:
+            entries = self.entries(name)
+            i = bisect.bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                del entries[i]
+                if not entries:
+                    del self.groups[name]
+
+    def entries(self, group=None):
+        """The sorted entries of a group (group None: every row)."""
+        self.loading = False
+        entries = self.groups.get(group)
+        if entries is None:
+            return []
+        if group in self.unsorted:
+            entries.sort()
+            self.unsorted.discard(group)
+        return entries
+
+    def key_of(self, entry):
+        return entry[-1] if isinstance(entry, tuple) else entry
+
+    def keys(self, group=None, start=0, stop=None, reverse=False):
+        """Primary keys at positions start:stop, counted from the end when
+        reverse is true."""
+        entries = self.entries(group)
+        if reverse:
+            n = len(entries)
+            stop = n if stop is None else stop
+            chosen = reversed(entries[max(0, n - stop):max(0, n - start)])
+        else:
+            chosen = entries[start:stop]
+        return [self.key_of(e) for e in chosen]
+
+    def span(self, low, high, group=None):
+        """(start, stop) positions of the entries whose first sort value lies
+        in low..high inclusive."""
+        entries = self.entries(group)
+        first = operator.itemgetter(0)
+        return (bisect.bisect_left(entries, low, key=first),
+                bisect.bisect_right(entries, high, key=first))
+
+    # Two tables sharing one order (students and enrollments) each keep a
+    # SortedIndex; these read them as one list without merging them.
+    @staticmethod
+    def split(a, b, k):
+        """How many of the first k entries of merged(a, b) come from a, in
+        O(log n) comparisons; a and b are sorted and share no entry."""
+        low, high = max(0, k - len(b)), min(k, len(a))
+        while low < high:
+            i = (low + high) // 2
+            if b[k - i - 1] > a[i]:
+                low = i + 1
+            else:
+                high = i
+        return low
+
+    @staticmethod
+    def merged(a, b, start=0, stop=None, reverse=False):
+        """(entry, 0 for a or 1 for b) at positions start:stop of the merge
+        of a and b, counted from the end when reverse is true."""
+        n = len(a) + len(b)
+        stop = n if stop is None else min(stop, n)
+        low, high = (n - stop, n - start) if reverse else (start, stop)
+        if low >= high:
+            return []
+        i = SortedIndex.split(a, b, low)
+        j = low - i
+        chosen = []
+        for _ in range(high - low):
+            if j >= len(b) or (i < len(a) and a[i] < b[j]):
+                chosen.append((a[i], 0))
+                i += 1
+            else:
+                chosen.append((b[j], 1))
+                j += 1
+        return chosen[::-1] if reverse else chosen
+
+class LinkedNameOrder:
+    """Students-table aggregate for a name-ordered SortedIndex over the
+    enrollments table. Enrollments rows carry no names, so their entries
+    are (*name_order_key(student), Enrollment id) and are re-entered here
+    whenever their student's row is added, changed or removed."""
+
+    def __init__(self, enrollments, index):
+        self.enrollments = enrollments
+        self.index = index
+
+    def _entries(self, student):
+        if self.enrollments.rows is None:
+            return
+        email = student['Email address']
+        names = DataStore.name_order_key(student)
+        for key, enrollment in self.enrollments.indexes['Email address'].get(email, {}).items():
+            yield (*names, key), (None, enrollment['Course.id'])
+
+    def load(self, rows, saved=None, columns=None):
+        if self.enrollments.rows is not None:
+            self.index.load(list(self.enrollments.rows.values()))
+
+    def add(self, row):
+        for entry, group_names in self._entries(row):
+            self.index.add_entry(entry, group_names)
+
+    def remove(self, row):
+        for entry, group_names in self._entries(row):
+            self.index.remove_entry(entry, group_names)
+
+class SQLiteTable:
+    """Same interface as Table, backed by one table of a SQLite database.
+    Rows come back as dicts of strings, like csv.DictReader rows."""
+
+    def __init__(self, conn, name, key, fieldnames, indexes=(), integer_fields=()):
+        self.conn = conn
+        self.name = name
+        self.key = key
+        self.fieldnames = fieldnames
+
+        columns = ', '.join(
+            f'"{f}" {"INTEGER" if f in integer_fields else "TEXT"}'
+            + (' PRIMARY KEY' if f == key else '')
+            for f in fieldnames)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{name}" ({columns})')
+        for index in indexes:
+            fields = (index,) if isinstance(index, str) else index
+            index_name = f'idx_{name}_' + '_'.join(f.replace('.', '_') for f in fields)
+            cols = ', '.join(f'"{f}"' for f in fields)
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{name}" ({cols})')
+
+        # Built once so sqlite3's statement cache reuses the prepared statements.
+        quoted = ', '.join(f'"{f}"' for f in fieldnames)
+        self._select = f'SELECT {quoted} FROM "{name}"'
+        self._get_sql = f'{self._select} WHERE "{key}" = ?'
+        self._insert_sql = (f'INSERT OR IGNORE INTO "{name}" ({quoted}) '
+                            f'VALUES ({", ".join("?" for _ in fieldnames)})')
+        self._replace_sql = self._insert_sql.replace('OR IGNORE', 'OR REPLACE')
+        self._delete_sql = f'DELETE FROM "{name}" WHERE "{key}" = ?'
 
-    def _convert(self, text, shift):
-        result = ""
-        for ch in text:
-            if ch.isupper():
-                result += chr((ord(ch) + shift - 65) % 26 + 65)
-            elif ch.islower():
-                result += chr((ord(ch) + shift - 97) % 26 + 97)
+    def _row(self, values):
+        return {f: '' if v is None else str(v) for f, v in zip(self.fieldnames, values)}
+
+    def _values(self, row):
+        return [row.get(f) for f in self.fieldnames]
+
+    def reload(self):
+        pass
+
+    def refresh(self):
+        pass
+
+    @property
+    def version(self):
+        # data_version moves when another connection commits; total_changes
+        # counts this connection's own writes.
+        return self.conn.execute('PRAGMA data_version').fetchone()[0], self.conn.total_changes
+
+    def __contains__(self, key):
+        return self.conn.execute(f'SELECT 1 FROM "{self.name}" WHERE "{self.key}" = ?',
+                                 (key,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute(f'SELECT COUNT(*) FROM "{self.name}"').fetchone()[0]
+
+    def get(self, key):
+        values = self.conn.execute(self._get_sql, (key,)).fetchone()
+        return self._row(values) if values else None
+
+    def find(self, field, value):
+        sql = f'{self._select} WHERE "{field}" = ? ORDER BY rowid'
+        return [self._row(v) for v in self.conn.execute(sql, (value,))]
+
+    def all(self):
+        return [self._row(v) for v in self.conn.execute(f'{self._select} ORDER BY rowid')]
+
+    def keys(self):
+        sql = f'SELECT "{self.key}" FROM "{self.name}" ORDER BY rowid'
+        return [k for (k,) in self.conn.execute(sql)]
+
+    def last(self):
+        values = self.conn.execute(f'{self._select} ORDER BY rowid DESC LIMIT 1').fetchone()
+        return self._row(values) if values else None
+
+    def insert(self, row):
+        with self.conn:
+            return self.conn.execute(self._insert_sql, self._values(row)).rowcount == 1
+
+    def insert_many(self, rows):
+        with self.conn:
+            return self.conn.executemany(self._insert_sql,
+                                         (self._values(r) for r in rows)).rowcount
+
+    def replace_many(self, rows):
+        with self.conn:
+            self.conn.executemany(self._replace_sql, (self._values(r) for r in rows))
+
+    def update(self, key, changes):
+        if changes:
+            assignments = ', '.join(f'"{f}" = ?' for f in changes)
+            with self.conn:
+                self.conn.execute(f'UPDATE "{self.name}" SET {assignments} WHERE "{self.key}" = ?',
+                                  [*changes.values(), key])
+        return self.get(key)
+
+    def update_many(self, changes):
+        # One executemany per distinct set of changed columns, one transaction.
+        batches = {}
+        for key, change in changes.items():
+            batches.setdefault(tuple(change), []).append([*change.values(), key])
+        updated = 0
+        with self.conn:
+            for fields, params in batches.items():
+                assignments = ', '.join(f'"{f}" = ?' for f in fields)
+                cursor = self.conn.executemany(
+                    f'UPDATE "{self.name}" SET {assignments} WHERE "{self.key}" = ?', params)
+                updated += cursor.rowcount
+        return updated
+
+    def delete(self, key):
+        row = self.get(key)
+        if row is not None:
+            with self.conn:
+                self.conn.execute(self._delete_sql, (key,))
+        return row
+
+    def delete_many(self, keys):
+        rows = [row for row in map(self.get, keys) if row is not None]
+        with self.conn:
+            self.conn.executemany(self._delete_sql, ((row[self.key],) for row in rows))
+        return rows
+
+    def values(self, field):
+        return [v for (v,) in self.conn.execute(f'SELECT DISTINCT "{field}" FROM "{self.name}"')]
+
+    def apply_changes(self, changes):
+        """Like Table.apply_changes, inside the caller's transaction (it does
+        not commit), so SQLiteStore can commit several tables at once."""
+        upserts = [self._values(row) for row in changes.values() if row is not None]
+        deletes = [(key,) for key, row in changes.items() if row is None]
+        if upserts:
+            assignments = ', '.join(f'"{f}" = excluded."{f}"' for f in self.fieldnames if f != self.key)
+            self.conn.executemany(f'{self._insert_sql.replace("OR IGNORE ", "")} '
+                                  f'ON CONFLICT("{self.key}") DO UPDATE SET {assignments}', upserts)
+        if deletes:
+            self.conn.executemany(self._delete_sql, deletes)
+        return len(changes)
+
+    def save(self):
+        self.conn.commit()
+
+class Snapshot:
+    """Binary image of a CSVStore's tables, saved next to the CSVs so a start
+    can skip parsing them and sorting the rankings.
+
+    The file is MAGIC, a uint32 header length, a JSON header and the column
+    data. Tables are stored column by column. A column with few distinct
+    values (Course.id, grades, Marks, Rank, Role...) is a dictionary of
+    strings in the header plus a fixed-width code per row; any other column
+    is its UTF-8 values joined by NUL. Each SortedIndex order is saved as a
+    uint32 array of row positions plus its entries, column by column. The
+    header holds every CSV's file_version,
+    so the snapshot is only used while they all match and the data's CRC32
+    checks out; the CRC32 of a snapshot file is checked once per process.
+    It is read through mmap."""
+    MAGIC = b'CMGSNAP1'
+    HEAD = struct.Struct('<I')
+    _verified = set()  # (path, inode, size, mtime) of snapshots whose CRC32 matched
+
+    @staticmethod
+    def _identity(path, st):
+        return os.path.abspath(path), st.st_ino, st.st_size, st.st_mtime_ns
+
+    @staticmethod
+    def _spans(meta):
+        """The [start, length] lists a table's meta holds, in file order."""
+        for column in meta['columns']:
+            yield column['data']
+        for saved in meta['orders'].values():
+            yield saved['positions']
+            for column in (saved['entries'] or {'columns': []})['columns']:
+                yield column.get('data') or column['ints']
+
+    @staticmethod
+    def _encode(column, add):
+        # Mostly distinct columns (emails, names) show it in their first rows.
+        codes = None if len(set(column[:1024])) > 512 else dict.fromkeys(column)
+        if codes is None or len(codes) > max(16, len(column) // 2):
+            joined = '\0'.join(column)
+            if joined.count('\0') == len(column) - 1:
+                return {'data': add(joined.encode('utf-8'))}
+            codes = dict.fromkeys(column)
+        values = list(codes)
+        for code, value in enumerate(values):
+            codes[value] = code
+        typecode = 'B' if len(values) <= 1 << 8 else 'H' if len(values) <= 1 << 16 else 'I'
+        return {'values': values, 'type': typecode,
+                'data': add(array(typecode, map(codes.__getitem__, column)).tobytes())}
+
+    @staticmethod
+    def _encode_entries(entries, add):
+        """Sorted index entries (keys, or tuples of sort values and key) as
+        columns of strings or int64s; None when they hold other types."""
+        tuples = bool(entries) and isinstance(entries[0], tuple)
+        columns = []
+        for column in ([list(map(operator.itemgetter(i), entries)) for i in range(len(entries[0]))]
+                       if tuples else [entries]):
+            types = set(map(type, column))
+            if types <= {str}:
+                columns.append(Snapshot._encode(column, add))
+            elif types == {int} and -2**63 <= min(column) and max(column) < 2**63:
+                columns.append({'ints': add(array('q', column).tobytes())})
             else:
-                result += ch
-        return result
+                return None
+        return {'tuples': tuples, 'columns': columns}
 
-    def encrypt(self, text):
-        return self._convert(text, self.shift)
+    @staticmethod
+    def _decode_entries(view, encoded, count):
+        if encoded is None:
+            return None
+        columns = []
+        for column in encoded['columns']:
+            if 'ints' in column:
+                start, length = column['ints']
+                with view[start:start + length] as raw, raw.cast('q') as ints:
+                    columns.append(ints.tolist())
+            else:
+                columns.append(Snapshot._decode(view, column, count))
+        return list(zip(*columns)) if encoded['tuples'] else columns[0]
 
-    def decrypt(self, text):
-        return self._convert(text, 26 - self.shift)
+    @staticmethod
+    def _decode(view, column, count):
+        start, length = column['data']
+        with view[start:start + length] as data:
+            if 'values' in column:
+                values = [sys.intern(v) for v in column['values']]
+                with data.cast(column['type']) as codes:
+                    return list(map(values.__getitem__, codes))
+            return str(data, 'utf-8').split('\0') if count else []
 
-class CSVHandler:
     @staticmethod
-    def load_data(filename):
+    @Metrics.timed('snapshot.save')
+    def save(path, tables):
+        """Write the rows the tables hold now, with the versions they were read
+        at. A table that was never loaded (rows is None) is copied from the
+        snapshot already at path, which must hold it as its CSV is now."""
+        chunks, size = [], 0
+
+        def add(data):
+            nonlocal size
+            chunks.append(data)
+            size += len(data)
+            return [size - len(data), len(data)]
+
+        header = {'byteorder': sys.byteorder, 'tables': {}}
+        unloaded = [table for table in tables if table.rows is None]
+        with ExitStack() as stack:
+            if unloaded:
+                f = stack.enter_context(open(path, 'rb'))
+                view = stack.enter_context(memoryview(stack.enter_context(
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))))
+                old, start = Snapshot._header(view)
+                old_data = stack.enter_context(view[start:])
+                if not Snapshot._check(path, os.fstat(f.fileno()), old, old_data):
+                    raise ValueError("snapshot damaged")
+            for table in tables:
+                name = os.path.basename(table.filename)
+                if table.rows is None:
+                    meta = old['tables'].get(name)
+                    if not Snapshot._matches(meta, table, CSVHandler.file_version(table.filename)):
+                        raise ValueError(f"snapshot does not hold {name}")
+                    spans = list(Snapshot._spans(meta))
+                    if spans:
+                        first = spans[0][0]
+                        last = max(s + n for s, n in spans)
+                        for span in spans:
+                            span[0] += size - first
+                        with old_data[first:last] as section:
+                            add(bytes(section))
+                    header['tables'][name] = meta
+                    continue
+                Snapshot._save_table(table, header, add)
+        data = b''.join(chunks)
+        header['crc32'] = zlib.crc32(data)
+        head = json.dumps(header).encode()
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
         try:
-            with open(filename, 'r') as f:
-                return list(csv.DictReader(f))
-        except FileNotFoundError:
-            return []
+            with os.fdopen(fd, 'wb') as f:
+                f.write(Snapshot.MAGIC + Snapshot.HEAD.pack(len(head)) + head)
+                f.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        Snapshot._verified.add(Snapshot._identity(path, os.stat(path)))
 
     @staticmethod
-    def save_data(filename, data, fieldnames):
-        with open(filename, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(data)
+    def _save_table(table, header, add):
+        rows = list(table.rows.values())
+        meta = {'version': table.version, 'fields': table.fieldnames, 'rows': len(rows),
+                'columns': [], 'orders': {}}
+        if table.record_type:
+            columns = table.record_type.to_columns(rows)
+        else:
+            columns = [[row.get(field) for row in rows] for field in table.fieldnames]
+        for column in columns:
+            if not set(map(type, column)) <= {str}:
+                column = ['' if v is None else str(v) for v in column]  # as the CSV would hold them
+            meta['columns'].append(Snapshot._encode(column, add))
+        position_of = {key: position for position, key in enumerate(table.rows)}
+        for position, aggregate in enumerate(table.aggregates):
+            if hasattr(aggregate, 'save'):
+                positions, entries = aggregate.save(position_of)
+                meta['orders'][position] = {'positions': add(array('I', positions).tobytes()),
+                                            'entries': Snapshot._encode_entries(entries, add)}
+        header['tables'][os.path.basename(table.filename)] = meta
 
     @staticmethod
-    def load_students():
-        return CSVHandler.load_data('students.csv')
+    def _header(view):
+        if view[:len(Snapshot.MAGIC)] != Snapshot.MAGIC:
+            raise ValueError("not a snapshot")
+        start = len(Snapshot.MAGIC) + Snapshot.HEAD.size
+        length, = Snapshot.HEAD.unpack_from(view, len(Snapshot.MAGIC))
+        return json.loads(bytes(view[start:start + length])), start + length
 
     @staticmethod
-    def save_students(students):
-        CSVHandler.save_data('students.csv', students, 
-                           ['Email address', 'First name', 'Last name', 'Course.id', 'grades', 'Marks'])
+    def _check(path, st, header, data):
+        """Whether the snapshot data matches its header's byte order and
+        CRC32; a file that passed once is not checked again."""
+        identity = Snapshot._identity(path, st)
+        if identity not in Snapshot._verified:
+            if header['byteorder'] != sys.byteorder or zlib.crc32(data) != header['crc32']:
+                return False
+            Snapshot._verified.add(identity)
+        return True
 
     @staticmethod
-    def load_courses():
-        return CSVHandler.load_data('courses.csv')
+    def _matches(meta, table, version):
+        return meta is not None and meta['fields'] == table.fieldnames and \
+            meta['version'] == json.loads(json.dumps(version))
 
     @staticmethod
-    def save_courses(courses):
-        CSVHandler.save_data('courses.csv', courses, 
-                           ['Course_id', 'Course_name', 'Credits', 'Description'])
+    def current(path, tables):
+        """Whether the snapshot at path holds the tables' CSVs as they are
+        now; only its header is read, so the data is not checked."""
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(len(Snapshot.MAGIC) + Snapshot.HEAD.size)
+                length, = Snapshot.HEAD.unpack_from(head, len(Snapshot.MAGIC))
+                header, _ = Snapshot._header(head + f.read(length))
+            return all(Snapshot._matches(header['tables'].get(os.path.basename(table.filename)), table,
+                                         CSVHandler.file_version(table.filename)) for table in tables)
+        except (OSError, ValueError, KeyError, TypeError, struct.error):
+            return False
 
     @staticmethod
-    def load_professors():
-        return CSVHandler.load_data('professors.csv')
+    @Metrics.timed('snapshot.load')
+    def load(path, tables):
+        """Load the tables from the snapshot at path and return True, or
+        return False, leaving them untouched, when it is missing, damaged or
+        older than any of the CSVs."""
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                    memoryview(mm) as view:
+                header, start = Snapshot._header(view)
+                with view[start:] as data:
+                    if not Snapshot._check(path, os.fstat(f.fileno()), header, data):
+                        return False
+                    return Snapshot._load_tables(header, data, tables)
+        except (OSError, ValueError, KeyError, TypeError, struct.error):
+            return False
 
     @staticmethod
-    def save_professors(professors):
-        CSVHandler.save_data('professors.csv', professors, 
-                           ['Professor_id', 'Professor Name', 'Rank', 'Course.id'])
+    def _load_tables(header, data, tables):
+        loaded = []
+        for table in tables:
+            meta = header['tables'].get(os.path.basename(table.filename))
+            version = CSVHandler.file_version(table.filename)
+            if not Snapshot._matches(meta, table, version):
+                return False
+            columns = [Snapshot._decode(data, column, meta['rows']) for column in meta['columns']]
+            orders = {}
+            for position, saved in meta['orders'].items():
+                start, length = saved['positions']
+                with data[start:start + length] as raw, raw.cast('I') as positions:
+                    positions = positions.tolist()
+                orders[int(position)] = (positions, Snapshot._decode_entries(data, saved['entries'],
+                                                                             len(positions)))
+            loaded.append((table, columns, version, orders))
+        for table, columns, version, orders in loaded:
+            if table.record_type:
+                table.load_columns(columns, version, orders)
+            else:
+                table.load([dict(zip(table.fieldnames, values)) for values in zip(*columns)],
+                           version, orders, columns)
+        return True
+
+class DataStore:
+    """Storage interface used by every class in the app. A store exposes the
+    students, professors, courses, login, enrollments and teaching tables
+    (Table or SQLiteTable) plus the queries below; CSVStore and SQLiteStore
+    implement it.
+
+    A student's row in students holds their first course (their home
+    enrollment); each further course is one enrollments row with its own
+    grades and Marks. Professors likewise keep their first course on their
+    row and the rest in teaching. Both link tables are indexed by person
+    and by course, so a student's courses and a course's roster cost one
+    lookup per row returned."""
+    active = None
+    BACKEND_ENV = 'CHECKMYGRADE_BACKEND'
 
     @staticmethod
-    def load_login():
-        return CSVHandler.load_data('login.csv')
+    def open(backend=None, data_dir='', lazy=False):
+        """A store on the backend; lazy only matters for CSV (see CSVStore)."""
+        backend = backend or os.environ.get(DataStore.BACKEND_ENV, 'csv')
+        if backend == 'csv':
+            return CSVStore(data_dir, lazy=lazy)
+        if backend == 'sqlite':
+            return SQLiteStore(os.path.join(data_dir, SQLiteStore.DB_NAME), data_dir)
+        raise ValueError(f"Unknown storage backend '{backend}'")
+
+    @staticmethod
+    def get():
+        if DataStore.active is None:
+            DataStore.active = DataStore.open()
+        return DataStore.active
+
+    def tables(self):
+        return [self.students, self.professors, self.courses, self.login, self.enrollments, self.teaching]
+
+    def reload(self):
+        for table in self.tables():
+            table.reload()
 
+    def transaction(self):
+        """A UnitOfWork on this store, for use as a context manager."""
+        return UnitOfWork(self)
+
+    @contextmanager
+    def locked(self, names):
+        """Hold the tables named while a transaction validates and commits."""
+        yield
+
+    def commit_changes(self, changes):
+        """Apply {table name: {key: row or None}} to the tables."""
+        for name, table_changes in changes.items():
+            getattr(self, name).apply_changes(table_changes)
 
     @staticmethod
-    def save_login(data):
-        header = ['User id', 'Password', 'Role']
-        with open('login.csv', 'w', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=header)
-            writer.writeheader()
-            filtered_data = [{key: row[key] for key in header} for row in data]
-            writer.writerows(filtered_data)
+    def link_id(email, course_id):
+        """Key of an enrollments or teaching row."""
+        return f"{email}/{course_id}"
+
+    @staticmethod
+    def _joined(student, enrollment):
+        return dict(student, **{field: enrollment[field] for field in ('Course.id', 'grades', 'Marks')})
+
+    def enrollment(self, email, course_id):
+        """The student's row as it reads for one of their courses (Course.id,
+        grades and Marks of that course), or None when not enrolled."""
+        student = self.students.get(email)
+        if not student or student['Course.id'] == course_id:
+            return student
+        enrollment = self.enrollments.get(self.link_id(email, course_id))
+        return self._joined(student, enrollment) if enrollment else None
+
+    def enrollments_of(self, email):
+        """One row per course of the student, home course first."""
+        student = self.students.get(email)
+        if not student:
+            return []
+        return [student] + [self._joined(student, e) for e in self.enrollments.find('Email address', email)]
+
+    def _join_all(self, enrollments):
+        rows = []
+        for enrollment in enrollments:
+            student = self.students.get(enrollment['Email address'])
+            if student:
+                rows.append(self._joined(student, enrollment))
+        return rows
+
+    def roster(self, course_id):
+        """One row per student enrolled in the course."""
+        return self.students.find('Course.id', course_id) + \
+            self._join_all(self.enrollments.find('Course.id', course_id))
+
+    def all_enrollments(self):
+        return self.students.all() + self._join_all(self.enrollments.all())
+
+    def courses_taught(self, email):
+        """Course.id of every course the professor teaches, their own first."""
+        professor = self.professors.get(email)
+        if not professor:
+            return []
+        courses = [] if professor['Course.id'] in Relations.NO_COURSE else [professor['Course.id']]
+        return courses + [t['Course.id'] for t in self.teaching.find('Professor_id', email)]
+
+    def course_stats(self, course_id):
+        """Count, average, median, min, max and grade histogram of the numeric
+        marks in a course, or None when the course has no marked students."""
+        students = self.roster(course_id)
+        marks = sorted(int(s['Marks']) for s in students if str(s['Marks']).isdigit())
+        if not marks:
+            return None
+        return {
+            'count': len(marks),
+            'average': sum(marks) / len(marks),
+            'median': marks[len(marks) // 2],
+            'min': marks[0],
+            'max': marks[-1],
+            'grades': dict(Counter(s['grades'] for s in students))
+        }
+
+    ORDERS = ('marks', 'name', 'email')
+
+    @staticmethod
+    def marks_order_key(row):
+        """Sort key of the marks ranking (highest first), None without marks."""
+        marks = str(row['Marks'])
+        return (-int(marks),) if marks.isdigit() else None
+
+    @staticmethod
+    def name_order_key(row):
+        return row['Last name'], row['First name']
+
+    def _ordered_students(self, order, course_id):
+        if course_id is None:
+            students, enrollments = self.students.all(), self.enrollments.all()
+        else:
+            students = self.students.find('Course.id', course_id)
+            enrollments = self.enrollments.find('Course.id', course_id)
+        # Ties go by row key: the email for a home enrollment, the
+        # Enrollment id (email/Course.id) for the others.
+        rows = [(s['Email address'], s) for s in students]
+        for enrollment in enrollments:
+            student = self.students.get(enrollment['Email address'])
+            if student:
+                rows.append((enrollment['Enrollment id'], self._joined(student, enrollment)))
+        key = {'marks': self.marks_order_key, 'name': self.name_order_key, 'email': lambda s: ()}[order]
+        entries = [(key(row), row_key, i) for i, (row_key, row) in enumerate(rows)]
+        return [rows[i][1] for sort_key, _, i in sorted(e for e in entries if e[0] is not None)]
+
+    def students_page(self, order='marks', offset=0, limit=None, course_id=None, reverse=False):
+        """(rows, total): rows offset..offset+limit of the students of a course
+        (or all students) in the given order, counted from the end and listed
+        backwards when reverse is true. The marks order ranks highest first
+        and leaves out students without marks; ties go by email."""
+        students = self._ordered_students(order, course_id)
+        if reverse:
+            students.reverse()
+        stop = None if limit is None else offset + limit
+        return students[offset:stop], len(students)
+
+    def top_students(self, k, course_id=None, lowest=False):
+        return self.students_page('marks', 0, k, course_id, reverse=lowest)[0]
+
+    def students_in_range(self, low, high, course_id=None):
+        """Students with low <= marks <= high, highest first."""
+        return [s for s in self._ordered_students('marks', course_id) if low <= int(s['Marks']) <= high]
+
+    def student_rank(self, email, course_id=None):
+        """{'rank', 'count', 'course_id', 'marks'} of a student within one of
+        their courses (their home course by default; 1 = best; equal marks
+        share a rank), or None when not enrolled or without marks."""
+        student = self.students.get(email) if course_id is None else self.enrollment(email, course_id)
+        if not student or not str(student['Marks']).isdigit():
+            return None
+        marks = int(student['Marks'])
+        ranked = self._ordered_students('marks', student['Course.id'])
+        better = sum(1 for s in ranked if int(s['Marks']) > marks)
+        return {'rank': better + 1, 'count': len(ranked), 'course_id': student['Course.id'], 'marks': marks}
+
+class CSVStore(DataStore):
+    """Long-lived repository for all the CSV files, owned by CheckMyGradeApp.
+    Lookups go through hash indexes instead of re-parsing and scanning files.
+
+    A lazy store loads each table on first use instead of all at start, so a
+    session that only logs in and reads its own records reads those rows
+    alone, through the offset indexes of students.csv and login.csv."""
+
+    def __init__(self, data_dir='', snapshot=True, lazy=False):
+        self.data_dir = data_dir
+        self.use_snapshot = snapshot
+        self.snapshot_stale = False
+        self.course_aggregates = CourseStatsIndex()
+        self.orders = {
+            'marks': SortedIndex('Email address', DataStore.marks_order_key, 'Course.id'),
+            'name': SortedIndex('Email address', DataStore.name_order_key, 'Course.id'),
+            'email': SortedIndex('Email address', lambda row: (), 'Course.id'),
+        }
+        # The same aggregates over enrollments rows, keyed by Enrollment id, so
+        # a course's roster and every enrollment are queried without a scan.
+        self.enrollment_aggregates = CourseStatsIndex()
+        self.enrollment_orders = {
+            'marks': SortedIndex('Enrollment id', DataStore.marks_order_key, 'Course.id'),
+            'name': SortedIndex('Enrollment id', self._enrollment_name_key, 'Course.id'),
+            'email': SortedIndex('Enrollment id', lambda row: (), 'Course.id'),
+        }
+        self.enrollments = Table(os.path.join(data_dir, 'enrollments.csv'), 'Enrollment id',
+                                 CSVHandler.ENROLLMENT_FIELDS, indexes=('Email address', 'Course.id'),
+                                 aggregates=(self.enrollment_aggregates, *self.enrollment_orders.values()),
+                                 record_type=EnrollmentRecord, load=False)
+        self.students = Table(os.path.join(data_dir, 'students.csv'), 'Email address',
+                              CSVHandler.STUDENT_FIELDS, indexes=('Course.id',),
+                              aggregates=(self.course_aggregates, *self.orders.values(),
+                                          LinkedNameOrder(self.enrollments, self.enrollment_orders['name'])),
+                              record_type=StudentRecord, load=False)
+        self.professors = Table(os.path.join(data_dir, 'professors.csv'), 'Professor_id',
+                                CSVHandler.PROFESSOR_FIELDS, indexes=('Course.id',),
+                                record_type=ProfessorRecord, load=False)
+        self.courses = Table(os.path.join(data_dir, 'courses.csv'), 'Course_id',
+                             CSVHandler.COURSE_FIELDS, record_type=CourseRecord, load=False)
+        self.login = Table(os.path.join(data_dir, 'login.csv'), 'User id', CSVHandler.LOGIN_FIELDS,
+                           record_type=LoginRecord, load=False)
+        self.teaching = Table(os.path.join(data_dir, 'teaching.csv'), 'Assignment id',
+                              CSVHandler.TEACHING_FIELDS, indexes=('Professor_id', 'Course.id'),
+                              record_type=TeachingRecord, load=False)
+        # Start from the binary snapshot while it matches the CSVs; otherwise
+        # parse them and write a fresh snapshot for the next start.
+        if lazy:
+            for table in self.tables():
+                table.loader = self._load_table
+        elif not (snapshot and Snapshot.load(self.snapshot_path(), self.tables())):
+            self.snapshot_stale = True
+            self.reload()
+            if snapshot:
+                self.save_snapshot()
+        self.recover()
+
+    def _load_table(self, table):
+        if table is self.enrollments:
+            self.students.refresh()  # the name order of enrollments reads their students
+        if self.use_snapshot and Snapshot.load(self.snapshot_path(), [table]):
+            return True
+        self.snapshot_stale = True
+        return False
+
+    SNAPSHOT_NAME = 'checkmygrade.snap'
+
+    def snapshot_path(self):
+        return os.path.join(self.data_dir, self.SNAPSHOT_NAME)
+
+    def save_snapshot(self):
+        """Snapshot the tables as they are on disk now, unless the snapshot
+        there already holds them; skipped (False) when the data directory
+        cannot be written. Tables a lazy session never loaded are copied from
+        the old snapshot while it holds them, so only changed tables are read."""
+        path, tables = self.snapshot_path(), self.tables()
+        if not self.snapshot_stale and Snapshot.current(path, tables):
+            return True
+        for table in tables:
+            if table.rows is not None or not Snapshot.current(path, [table]):
+                table.refresh()
+        try:
+            try:
+                Snapshot.save(path, tables)
+            except ValueError:  # the old snapshot is damaged: load what it was to supply
+                for table in tables:
+                    table.refresh()
+                Snapshot.save(path, tables)
+        except OSError:
+            return False
+        self.snapshot_stale = False
+        return True
+
+    def compact(self):
+        """Fold the tables' journals into their CSVs. A table in memory that
+        was current stays current, so it is not read again afterwards."""
+        for table in self.tables():
+            with CSVHandler.locked(table.filename):
+                current = table.rows is not None and table.version == CSVHandler.file_version(table.filename)
+                CSVHandler.compact(table.filename, table.fieldnames)
+                if current:
+                    table.version = CSVHandler.file_version(table.filename)
+
+    # Each transaction writes its changes to a redo file of its own before
+    # touching any table and removes it once every table is written. Files
+    # left behind by a crash are applied again on the next start; applying
+    # changes twice is harmless.
+    REDO_PATTERN = 'checkmygrade.*.tx'
+
+    def redo_path(self):
+        """A new redo file name, for one transaction."""
+        return os.path.join(self.data_dir, self.REDO_PATTERN.replace('*', secrets.token_hex(8)))
+
+    def redo_paths(self):
+        """The redo files on disk, oldest first."""
+        paths = []
+        for path in glob.glob(os.path.join(glob.escape(self.data_dir), self.REDO_PATTERN)):
+            try:
+                paths.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                pass
+        return [path for _, path in sorted(paths)]
+
+    @contextmanager
+    def locked(self, names):
+        # Always taken in the same order, so two transactions cannot deadlock.
+        with ExitStack() as stack:
+            for filename in sorted(getattr(self, name).filename for name in names):
+                stack.enter_context(CSVHandler.locked(filename))
+            yield
+
+    def commit_changes(self, changes):
+        path = self.redo_path()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({name: [[key, None if row is None else {k: v if v is None else str(v)
+                                                              for k, v in row.items()}]
+                              for key, row in table_changes.items()]
+                       for name, table_changes in changes.items()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        DataStore.commit_changes(self, changes)
+        self._remove_redo(path)
+
+    @staticmethod
+    def _remove_redo(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def recover(self):
+        """Finish the transactions interrupted after their redo files were
+        written. The files are listed again under every table's lock: a
+        transaction still committing holds its tables' locks until it has
+        removed its own file."""
+        if not self.redo_paths():
+            return
+        with self.locked(UnitOfWork.TABLES):
+            for path in self.redo_paths():
+                try:
+                    with open(path) as f:
+                        changes = {name: dict(map(tuple, pairs)) for name, pairs in json.load(f).items()}
+                except FileNotFoundError:
+                    continue  # another process finished it first
+                DataStore.commit_changes(self, changes)
+                self._remove_redo(path)
+
+    def _enrollment_name_key(self, enrollment):
+        student = self.students.rows.get(enrollment['Email address'])
+        return None if student is None else DataStore.name_order_key(student)
+
+    def _refresh_enrolled(self):
+        self.students.refresh()
+        self.enrollments.refresh()
+
+    def _enrolled_rows(self, chosen):
+        """Rows for the (entry, 0 for students or 1 for enrollments) pairs
+        of SortedIndex.merged."""
+        students, enrollments = self.students.rows, self.enrollments.rows
+        rows = []
+        for entry, source in chosen:
+            key = entry[-1] if isinstance(entry, tuple) else entry
+            if source == 0:
+                rows.append(students[key])
+                continue
+            enrollment = enrollments[key]
+            student = students.get(enrollment['Email address'])
+            if student is not None:
+                rows.append(self._joined(student, enrollment))
+        return rows
+
+    # Served from the aggregates maintained on every students and enrollments
+    # write, read together: O(log n + k) for k rows returned.
+    def course_stats(self, course_id):
+        self._refresh_enrolled()
+        return CourseStats.combined_summary(self.course_aggregates.get(course_id),
+                                            self.enrollment_aggregates.get(course_id))
+
+    def students_page(self, order='marks', offset=0, limit=None, course_id=None, reverse=False):
+        self._refresh_enrolled()
+        homes = self.orders[order].entries(course_id)
+        others = self.enrollment_orders[order].entries(course_id)
+        stop = None if limit is None else offset + limit
+        return (self._enrolled_rows(SortedIndex.merged(homes, others, offset, stop, reverse)),
+                len(homes) + len(others))
+
+    def students_in_range(self, low, high, course_id=None):
+        self._refresh_enrolled()
+        spans = []
+        for index in (self.orders['marks'], self.enrollment_orders['marks']):
+            start, stop = index.span(-high, -low, course_id)
+            spans.append(index.entries(course_id)[start:stop])
+        return self._enrolled_rows(SortedIndex.merged(*spans))
+
+    def student_rank(self, email, course_id=None):
+        student = self.students.get(email) if course_id is None else self.enrollment(email, course_id)
+        if not student or not str(student['Marks']).isdigit():
+            return None
+        self._refresh_enrolled()
+        marks, course_id = int(student['Marks']), student['Course.id']
+        better = count = 0
+        for index in (self.orders['marks'], self.enrollment_orders['marks']):
+            start, _ = index.span(-marks, -marks, course_id)
+            better += start
+            count += len(index.entries(course_id))
+        return {'rank': better + 1, 'count': count, 'course_id': course_id, 'marks': marks}
+
+class SQLiteStore(DataStore):
+    """SQLite database (WAL mode) holding the same six tables. A new database
+    is seeded from the CSV files in data_dir."""
+    DB_NAME = 'checkmygrade.db'
+
+    def __init__(self, path=DB_NAME, data_dir=''):
+        self.path = path
+        self.data_dir = data_dir
+        is_new = not os.path.exists(path)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.students = SQLiteTable(self.conn, 'students', 'Email address',
+                                        CSVHandler.STUDENT_FIELDS,
+                                        indexes=[('Course.id', 'Marks'), 'Marks',
+                                                 ('Last name', 'First name'),
+                                                 ('Course.id', 'Last name', 'First name')],
+                                        integer_fields=('Marks',))
+            self.professors = SQLiteTable(self.conn, 'professors', 'Professor_id',
+                                          CSVHandler.PROFESSOR_FIELDS, indexes=['Course.id'])
+            self.courses = SQLiteTable(self.conn, 'courses', 'Course_id', CSVHandler.COURSE_FIELDS)
+            self.login = SQLiteTable(self.conn, 'login', 'User id', CSVHandler.LOGIN_FIELDS)
+            self.enrollments = SQLiteTable(self.conn, 'enrollments', 'Enrollment id',
+                                           CSVHandler.ENROLLMENT_FIELDS,
+                                           indexes=['Email address', ('Course.id', 'Marks'), 'Marks'],
+                                           integer_fields=('Marks',))
+            self.teaching = SQLiteTable(self.conn, 'teaching', 'Assignment id', CSVHandler.TEACHING_FIELDS,
+                                        indexes=['Professor_id', 'Course.id'])
+        if is_new:
+            self.import_csv(data_dir)
+
+    def import_csv(self, data_dir=''):
+        """Copy the CSV file of every table (students.csv, login.csv, ...) into
+        the database, replacing rows that share a primary key."""
+        counts = {}
+        for table in self.tables():
+            rows = CSVHandler.load_data(os.path.join(data_dir, table.name + '.csv'))
+            table.replace_many(rows)
+            counts[table.name] = len(rows)
+        return counts
+
+    # The queries below read students rows and enrollments rows joined to
+    # their student as one roster: a UNION ALL of two branches, s and e,
+    # where "{t}" in a condition stands for the branch's table. row_key is
+    # the email or the Enrollment id, which breaks ties as in CSVStore.
+    # Counts and sums run on each table alone, where the ("Course.id",
+    # "Marks") index answers them, and are added up here.
+    BRANCHES = (
+        ('s', 'students', 'students s', 's."Email address"'),
+        ('e', 'enrollments', 'enrollments e JOIN students s ON s."Email address" = e."Email address"',
+         'e."Enrollment id"'),
+    )
+    COLUMNS = ('s."Email address"', 's."First name"', 's."Last name"', '{t}."Course.id"', '{t}.grades',
+               '{t}."Marks"')
+
+    ORDER_TERMS = {
+        'marks': [('"Marks"', 'DESC'), ('row_key', 'ASC')],
+        'name': [('"Last name"', 'ASC'), ('"First name"', 'ASC'), ('row_key', 'ASC')],
+        'email': [('row_key', 'ASC')],
+    }
+
+    def _order_by(self, order, reverse=False):
+        flip = {'ASC': 'DESC', 'DESC': 'ASC'}
+        return "ORDER BY " + ', '.join(f"{column} {flip[d] if reverse else d}"
+                                       for column, d in self.ORDER_TERMS[order])
+
+    def _roster_where(self, order, course_id, where=(), params=()):
+        where, params = list(where), list(params)
+        if order == 'marks':
+            where.append('typeof({t}."Marks") = \'integer\'')
+        if course_id is not None:
+            where.append('{t}."Course.id" = ?')
+            params.append(course_id)
+        return (f"WHERE {' AND '.join(where)}" if where else ''), params
+
+    def _roster_query(self, order, course_id, where=(), params=(), reverse=False, limit=None):
+        """(sql, params) of the roster rows (STUDENT_FIELDS and row_key) that
+        matter to the order and match the conditions. With a limit each
+        branch is sorted and cut to it before the two are combined."""
+        clause, params = self._roster_where(order, course_id, where, params)
+        branches = []
+        for t, _, source, key in self.BRANCHES:
+            columns = ', '.join(f'{column.format(t=t)} AS "{field}"'
+                                for column, field in zip(self.COLUMNS, CSVHandler.STUDENT_FIELDS))
+            sql = f'SELECT {columns}, {key} AS row_key FROM {source} {clause.format(t=t)}'
+            if limit is not None:
+                sql = f'SELECT * FROM ({sql} {self._order_by(order, reverse)} LIMIT {int(limit)})'
+            branches.append(sql)
+        return ' UNION ALL '.join(branches), params * len(branches)
+
+    def _roster_totals(self, select, order, course_id, where=(), params=(), group_by=None):
+        """The rows of `select` over each table's roster rows, one list per
+        branch; "{t}" in `select` and `group_by` stands for the table."""
+        clause, params = self._roster_where(order, course_id, where, params)
+        results = []
+        for t, table, _, _ in self.BRANCHES:
+            sql = f'SELECT {select} FROM {table} {t} {clause}'
+            if group_by:
+                sql += f' GROUP BY {group_by}'
+            results.append(self.conn.execute(sql.format(t=t), params).fetchall())
+        return results
+
+    def _roster_count(self, order, course_id):
+        return sum(rows[0][0] for rows in self._roster_totals('COUNT(*)', order, course_id))
+
+    def _roster_rows(self, cursor):
+        return [self.students._row(values[:-1]) for values in cursor]
+
+    def course_stats(self, course_id):
+        totals = [rows[0] for rows in self._roster_totals(
+            'COUNT(*), TOTAL({t}."Marks"), MIN({t}."Marks"), MAX({t}."Marks")', 'marks', course_id)]
+        count = sum(row[0] for row in totals)
+        if not count:
+            return None
+        # The lowest count // 2 + 1 marks of either table hold the median.
+        clause, params = self._roster_where('marks', course_id)
+        sql = ' UNION ALL '.join(f'SELECT * FROM (SELECT {t}."Marks" AS "Marks" FROM {table} {t} '
+                                 f'{clause.format(t=t)} ORDER BY {t}."Marks" LIMIT {count // 2 + 1})'
+                                 for t, table, _, _ in self.BRANCHES)
+        (median,) = self.conn.execute(f'SELECT "Marks" FROM ({sql}) ORDER BY "Marks" LIMIT 1 OFFSET ?',
+                                      [*params * len(self.BRANCHES), count // 2]).fetchone()
+        grades = {}
+        for rows in self._roster_totals('{t}.grades, COUNT(*)', 'email', course_id, group_by='{t}.grades'):
+            for grade, n in rows:
+                grades[grade] = grades.get(grade, 0) + n
+        return {'count': count, 'average': sum(row[1] for row in totals) / count, 'median': median,
+                'min': min(row[2] for row in totals if row[0]),
+                'max': max(row[3] for row in totals if row[0]), 'grades': grades}
+
+    def students_page(self, order='marks', offset=0, limit=None, course_id=None, reverse=False):
+        total = self._roster_count(order, course_id)
+        stop = None if limit is None else offset + limit
+        sql, params = self._roster_query(order, course_id, reverse=reverse, limit=stop)
+        rows = self.conn.execute(f'{sql} {self._order_by(order, reverse)} LIMIT ? OFFSET ?',
+                                 [*params, -1 if limit is None else limit, offset])
+        return self._roster_rows(rows), total
+
+    def students_in_range(self, low, high, course_id=None):
+        sql, params = self._roster_query('marks', course_id, ['{t}."Marks" BETWEEN ? AND ?'], [low, high])
+        return self._roster_rows(self.conn.execute(f'{sql} {self._order_by("marks")}', params))
+
+    def student_rank(self, email, course_id=None):
+        student = self.students.get(email) if course_id is None else self.enrollment(email, course_id)
+        if not student or not str(student['Marks']).isdigit():
+            return None
+        marks = int(student['Marks'])
+        totals = [rows[0] for rows in self._roster_totals(
+            'TOTAL({t}."Marks" > %d), COUNT(*)' % marks, 'marks', student['Course.id'])]
+        return {'rank': int(sum(row[0] for row in totals)) + 1, 'count': sum(row[1] for row in totals),
+                'course_id': student['Course.id'], 'marks': marks}
+
+    def commit_changes(self, changes):
+        with self.conn:
+            DataStore.commit_changes(self, changes)
+
+    def close(self):
+        self.conn.close()
+
 class Grade:
     grade_ranges = [
         {"grade_id": 1, "grade": "A", "min": 90, "max": 100},
@@ -90,75 +2700,362 @@ class Grade:
         {"grade_id": 5, "grade": "F", "min": 0, "max": 59}
     ]
 
+    _grade_table = None
+    _table_key = None
+
+    @classmethod
+    def grade_table(cls):
+        """Letter grade for every whole mark 0-100, rebuilt whenever
+        grade_ranges is replaced or any of its ranges is edited in place."""
+        key = tuple((gr["grade"], gr["min"], gr["max"]) for gr in cls.grade_ranges)
+        if cls._table_key != key:
+            table = []
+            for marks in range(101):
+                table.append(next((gr["grade"] for gr in cls.grade_ranges
+                                   if gr["min"] <= marks <= gr["max"]), "F"))
+            cls._grade_table = table
+            cls._table_key = key
+        return cls._grade_table
+
+    @classmethod
+    def set_grade_ranges(cls, grade_ranges):
+        cls.grade_ranges = grade_ranges
+        return cls.grade_table()
+
     @classmethod
     def calculate_grade(cls, marks):
+        table = cls.grade_table()
+        if isinstance(marks, int) and 0 <= marks <= 100:
+            return table[marks]
         for gr in cls.grade_ranges:
             if gr["min"] <= marks <= gr["max"]:
                 return gr["grade"]
         return "F"
 
+    @classmethod
+    def regrade(cls, course_id=None, store=None):
+        """Recompute the grades column from Marks for one course, or for every
+        enrollment when course_id is None, and persist it with a single write
+        per table."""
+        store = store or DataStore.get()
+        changed = 0
+        for table in (store.students, store.enrollments):
+            rows = table.find('Course.id', course_id) if course_id else table.all()
+            changes = {}
+            for row in rows:
+                marks = str(row['Marks'])
+                if marks.isdigit():
+                    grade = cls.calculate_grade(int(marks))
+                    if grade != row['grades']:
+                        changes[row[table.key]] = {'grades': grade}
+            if changes:
+                table.update_many(changes)
+            changed += len(changes)
+        return changed
+
     @staticmethod
+    @Metrics.timed('menu.display_grade_report')
     def display_grade_report(email):
-        start_time = time.time()
-        students = CSVHandler.load_students()
-        target = next((s for s in students if s['Email address'] == email), None)
-        
-        if not target:
-            print("Student not found!")
+        try:
+            reports = GradeService(DataStore.get()).grade_reports(email)
+        except ServiceError as e:
+            print(e)
             return
 
-        course_id = target['Course.id']
-        course_students = [s for s in students if s['Course.id'] == course_id]
-        marks = [int(s['Marks']) for s in course_students]
-        
-        print(f"\nStudent: {target['First name']} {target['Last name']}")
-        print(f"Course: {course_id}, Grade: {target['grades']}, Marks: {target['Marks']}")
-        print(f"Min Marks: {min(marks)}, Max Marks: {max(marks)}")
-        print(f"Report generated in {time.time() - start_time:.6f} seconds")
+        print(f"\nStudent: {reports[0]['First name']} {reports[0]['Last name']}")
+        for report in reports:
+            print(f"Course: {report['Course.id']}, Grade: {report['grades']}, Marks: {report['Marks']}")
+            if report['min'] is not None:
+                print(f"Min Marks: {report['min']}, Max Marks: {report['max']}")
 
     @staticmethod
+    @Metrics.timed('menu.course_statistics')
     def get_course_statistics(course_id):
-        start_time = time.time()
-        students = CSVHandler.load_students()
-        marks = [int(s['Marks']) for s in students if s['Course.id'] == course_id]
-        
-        if not marks:
-            print("No students found for this course!")
+        start_time = time.perf_counter()
+        try:
+            stats = GradeService(DataStore.get()).course_stats(course_id)
+        except ServiceError as e:
+            print(e)
             return 0, 0, 0
 
-        avg = sum(marks) / len(marks)
-        sorted_marks = sorted(marks)
-        median = sorted_marks[len(sorted_marks)//2]
-        Min = min(sorted_marks)
-        Max = max(sorted_marks)
-        elapsed = time.time() - start_time
+        avg = stats['average']
+        median = stats['median']
+        Min = stats['min']
+        Max = stats['max']
+        elapsed = time.perf_counter() - start_time
         
         print(f"\nCourse Statistics for {course_id}:")
         print(f"Average Marks: {avg:.2f}")
         print(f"Median Marks: {median}")
         print(f"Minimum Marks: {Min}")
         print(f"Maximum Marks: {Max}")
-        print(f"Generated in {elapsed:.6f} seconds")
+        print("Grade Distribution: " + ", ".join(f"{g}: {n}" for g, n in sorted(stats['grades'].items())))
         return avg, median, elapsed
 
+class GradeAnalytics:
+    """Statistics for every course in one vectorized pass. Marks are held in
+    a NumPy array next to a parallel array of integer-coded Course.id values."""
+    PERCENTILES = (25, 75, 90)
+
+    def __init__(self, course_ids, codes, marks):
+        if np is None:
+            raise RuntimeError("Batch analytics requires NumPy (pip install numpy)")
+        self.course_ids = list(course_ids)
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.marks = np.asarray(marks, dtype=np.int64)
+
+    @classmethod
+    def from_columns(cls, course_ids, marks):
+        code_of = {}
+        codes = [code_of.setdefault(c, len(code_of)) for c in course_ids]
+        return cls(list(code_of), codes, marks)
+
+    @classmethod
+    def from_csv(cls, filename='students.csv', *filenames):
+        # Streams just the two columns instead of materialising every row;
+        # further files (enrollments.csv) add their rows to the same courses.
+        course_ids = []
+        marks = []
+        for name in (filename, *filenames):
+            for course_id, value in CSVHandler.iter_columns(name, ['Course.id', 'Marks']):
+                if value.isdigit():
+                    course_ids.append(course_id)
+                    marks.append(int(value))
+        return cls.from_columns(course_ids, marks)
+
+    @classmethod
+    def from_rows(cls, rows):
+        course_ids = []
+        marks = []
+        for row in rows:
+            value = str(row['Marks'])
+            if value.isdigit():
+                course_ids.append(row['Course.id'])
+                marks.append(int(value))
+        return cls.from_columns(course_ids, marks)
+
+    def summary(self):
+        """{course_id: {count, mean, median, std, min, max, p25.., grades}}"""
+        if not len(self.marks):
+            return {}
+        # Marks are small non-negative integers, so one bincount gives a
+        # per-course histogram from which every statistic is read off.
+        n = len(self.course_ids)
+        width = int(self.marks.max()) + 1
+        histogram = np.bincount(self.codes * width + self.marks,
+                                minlength=n * width).reshape(n, width)
+        cumulative = histogram.cumsum(axis=1)
+        counts = cumulative[:, -1]
+        values = np.arange(width, dtype=np.float64)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = histogram @ values / counts
+            stds = np.sqrt(np.maximum(histogram @ (values * values) / counts - means ** 2, 0))
+
+        def at_rank(rank):
+            # Smallest mark whose cumulative count reaches the 1-based rank.
+            return (cumulative < rank[:, None]).sum(axis=1)
+
+        columns = {
+            'median': at_rank(counts // 2 + 1),
+            'min': at_rank(np.ones_like(counts)),
+            'max': at_rank(counts),
+        }
+        for p in self.PERCENTILES:
+            columns[f'p{p}'] = at_rank(np.maximum(1, np.ceil(p / 100 * counts)).astype(np.int64))
+
+        letters = [gr['grade'] for gr in Grade.grade_ranges]
+        letter_of = np.array([letters.index(Grade.calculate_grade(m)) for m in range(width)])
+        grades = np.stack([histogram[:, letter_of == k].sum(axis=1)
+                           for k in range(len(letters))], axis=1)
+
+        result = {}
+        for i, course_id in enumerate(self.course_ids):
+            if not counts[i]:
+                continue
+            stats = {'count': int(counts[i]), 'mean': float(means[i]), 'std': float(stds[i])}
+            stats.update({name: int(column[i]) for name, column in columns.items()})
+            stats['grades'] = {g: int(c) for g, c in zip(letters, grades[i]) if c}
+            result[course_id] = stats
+        return result
+
+    @staticmethod
+    def display(summary):
+        print(f"\n{'Course':<10}{'Count':>8}{'Mean':>8}{'Median':>8}{'Std':>8}"
+              f"{'Min':>6}{'Max':>6}  Grades")
+        for course_id, st in sorted(summary.items()):
+            grades = ' '.join(f"{g}:{c}" for g, c in st['grades'].items())
+            print(f"{course_id:<10}{st['count']:>8}{st['mean']:>8.2f}{st['median']:>8}"
+                  f"{st['std']:>8.2f}{st['min']:>6}{st['max']:>6}  {grades}")
+
+class ReportBuilder:
+    """End-of-term grade reports for every student. Course aggregates are
+    computed in one pass over the roster; students are then rendered in
+    chunks on a process pool and streamed, in roster order, to one file per
+    course in the output directory."""
+    FORMATS = {'text': '.txt', 'csv': '.csv', 'json': '.jsonl'}
+    REPORT_FIELDS = ['Email address', 'First name', 'Last name', 'Course.id', 'grades', 'Marks',
+                     'Percentile', 'Course count', 'Course average', 'Course median',
+                     'Course min', 'Course max']
+    _aggregates = {}  # set in each worker process by _init_worker
+
+    def __init__(self, store, fmt='text', workers=None, chunk_size=2000):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown report format '{fmt}'")
+        self.store = store
+        self.fmt = fmt
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def course_aggregates(students):
+        """{course_id: {'count', 'average', 'median', 'min', 'max', 'marks'}}
+        with marks sorted, for the numeric marks of each course."""
+        marks = {}
+        for s in students:
+            value = str(s['Marks'])
+            bucket = marks.setdefault(s['Course.id'], [])
+            if value.isdigit():
+                bucket.append(int(value))
+        aggregates = {}
+        for course_id, course_marks in marks.items():
+            course_marks.sort()
+            count = len(course_marks)
+            aggregates[course_id] = {
+                'count': count,
+                'average': round(sum(course_marks) / count, 2) if count else None,
+                'median': course_marks[count // 2] if count else None,
+                'min': course_marks[0] if count else None,
+                'max': course_marks[-1] if count else None,
+                'marks': course_marks,
+            }
+        return aggregates
+
+    @staticmethod
+    def _init_worker(aggregates):
+        ReportBuilder._aggregates = aggregates
+
+    @staticmethod
+    def report(values, stats):
+        """Report fields for one student row given as a STUDENT_FIELDS tuple."""
+        report = dict(zip(CSVHandler.STUDENT_FIELDS, values))
+        marks = str(report['Marks'])
+        percentile = None
+        if marks.isdigit() and stats['marks']:
+            percentile = round(100 * bisect.bisect_left(stats['marks'], int(marks)) / stats['count'], 1)
+        report['Percentile'] = percentile
+        for name in ('count', 'average', 'median', 'min', 'max'):
+            report[f"Course {name}"] = stats[name]
+        return report
+
+    @staticmethod
+    def render_chunk(fmt, course_id, rows):
+        stats = ReportBuilder._aggregates[course_id]
+        reports = [ReportBuilder.report(values, stats) for values in rows]
+        if fmt == 'json':
+            return ''.join(json.dumps(r) + '\n' for r in reports)
+        if fmt == 'csv':
+            out = io.StringIO()
+            writer = csv.writer(out)
+            writer.writerows([r[f] for f in ReportBuilder.REPORT_FIELDS] for r in reports)
+            return out.getvalue()
+        return ''.join(
+            f"Student: {r['First name']} {r['Last name']} <{r['Email address']}>\n"
+            f"Course: {r['Course.id']}, Grade: {r['grades']}, Marks: {r['Marks']}"
+            + (f", Percentile: {r['Percentile']}" if r['Percentile'] is not None else '') + "\n"
+            f"Course average: {r['Course average']}, median: {r['Course median']}, "
+            f"min: {r['Course min']}, max: {r['Course max']} ({r['Course count']} marked)\n\n"
+            for r in reports)
+
+    def units(self, students):
+        """(course_id, rows) work units of at most chunk_size students, grouped
+        by course in first-seen order."""
+        by_course = {}
+        for s in students:
+            by_course.setdefault(s['Course.id'], []).append(tuple(s[f] for f in CSVHandler.STUDENT_FIELDS))
+        for course_id, rows in by_course.items():
+            for start in range(0, len(rows), self.chunk_size):
+                yield course_id, rows[start:start + self.chunk_size]
+
+    @staticmethod
+    def file_name(course_id, taken=()):
+        """course_id with anything but letters, digits, '-' and '_' replaced,
+        numbered when that name is in taken (lower-cased names) already."""
+        safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(course_id)) or 'no_course'
+        name, number = safe, 1
+        while name.lower() in taken:
+            number += 1
+            name = f"{safe}_{number}"
+        return name
+
+    def build(self, out_dir, progress=True):
+        """Write every report; returns {'students', 'courses', 'files', 'seconds'}."""
+        start = time.perf_counter()
+        students = self.store.all_enrollments()
+        aggregates = self.course_aggregates(students)
+        units = list(self.units(students))
+        os.makedirs(out_dir, exist_ok=True)
+
+        args = ([self.fmt] * len(units), [u[0] for u in units], [u[1] for u in units])
+        if self.workers > 1 and len(units) > 1:
+            pool = ProcessPoolExecutor(self.workers, initializer=ReportBuilder._init_worker,
+                                       initargs=(aggregates,))
+            rendered = pool.map(ReportBuilder.render_chunk, *args)
+        else:
+            pool = None
+            ReportBuilder._init_worker(aggregates)
+            rendered = map(ReportBuilder.render_chunk, *args)
+
+        files, taken, done, current, f = [], set(), 0, None, None
+        try:
+            for (course_id, rows), text in zip(units, rendered):
+                if course_id != current:
+                    if f:
+                        f.close()
+                    current = course_id
+                    name = self.file_name(course_id, taken)
+                    taken.add(name.lower())
+                    path = os.path.join(out_dir, name + self.FORMATS[self.fmt])
+                    f = open(path, 'w', newline='')
+                    files.append(path)
+                    if self.fmt == 'csv':
+                        csv.writer(f).writerow(self.REPORT_FIELDS)
+                f.write(text)
+                done += len(rows)
+                if progress:
+                    print(f"\rRendered {done}/{len(students)} reports", end='', flush=True)
+        finally:
+            if f:
+                f.close()
+            if pool:
+                pool.shutdown()
+        if progress:
+            print()
+        return {'students': done, 'courses': len(files), 'files': files,
+                'seconds': time.perf_counter() - start}
+
 class Student:
     def __init__(self, app):
         self.app = app
 
+    @Metrics.timed('menu.display_records')
     def display_records(self, email):
-        students = CSVHandler.load_students()
-        student = next((s for s in students if s['Email address'] == email), None)
-        if student:
-            print("\nStudent Record:")
-            for key, value in student.items():
-                print(f"{key}: {value}")
-        else:
-            print("Student not found!")
+        try:
+            student = self.app.service.get_student(email)
+        except ServiceError as e:
+            print(e)
+            return
+        print("\nStudent Record:")
+        for key, value in student.items():
+            print(f"{key}: {value}")
+        courses = self.app.service.student_courses(email)
+        if len(courses) > 1:
+            print("Courses: " + ", ".join(f"{c['Course.id']} ({c['grades']}, {c['Marks']})" for c in courses))
 
+    @Metrics.timed('menu.add_new_student')
     def add_new_student(self):
         email = input("Enter student email: ")
-        students = CSVHandler.load_students()
-        if any(s['Email address'] == email for s in students):
+        if email in self.app.store.students:
             print("Student already exists!")
             return
 
@@ -170,38 +3067,27 @@ class Student:
             return
 
         marks = input("Initial Marks: ")
-        grade = Grade.calculate_grade(int(marks))
-
-        students.append({
-            'Email address': email,
-            'First name': first_name,
-            'Last name': last_name,
-            'Course.id': course_id,
-            'grades': grade,
-            'Marks': marks
-        })
-
-        CSVHandler.save_students(students)
-        LoginUser.add_to_login(email, "student")
+        try:
+            self.app.service.add_student(email, first_name, last_name, course_id, marks)
+        except ServiceError as e:
+            print(e)
+            return
         print("Student added successfully!")
 
 
     def delete_new_student(self, email):
-        students = CSVHandler.load_students()
-        students = [s for s in students if s['Email address'] != email]
-        CSVHandler.save_students(students)
-
-        login_data = CSVHandler.load_login()
-        login_data = [u for u in login_data if u['User id'] != email]
-        CSVHandler.save_login(login_data)
+        try:
+            self.app.service.delete_student(email)
+        except ServiceError as e:
+            print(e)
+            return
 
         print(f"Student '{email}' deleted successfully from students.csv and login.csv!")
 
         
+    @Metrics.timed('menu.update_student_record')
     def update_student_record(self, email):
-        students = CSVHandler.load_students()
-        student = next((s for s in students if s['Email address'] == email), None)
-        if not student:
+        if email not in self.app.store.students:
             print("Student not found!")
             return
 
@@ -213,20 +3099,22 @@ class Student:
         choice = input("Select field to update: ")
 
         if choice == '1':
-            student['First name'] = input("New first name: ")
+            changes = {'first_name': input("New first name: ")}
         elif choice == '2':
-            student['Last name'] = input("New last name: ")
+            changes = {'last_name': input("New last name: ")}
         elif choice == '3':
-            student['Course.id'] = input("New course ID: ")
+            changes = {'course_id': input("New course ID: ")}
         elif choice == '4':
-            marks = int(input("New marks: "))
-            student['Marks'] = marks
-            student['grades'] = Grade.calculate_grade(marks)
+            changes = {'marks': input("New marks: ")}
         else:
             print("Invalid choice!")
             return
 
-        CSVHandler.save_students(students)
+        try:
+            self.app.service.update_student(email, **changes)
+        except ServiceError as e:
+            print(e)
+            return
         print("Record updated successfully!")
 
 class Course:
@@ -235,8 +3123,7 @@ class Course:
         
     @staticmethod
     def get_available_courses():
-        courses = CSVHandler.load_courses()
-        return [c['Course_id'] for c in courses]
+        return DataStore.get().courses.keys()
 
     @staticmethod
     def select_course():
@@ -250,18 +3137,17 @@ class Course:
         choice = int(input("Select course number: ")) - 1
         return courses[choice] if 0 <= choice < len(courses) else None
         
+    @Metrics.timed('menu.display_courses')
     def display_courses(self):
-        courses = CSVHandler.load_courses()
         print("\nAvailable Courses:")
-        for course in courses:
+        for course in self.app.service.list_courses():
             print(f"{course['Course_id']}: {course['Course_name']} ({course['Credits']} credits)")
 
-    def add_new_course(self):
+    @Metrics.timed('menu.add_new_course')
+    def add_new_course(self, professor=None):
 
         course_id = input("Course ID: ")
-        courses = CSVHandler.load_courses()
-
-        if any(c['Course_id'] == course_id for c in courses):
+        if course_id in self.app.store.courses:
             print(f"Course '{course_id}' already exists!")
             return  
 
@@ -269,29 +3155,37 @@ class Course:
         credits = input("Credits: ")
         desc = input("Description: ")
 
-        courses.append({
-            'Course_id': course_id,
-            'Course_name': name,
-            'Credits': credits,
-            'Description': desc
-        })
-        CSVHandler.save_courses(courses)
+        try:
+            self.app.service.add_course(course_id, name, credits, desc, professor=professor)
+        except ServiceError as e:
+            print(e)
+            return False
         print(f"Course '{course_id}' added successfully!")
+        return True
 
+    @Metrics.timed('menu.delete_course')
     def delete_new_course(self, course_id):
-        courses = CSVHandler.load_courses()
-        courses = [c for c in courses if c['Course_id'] != course_id]
-        CSVHandler.save_courses(courses)
+        try:
+            self.app.service.delete_course(course_id)
+        except IntegrityError as e:
+            print(e)
+            if input("Delete its students and unassign its professors? (Y/N): ").lower() != 'y':
+                return
+            changed = self.app.service.delete_course(course_id, cascade=True)
+            print(f"Removed {changed.get('students', 0)} student(s), "
+                  f"unassigned {changed.get('professors', 0)} professor(s).")
+        except ServiceError as e:
+            print(e)
+            return
         print("Course deleted successfully!")
 
 class Professor:
     def __init__(self, app):
         self.app = app
         
+    @Metrics.timed('menu.modify_professor_course')
     def modify_professor_course(self, email):
-        professors = CSVHandler.load_professors()
-        prof = next((p for p in professors if p['Professor_id'] == email), None)
-        if not prof:
+        if email not in self.app.store.professors:
             print("Professor not found!")
             return
 
@@ -304,17 +3198,12 @@ class Professor:
             if choice == '1':
                 course_id = Course.select_course()
                 if course_id:
-                    prof['Course.id'] = course_id
-                    CSVHandler.save_professors(professors)
+                    self.app.service.assign_course(email, course_id)
                     print("Course assignment updated!")
                 return
 
             elif choice == '2':
-                self.app.course.add_new_course()
-                new_courses = CSVHandler.load_courses()
-                if new_courses:
-                    prof['Course.id'] = new_courses[-1]['Course_id']
-                    CSVHandler.save_professors(professors)
+                if self.app.course.add_new_course(professor=email):
                     print("Automatically assigned to new course!")
                 return
 
@@ -323,65 +3212,58 @@ class Professor:
             else:
                 print("Invalid choice!")
                 
+    @Metrics.timed('menu.professor_details')
     def professors_details(self, professor_id):
-        professors = CSVHandler.load_professors()
-        prof = next((p for p in professors if p['Professor_id'] == professor_id), None)
-        if prof:
-            print("\nProfessor Details:")
-            for key, value in prof.items():
-                print(f"{key}: {value}")
-        else:
-            print("Professor not found!")
+        try:
+            prof = self.app.service.get_professor(professor_id)
+        except ServiceError as e:
+            print(e)
+            return
+        print("\nProfessor Details:")
+        for key, value in prof.items():
+            print(f"{key}: {value}")
 
+    @Metrics.timed('menu.add_new_professor')
     def add_new_professor(self):
         email = input("Professor email: ")
-        professors = CSVHandler.load_professors()
-
-        if any(p['Professor_id'] == email for p in professors):
+        if email in self.app.store.professors:
             print(f"Professor '{email}' already exists!")
             return  
         name = input("Full name: ")
         rank = input("Rank (Junior/Senior/Associate): ")
-        course = input("Course ID: ")
+        courses = Course.get_available_courses()
+        print("Available Courses: " + ", ".join(f"{i}. {c}" for i, c in enumerate(courses, 1)))
+        course = input("Course ID or number: ")
+        if course not in courses and course.isdigit() and 1 <= int(course) <= len(courses):
+            course = courses[int(course) - 1]
 
-        professors.append({
-            'Professor_id': email,
-            'Professor Name': name,
-            'Rank': rank,
-            'Course.id': course
-        })
-        CSVHandler.save_professors(professors)
-        LoginUser.add_to_login(email, "professor")
+        try:
+            self.app.service.add_professor(email, name, rank, course)
+        except ServiceError as e:
+            print(e)
+            return
         print(f"Professor '{email}' added successfully!")
 
 
+    @Metrics.timed('menu.delete_professor')
     def delete_professor(self, professor_id):
-        professors = CSVHandler.load_professors()
-        professors = [p for p in professors if p['Professor_id'] != professor_id]
-        CSVHandler.save_professors(professors)
-
-        login_data = CSVHandler.load_login()
-        login_data = [u for u in login_data if u['User id'] != professor_id]
-        CSVHandler.save_login(login_data)
+        self.app.service.delete_professor(professor_id)
 
         print(f"Professor '{professor_id}' deleted successfully from professors.csv and login.csv!")
 
+    @Metrics.timed('menu.course_details')
     def show_course_details_by_professor(self, professor_id):
-        professors = CSVHandler.load_professors()
-        prof = next((p for p in professors if p['Professor_id'] == professor_id), None)
-        if not prof:
-            print("Professor not found!")
+        service = self.app.service
+        try:
+            courses = [service.get_course(c) for c in service.professor_courses(professor_id)]
+        except ServiceError as e:
+            print(e)
             return
-
-        course_id = prof['Course.id']
-        courses = CSVHandler.load_courses()
-        course = next((c for c in courses if c['Course_id'] == course_id), None)
-        if course:
+        for course in courses:
             print("\nCourse Details:")
             for key, value in course.items():
                 print(f"{key}: {value}")
-        else:
-            print("Course not found!")
+
     def update_professor_course(self, email):
         courses = Course.get_available_courses()
         if not courses:
@@ -393,37 +3275,66 @@ class Professor:
             print(f"- {c}")
             
         new_course = input("Enter course ID from list above: ")
-        if new_course not in courses:
-            print("Invalid course selection!")
+        try:
+            self.app.service.assign_course(email, new_course)
+        except ServiceError as e:
+            print(e)
             return
+        print("Course assignment updated!")
 
-        professors = CSVHandler.load_professors()
-        prof = next((p for p in professors if p['Professor_id'] == email), None)
-        if prof:
-            prof['Course.id'] = new_course
-            CSVHandler.save_professors(professors)
-            print("Course assignment updated!")
     def assign_student_grade(self, student_email):
-        students = CSVHandler.load_students()
-        student = next((s for s in students if s['Email address'] == student_email), None)
-
-        if student:
-            marks = int(input(f"Enter marks (0-100) for {student_email}: "))
-            grade = ('A' if marks >= 90 else 'B' if marks >= 80 else 'C' if marks >= 70 else 'D' if marks >= 60 else 'F')
-
-            student['Marks'] = marks
-            student['grades'] = grade
-            CSVHandler.save_students(students)
-            print(f"Student '{student_email}' updated to Marks: {marks}, Grade: {grade}.")
-        else:
+        if student_email not in self.app.store.students:
             print(f"Student '{student_email}' not found!")
-
-
+            return
+        marks = input(f"Enter marks (0-100) for {student_email}: ")
+        try:
+            student = self.app.service.set_marks(student_email, marks)
+        except ServiceError as e:
+            print(e)
+            return
+        print(f"Student '{student_email}' updated to Marks: {student['Marks']}, Grade: {student['grades']}.")
 
 
             
 class LoginUser:
+    # Only used to read Caesar entries, which are rehashed on login. Entries
+    # written by rotate_cipher are 'caesar$<shift>$<text>'; bare ones use this.
     cipher = TextSecurity(shift=3)
+    CAESAR_PREFIX = 'caesar$'
+    verified = VerificationCache()
+
+    @staticmethod
+    def caesar_parts(stored):
+        """(TextSecurity, ciphertext) for a Caesar password entry."""
+        if stored.startswith(LoginUser.CAESAR_PREFIX):
+            _, shift, text = stored.split('$', 2)
+            return TextSecurity(int(shift)), text
+        return LoginUser.cipher, stored
+
+    @staticmethod
+    @Metrics.timed('auth.rotate_cipher')
+    def rotate_cipher(new_shift, filename='login.csv'):
+        """Re-encrypt every Caesar entry in login.csv with new_shift in one
+        streaming pass and a single atomic rewrite; hashed entries are kept.
+        Returns the number of entries re-encrypted."""
+        target = TextSecurity(new_shift)
+        rotated = 0
+
+        def rotate(row):
+            nonlocal rotated
+            stored = row['Password']
+            if PasswordHasher.is_hashed(stored):
+                return row
+            cipher, text = LoginUser.caesar_parts(stored)
+            row['Password'] = f"{LoginUser.CAESAR_PREFIX}{target.shift}${target.encrypt(cipher.decrypt(text))}"
+            rotated += 1
+            return row
+
+        with CSVHandler.locked(filename):
+            rows = CSVHandler.iter_rows(filename)
+            CSVHandler.save_data(filename, (rotate(row) for row in rows), CSVHandler.LOGIN_FIELDS)
+        LoginUser.verified.clear()
+        return rotated
 
     @staticmethod
     def encrypt_password(password):
@@ -433,97 +3344,105 @@ class LoginUser:
     def decrypt_password(encrypted_password):
         return LoginUser.cipher.decrypt(encrypted_password)
 
+    @staticmethod
+    def hash_password(password):
+        return PasswordHasher.hash(password)
+
+    @staticmethod
+    @Metrics.timed('auth.check_password')
+    def check_password(email, password, stored):
+        """True when password matches the stored entry. Reads and writes no
+        table, so it is safe to run on a worker thread."""
+        if LoginUser.verified.check(email, stored, password):
+            return True
+        if PasswordHasher.is_hashed(stored):
+            return PasswordHasher.verify(password, stored)
+        cipher, text = LoginUser.caesar_parts(stored)
+        return hmac.compare_digest(cipher.encrypt(password).encode(), text.encode())
+
+    @staticmethod
+    @Metrics.timed('auth.verify_password')
+    def verify_password(email, password, stored, store=None):
+        """Check password against the stored entry. A legacy Caesar entry that
+        matches is replaced by a salted hash."""
+        if not LoginUser.check_password(email, password, stored):
+            return False
+
+        if PasswordHasher.needs_rehash(stored):
+            stored = PasswordHasher.hash(password)
+            (store or DataStore.get()).login.update(email, {'Password': stored})
+        LoginUser.verified.add(email, stored, password)
+        return True
+
     @staticmethod
     def display_encrypted_and_decrypted_password(email):
-        login_data = CSVHandler.load_login()
-        user = next((u for u in login_data if u['User id'] == email), None)
+        user = DataStore.get().login.get(email)
         if user:
             encrypted_pass = user['Password']
-            decrypted_pass = LoginUser.decrypt_password(encrypted_pass)
             print(f"Encrypted password: {encrypted_pass}")
-            print(f"Decrypted password: {decrypted_pass}")
+            if PasswordHasher.is_hashed(encrypted_pass):
+                print("Decrypted password: unavailable (stored as a salted hash)")
+            else:
+                cipher, text = LoginUser.caesar_parts(encrypted_pass)
+                print(f"Decrypted password: {cipher.decrypt(text)}")
         else:
             print("User not found!")
+
     @staticmethod
-    #def encrypt_password(password):
-     #   return hashlib.sha256(password.encode()).hexdigest()
-    @staticmethod
-    def add_to_login(email, role):
-        login_data = CSVHandler.load_login()
-        if not any(user['User id'] == email for user in login_data):
-            login_data.append({
-                'User id': email,
-                'Password': LoginUser.encrypt_password("default"),
-                'Role': role
-            })
-            CSVHandler.save_login(login_data)
+    def add_to_login(email, role, store=None):
+        (store or DataStore.get()).login.insert({
+            'User id': email,
+            'Password': LoginUser.hash_password("default"),
+            'Role': role
+        })
 
     @staticmethod
     def register_new_user(email, role):
 
-        login_data = CSVHandler.load_login()
-        if any(u['User id'] == email for u in login_data):
+        service = GradeService(DataStore.get())
+        if email in service.store.login:
             print(f"User '{email}' already exists in login.csv!")
             return False
 
         password = input("Set your password: ")
-        encrypted_pass = LoginUser.encrypt_password(password)
-        login_data.append({'User id': email, 'Password': encrypted_pass, 'Role': role})
-        CSVHandler.save_login(login_data)
 
         if role == 'student':
             first_name = input("First name: ")
             last_name = input("Last name: ")
             course_id = Course.select_course()
-            student_data = CSVHandler.load_students()
-            new_student = {
-                'Email address': email,
-                'First name': first_name,
-                'Last name': last_name,
-                'Course.id': course_id,
-                'grades': 'Unavailable',
-                'Marks': 'Unavailable'
-            }
-            student_data.append(new_student)
-            CSVHandler.save_students(student_data)
+            service.register(email, password, role, first_name, last_name, course_id=course_id)
             print(f"Student '{email}' added successfully to students.csv and login.csv!")
 
         elif role == 'professor':
             prof_name = input("Professor Name: ")
             rank = input("Rank: ")
             course_id = Course.select_course()
-
-            professor_data = CSVHandler.load_professors()
-            professor_data.append({
-                'Professor_id': email,
-                'Professor Name': prof_name,
-                'Rank': rank,
-                'Course.id': course_id
-            })
-            CSVHandler.save_professors(professor_data)
+            service.register(email, password, role, prof_name, rank=rank, course_id=course_id)
             print(f"Professor '{email}' added successfully to professors.csv and login.csv!")
 
         return True
         
     @staticmethod
+    @Metrics.timed('menu.login')
     def login():
 
         email = input("Email: ")
-        login_data = CSVHandler.load_login()
-        user = next((u for u in login_data if u['User id'] == email), None)
+        service = GradeService(DataStore.get())
 
-        if user:
+        if email in service.store.login:
             password = input("Password: ")
-            if LoginUser.decrypt_password(user['Password']) == password:
-                print(f"Existing {user['Role']} login successful for user '{email}'!")
-                return user['Role'], email
-            print("Invalid password!")
-            return None, None
+            try:
+                user = service.authenticate(email, password)
+            except ServiceError:
+                print("Invalid password!")
+                return None, None
+            print(f"Existing {user['role']} login successful for user '{email}'!")
+            return user['role'], email
         else:
             print("New user detected! Let's create an account.")
             while True:
                 role = input("Choose role (student/professor): ").lower()
-                if role in ['student', 'professor']:
+                if role in GradeService.ROLES:
                     break
                 print("Invalid role! Please choose student or professor.")
 
@@ -534,23 +3453,1091 @@ class LoginUser:
             return None, None
     
     @staticmethod
+    @Metrics.timed('menu.change_password')
     def change_password(email):
         old_pass = input("Current password: ")
-        login_data = CSVHandler.load_login()
-        user = next((u for u in login_data if u['User id'] == email), None)
-
-        if not user or user['Password'] != LoginUser.encrypt_password(old_pass):
+        service = GradeService(DataStore.get())
+        try:
+            service.authenticate(email, old_pass)
+        except ServiceError:
             print("Invalid password!")
             return
 
         new_pass = input("New password: ")
-        old_encrypted = user['Password']
-        user['Password'] = LoginUser.encrypt_password(new_pass)
-        CSVHandler.save_login(login_data)
-        print(f"Password changed from '{old_encrypted}' to '{user['Password']}' successfully!")
+        service.change_password(email, old_pass, new_pass)
+        print("Password changed successfully!")
         
+class Session:
+    """What authorization checks need about a logged-in user, captured once
+    at login: role, the professor's Course.id (their own course) and every
+    course they teach, and the student's row key."""
+    __slots__ = ('token', 'email', 'role', 'course_id', 'course_ids', 'student_key', 'expires', 'stamp')
+
+    def __init__(self, token, email, role, expires):
+        self.token = token
+        self.email = email
+        self.role = role
+        self.course_id = None
+        self.course_ids = ()
+        self.student_key = None
+        self.expires = expires
+        self.stamp = None
+
+    def to_dict(self, now):
+        return {'token': self.token, 'email': self.email, 'role': self.role,
+                'course_id': self.course_id, 'course_ids': list(self.course_ids),
+                'expires_in': max(0, round(self.expires - now))}
+
+class SessionManager:
+    """Sessions by token. A session is dropped when its TTL runs out, and is
+    re-checked against the login, professors and teaching tables only when
+    their version has moved since it was stamped, so a check on an unchanged
+    session is a dict lookup and two comparisons. The files behind those
+    tables are looked at for writes by other processes at most once every
+    RECHECK seconds."""
+    TTL = 30 * 60
+    RECHECK = 1
+
+    def __init__(self, store, ttl=TTL, clock=time.monotonic, recheck=RECHECK):
+        self.store = store
+        self.ttl = ttl
+        self.clock = clock
+        self.recheck = recheck
+        self.sessions = {}
+        self._next_sweep = clock() + ttl
+        self._next_check = clock()
+
+    def _tables(self):
+        return self.store.login, self.store.professors, self.store.teaching
+
+    def _stamp(self):
+        return tuple(table.version for table in self._tables())
+
+    def _current_stamp(self, now):
+        if now >= self._next_check:
+            self._next_check = now + self.recheck
+            for table in self._tables():
+                table.refresh()
+        return self._stamp()
+
+    def _fill(self, session):
+        """Re-read what the session caches; False when the user is gone or
+        their role has changed."""
+        user = self.store.login.get(session.email)
+        if not user or user['Role'] != session.role:
+            return False
+        if session.role == 'professor':
+            professor = self.store.professors.get(session.email)
+            session.course_id = professor['Course.id'] if professor else None
+            session.course_ids = tuple(self.store.courses_taught(session.email))
+        else:
+            student = self.store.students.get(session.email)
+            session.student_key = student['Email address'] if student else None
+            session.course_id = student['Course.id'] if student else None
+        session.stamp = self._stamp()
+        return True
+
+    def issue(self, email, role):
+        now = self.clock()
+        if now >= self._next_sweep:
+            self.sessions = {t: s for t, s in self.sessions.items() if s.expires > now}
+            self._next_sweep = now + self.ttl
+        session = Session(secrets.token_urlsafe(32), email, role, now + self.ttl)
+        if not self._fill(session):
+            raise ServiceError("Invalid email or password!")
+        self._next_check = now + self.recheck  # _fill has just read the tables
+        self.sessions[session.token] = session
+        return session
+
+    def get(self, token):
+        """The live Session for token, or None."""
+        session = self.sessions.get(token)
+        if session is None:
+            return None
+        now = self.clock()
+        if now >= session.expires or (session.stamp != self._current_stamp(now)
+                                      and not self._fill(session)):
+            del self.sessions[token]
+            return None
+        return session
+
+    def invalidate(self, token):
+        self.sessions.pop(token, None)
+
+    def invalidate_user(self, email):
+        self.sessions = {t: s for t, s in self.sessions.items() if s.email != email}
+
+class ServiceError(ValueError):
+    """A request GradeService refused; the message is meant for the user."""
+
+class SessionExpired(ServiceError):
+    """The session token is unknown, expired or no longer valid."""
+
+class AccessDenied(ServiceError):
+    """The session's user may not act on this record."""
+
+class NotFound(ServiceError):
+    """The record asked for does not exist (or is not visible to the user)."""
+
+class IntegrityError(ServiceError):
+    """A write would leave a reference to a row that does not exist."""
+
+class Relations:
+    """The foreign keys between the store's tables, checked through the
+    primary-key and secondary indexes:
+
+        students.Course.id, professors.Course.id -> courses.Course_id
+        enrollments.Course.id, teaching.Course.id -> courses.Course_id
+        enrollments.Email address -> students.Email address
+        teaching.Professor_id -> professors.Professor_id
+        login.User id <-> students.Email address / professors.Professor_id
+
+    A login row and the student or professor row with the same id are one
+    account and are always deleted together, with the account's enrollments
+    or teaching rows. Deleting a course is refused while anything refers to
+    it, unless cascade is set: then its enrollments and teaching rows are
+    deleted, and a student or professor whose own row holds the course gets
+    their next enrollments or teaching course moved onto it instead. Students
+    with no other course are deleted (with their logins); professors with no
+    other course are unassigned.
+
+    A delete is planned first and then committed as one UnitOfWork, with at
+    most one write per table."""
+    NO_COURSE = ('', 'TBD', None)
+    FOREIGN_KEYS = (  # child table, field, parent table, cascade action
+        ('students', 'Course.id', 'courses', 'delete'),
+        ('professors', 'Course.id', 'courses', 'unassign'),
+        ('enrollments', 'Course.id', 'courses', 'delete'),
+        ('teaching', 'Course.id', 'courses', 'delete'),
+        ('enrollments', 'Email address', 'students', 'delete'),
+        ('teaching', 'Professor_id', 'professors', 'delete'),
+    )
+    ACCOUNTS = {'student': 'students', 'professor': 'professors'}
+    # Where the courses beyond the one on a row are kept: link table, its
+    # field holding the row's key, and the fields moved onto the row.
+    LINKS = {
+        'students': ('enrollments', 'Email address', ('Course.id', 'grades', 'Marks')),
+        'professors': ('teaching', 'Professor_id', ('Course.id',)),
+    }
+
+    def __init__(self, store):
+        self.store = store
+
+    def table(self, name):
+        return getattr(self.store, name)
+
+    def check(self, name, row):
+        """Messages for each foreign key of row (a row of table name) that
+        points at nothing."""
+        problems = []
+        for child, field, parent, _ in self.FOREIGN_KEYS:
+            value = row.get(field)
+            if child == name and value not in self.NO_COURSE and value not in self.table(parent):
+                problems.append(f"{field} '{value}' is not in {parent}")
+        return problems
+
+    def validate(self, name, row):
+        problems = self.check(name, row)
+        if problems:
+            raise IntegrityError("; ".join(problems) + "!")
+
+    def violations(self):
+        """(table, key, problem) for every dangling reference and every
+        account missing its login or its student/professor row."""
+        found = []
+        for child, field, parent, _ in self.FOREIGN_KEYS:
+            table, parent_table = self.table(child), self.table(parent)
+            for value in table.values(field):
+                if value not in self.NO_COURSE and value not in parent_table:
+                    found.extend((child, row[table.key], f"{field} '{value}' is not in {parent}")
+                                 for row in table.find(field, value))
+        login = self.store.login
+        for user in login.all():
+            name = self.ACCOUNTS.get(user['Role'])
+            if name and user['User id'] not in self.table(name):
+                found.append(('login', user['User id'], f"no {user['Role']} row"))
+        for name in self.ACCOUNTS.values():
+            table = self.table(name)
+            for key in table.keys():
+                if key not in login:
+                    found.append((name, key, "no login"))
+        return found
+
+    def plan_delete(self, name, key, cascade=False):
+        """{table: {'delete': [keys], 'update': {key: changes}}} for deleting
+        one row with everything that depends on it."""
+        plan, deleted = {}, set()
+
+        def steps(table):
+            return plan.setdefault(table, {'delete': [], 'update': {}})
+
+        def move_next_course(table, row_key, course_id):
+            # Move the row's next linked course onto it; False without one.
+            links, field, moved = self.LINKS[table]
+            link_key = self.table(links).key
+            others = [link for link in self.table(links).find(field, row_key)
+                      if link['Course.id'] != course_id and (links, link[link_key]) not in deleted]
+            if not others:
+                return False
+            steps(table)['update'][row_key] = {f: others[0][f] for f in moved}
+            delete(links, others[0][link_key])
+            return True
+
+        def delete(table, row_key):
+            if (table, row_key) in deleted:
+                return
+            deleted.add((table, row_key))
+            steps(table)['delete'].append(row_key)
+            if table in self.ACCOUNTS.values() and row_key in self.store.login:
+                delete('login', row_key)
+            for child, field, parent, action in self.FOREIGN_KEYS:
+                if parent != table:
+                    continue
+                child_key = self.table(child).key
+                for row in self.table(child).find(field, row_key):
+                    if child in self.LINKS and move_next_course(child, row[child_key], row_key):
+                        continue
+                    if action == 'delete':
+                        delete(child, row[child_key])
+                    else:
+                        steps(child)['update'][row[child_key]] = {field: 'TBD'}
+
+        if key not in self.table(name):
+            return plan
+        if name == 'courses' and not cascade:
+            used = [f"{count} {child}" for child, field, parent, _ in self.FOREIGN_KEYS if parent == name
+                    for count in [len(self.table(child).find(field, key))] if count]
+            if used:
+                raise IntegrityError(f"Course '{key}' is still used by {' and '.join(used)}!")
+        if name == 'login':
+            account = self.ACCOUNTS.get(self.store.login.get(key)['Role'])
+            if account and key in self.table(account):
+                name = account
+        delete(name, key)
+        return plan
+
+    def apply(self, plan):
+        """Apply a plan as one transaction; returns {table: rows changed}."""
+        with UnitOfWork(self.store) as tx:
+            for name, steps in plan.items():
+                for key, changes in steps['update'].items():
+                    tx.update(name, key, changes)
+                for key in steps['delete']:
+                    tx.delete(name, key)
+        return {name: len(steps['update']) + len(steps['delete']) for name, steps in plan.items()}
+
+    def delete(self, name, key, cascade=False):
+        return self.apply(self.plan_delete(name, key, cascade))
+
+class UnitOfWork:
+    """Inserts, updates and deletes across the store's tables, staged in
+    memory and committed together:
+
+        with store.transaction() as tx:
+            tx.insert('login', {...})
+            tx.insert('students', {...})
+
+    Reads through the unit of work see its own staged changes. On a clean
+    exit the changes are checked against the foreign keys and written with
+    one write per changed table (all or nothing: see CSVStore.commit_changes);
+    if the block raises, nothing is written."""
+    TABLES = ('enrollments', 'teaching', 'students', 'professors', 'login', 'courses')  # children first
+
+    def __init__(self, store):
+        self.store = store
+        self.changes = {name: {} for name in self.TABLES}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def table(self, name):
+        return getattr(self.store, name)
+
+    def get(self, name, key):
+        staged = self.changes[name]
+        if key in staged:
+            return staged[key]
+        row = self.table(name).get(key)
+        return dict(row) if row is not None else None
+
+    def find(self, name, field, value):
+        staged = self.changes[name]
+        key = self.table(name).key
+        rows = [dict(row) for row in self.table(name).find(field, value) if row[key] not in staged]
+        return rows + [row for row in staged.values() if row is not None and row[field] == value]
+
+    def insert(self, name, row):
+        table = self.table(name)
+        key = row[table.key]
+        if self.get(name, key) is not None:
+            raise ServiceError(f"'{key}' already exists in {name}!")
+        self.changes[name][key] = {f: row.get(f) for f in table.fieldnames}
+        return self.changes[name][key]
+
+    def update(self, name, key, changes):
+        row = self.get(name, key)
+        if row is None:
+            raise NotFound(f"'{key}' not found in {name}!")
+        row = dict(row, **changes)
+        self.changes[name][key] = row
+        return row
+
+    def delete(self, name, key):
+        if self.get(name, key) is None:
+            raise NotFound(f"'{key}' not found in {name}!")
+        self.changes[name][key] = None
+
+    def problems(self):
+        """Foreign keys the staged changes would break."""
+        found = []
+        for child, field, parent, _ in Relations.FOREIGN_KEYS:
+            for key, row in self.changes[child].items():
+                value = row and row[field]
+                if row is not None and value not in Relations.NO_COURSE and self.get(parent, value) is None:
+                    found.append(f"{child} '{key}': {field} '{value}' is not in {parent}")
+            for key, row in self.changes[parent].items():
+                users = self.find(child, field, key) if row is None else []
+                if users:
+                    parent_name = 'Course' if parent == 'courses' else parent
+                    found.append(f"{parent_name} '{key}' is still used by {len(users)} {child}")
+        for role, name in Relations.ACCOUNTS.items():
+            for key, row in self.changes[name].items():
+                if (row is None) != (self.get('login', key) is None):
+                    found.append(f"{name} '{key}' and its login must be added or deleted together")
+        for key, row in self.changes['login'].items():
+            name = Relations.ACCOUNTS.get(row['Role']) if row else None
+            if name and key not in self.changes[name] and self.get(name, key) is None:
+                found.append(f"login '{key}' has no {row['Role']} row")
+        return found
+
+    def commit(self):
+        """Validate and write the staged changes; returns {table: rows changed}."""
+        dirty = {name: changes for name, changes in self.changes.items() if changes}
+        if not dirty:
+            return {}
+        with self.store.locked(dirty):
+            problems = self.problems()
+            if problems:
+                raise IntegrityError("; ".join(problems) + "!")
+            self.store.commit_changes(dirty)
+        self.changes = {name: {} for name in self.TABLES}
+        return {name: len(changes) for name, changes in dirty.items()}
+
+class GradeService:
+    """The app's operations without any console I/O. Every method takes plain
+    values, returns plain dicts (or raises ServiceError), so the console menus,
+    batch jobs, tests and servers all drive the same code."""
+    STUDENT_FIELDS = {'first_name': 'First name', 'last_name': 'Last name',
+                      'course_id': 'Course.id', 'marks': 'Marks'}
+    ROLES = ('student', 'professor')
+
+    def __init__(self, store, session_ttl=SessionManager.TTL):
+        self.store = store
+        self.sessions = SessionManager(store, session_ttl)
+        self.relations = Relations(store)
+
+    @staticmethod
+    def _marks(marks):
+        text = str(marks).strip()
+        if not (text.isdigit() and 0 <= int(text) <= 100):
+            raise ServiceError(f"Marks must be a whole number from 0 to 100, got '{marks}'!")
+        return int(text)
+
+    def _student(self, email, course_id=None):
+        """The student's row, as it reads for course_id when given."""
+        student = self.store.students.get(email)
+        if not student:
+            raise NotFound("Student not found!")
+        if course_id is not None and student['Course.id'] != course_id:
+            student = self.store.enrollment(email, course_id)
+            if not student:
+                raise NotFound("Student not found in your course!")
+        return student
+
+    # Accounts
+    def authenticate(self, email, password):
+        """{'email', 'role'} for valid credentials."""
+        user = self.store.login.get(email)
+        if not user or not LoginUser.verify_password(email, password, user['Password'], self.store):
+            raise ServiceError("Invalid email or password!")
+        return {'email': email, 'role': user['Role']}
+
+    def login(self, email, password):
+        """Authenticate and open a Session."""
+        user = self.authenticate(email, password)
+        return self.sessions.issue(email, user['role'])
+
+    def session(self, token):
+        session = self.sessions.get(token)
+        if session is None:
+            raise SessionExpired("Session expired, please login again!")
+        return session
+
+    def logout(self, token):
+        self.sessions.invalidate(token)
+
+    def session_course(self, session, course_id=None):
+        """Course.id a professor's session may grade: course_id when they
+        teach it, otherwise their own course."""
+        if session.role != 'professor':
+            raise AccessDenied("Only professors can do this!")
+        if not session.course_ids:
+            raise ServiceError("You must be assigned to a course first!")
+        if course_id is None:
+            return session.course_ids[0]
+        if course_id not in session.course_ids:
+            raise AccessDenied(f"You do not teach {course_id}!")
+        return course_id
+
+    def shared_course(self, session, email):
+        """The first of the professor's courses the student is enrolled in."""
+        self.session_course(session)
+        for course_id in session.course_ids:
+            if self.store.enrollment(email, course_id):
+                return course_id
+        raise NotFound("Student not found in your course!")
+
+    def student_for(self, session, email):
+        """The student's row when the session may see it: a student's own
+        row, or a student enrolled in any of the professor's courses."""
+        student = self._student(email)
+        if session.role == 'student' and session.student_key == email:
+            return dict(student)
+        if session.role == 'professor' and any(self.store.enrollment(email, course_id)
+                                               for course_id in session.course_ids):
+            return dict(student)
+        raise AccessDenied("You may not view this student!")
+
+    def register(self, email, password, role, name='', last_name='', rank='', course_id=None):
+        """Create a login plus the matching student or professor row. For a
+        professor, name is the full name; for a student, the first name."""
+        if role not in self.ROLES:
+            raise ServiceError(f"Invalid role '{role}'!")
+        if email in self.store.login:
+            raise ServiceError(f"User '{email}' already exists in login.csv!")
+        with self.store.transaction() as tx:
+            tx.insert('login', {'User id': email, 'Password': LoginUser.hash_password(password),
+                                'Role': role})
+            if role == 'student':
+                tx.insert('students', {
+                    'Email address': email,
+                    'First name': name,
+                    'Last name': last_name,
+                    'Course.id': course_id,
+                    'grades': 'Unavailable',
+                    'Marks': 'Unavailable'
+                })
+            else:
+                tx.insert('professors', {
+                    'Professor_id': email,
+                    'Professor Name': name,
+                    'Rank': rank,
+                    'Course.id': course_id
+                })
+        return {'email': email, 'role': role}
+
+    @staticmethod
+    def _add_login(tx, email, role):
+        # Accounts added by a professor start with the public default password.
+        if tx.get('login', email) is None:
+            tx.insert('login', {'User id': email, 'Password': LoginUser.hash_password("default"),
+                                'Role': role})
+
+    def change_password(self, email, old_password, new_password):
+        self.authenticate(email, old_password)
+        self.store.login.update(email, {'Password': LoginUser.hash_password(new_password)})
+
+    # Students
+    def get_student(self, email):
+        return dict(self._student(email))
+
+    def add_student(self, email, first_name, last_name, course_id, marks):
+        """Add a student with a default login; the grade follows from marks."""
+        if email in self.store.students:
+            raise ServiceError(f"Student '{email}' already exists!")
+        if course_id not in self.store.courses:
+            raise IntegrityError(f"Course '{course_id}' does not exist!")
+        marks = self._marks(marks)
+        student = {
+            'Email address': email,
+            'First name': first_name,
+            'Last name': last_name,
+            'Course.id': course_id,
+            'grades': Grade.calculate_grade(marks),
+            'Marks': marks
+        }
+        with self.store.transaction() as tx:
+            tx.insert('students', student)
+            self._add_login(tx, email, "student")
+        return student
+
+    def update_student(self, email, **changes):
+        """Change any of first_name, last_name, course_id and marks; course_id
+        and marks are those of the student's home course."""
+        self._student(email)
+        unknown = set(changes) - set(self.STUDENT_FIELDS)
+        if unknown:
+            raise ServiceError(f"Cannot update {', '.join(sorted(unknown))}!")
+        row = {self.STUDENT_FIELDS[name]: value for name, value in changes.items()}
+        self.relations.validate('students', row)
+        if 'Course.id' in row and DataStore.link_id(email, row['Course.id']) in self.store.enrollments:
+            raise ServiceError(f"Student '{email}' is already enrolled in {row['Course.id']}!")
+        if 'Marks' in row:
+            row['Marks'] = self._marks(row['Marks'])
+            row['grades'] = Grade.calculate_grade(row['Marks'])
+        return dict(self.store.students.update(email, row))
+
+    def set_marks(self, email, marks, course_id=None):
+        """Record marks and the matching grade for one of the student's
+        courses (their home course by default)."""
+        student = self._student(email, course_id)
+        marks = self._marks(marks)
+        changes = {'Marks': marks, 'grades': Grade.calculate_grade(marks)}
+        if self.store.students.get(email)['Course.id'] == student['Course.id']:
+            return dict(self.store.students.update(email, changes))
+        self.store.enrollments.update(DataStore.link_id(email, student['Course.id']), changes)
+        return dict(self.store.enrollment(email, student['Course.id']))
+
+    def delete_student(self, email, course_id=None):
+        """Delete the student with their login and enrollments; with
+        course_id, only drop that course while they take others. True when
+        the whole student was deleted."""
+        self._student(email, course_id)
+        if course_id is not None and len(self.store.enrollments_of(email)) > 1:
+            self.drop(email, course_id)
+            return False
+        self.relations.delete('students', email)
+        self.sessions.invalidate_user(email)
+        return True
+
+    def grade_report(self, email, course_id=None):
+        """The student's row for one course (their home course by default)
+        plus the min and max marks of that course."""
+        student = self._student(email, course_id)
+        report = dict(student)
+        stats = self.store.course_stats(student['Course.id'])
+        report['min'], report['max'] = (stats['min'], stats['max']) if stats else (None, None)
+        return report
+
+    def grade_reports(self, email):
+        """grade_report for every course of the student, home course first."""
+        self._student(email)
+        return [self.grade_report(email, row['Course.id']) for row in self.store.enrollments_of(email)]
+
+    # Enrollments
+    def student_courses(self, email):
+        """The student's row for each of their courses, home course first."""
+        self._student(email)
+        return [dict(row) for row in self.store.enrollments_of(email)]
+
+    def enroll(self, email, course_id, marks=None):
+        """Enroll an existing student in one more course. A student without a
+        course (Course.id TBD) gets it as their home course instead."""
+        student = self._student(email)
+        if course_id not in self.store.courses:
+            raise IntegrityError(f"Course '{course_id}' does not exist!")
+        if self.store.enrollment(email, course_id):
+            raise ServiceError(f"Student '{email}' is already enrolled in {course_id}!")
+        marks = 'Unavailable' if marks in (None, '') else self._marks(marks)
+        grade = 'Unavailable' if marks == 'Unavailable' else Grade.calculate_grade(marks)
+        if student['Course.id'] in Relations.NO_COURSE:
+            self.store.students.update(email, {'Course.id': course_id, 'grades': grade, 'Marks': marks})
+        else:
+            with self.store.transaction() as tx:
+                tx.insert('enrollments', {
+                    'Enrollment id': DataStore.link_id(email, course_id),
+                    'Email address': email,
+                    'Course.id': course_id,
+                    'grades': grade,
+                    'Marks': marks
+                })
+        return dict(self.store.enrollment(email, course_id))
+
+    def drop(self, email, course_id):
+        """Take the student out of one of their courses. Dropping the home
+        course moves the next enrollment onto the student's row; a student's
+        only course cannot be dropped (delete the student instead)."""
+        student = self._student(email, course_id)
+        courses = self.store.enrollments_of(email)
+        if len(courses) == 1:
+            raise ServiceError(f"{course_id} is the only course of '{email}'!")
+        with self.store.transaction() as tx:
+            if courses[0]['Course.id'] == course_id:
+                student = courses[1]
+                tx.update('students', email, {field: student[field]
+                                              for field in ('Course.id', 'grades', 'Marks')})
+            tx.delete('enrollments', DataStore.link_id(email, student['Course.id']))
+
+    # Courses
+    def list_courses(self):
+        return [dict(course) for course in self.store.courses.all()]
+
+    def get_course(self, course_id):
+        course = self.store.courses.get(course_id)
+        if not course:
+            raise NotFound("Course not found!")
+        return dict(course)
+
+    def add_course(self, course_id, name, credits, description='', professor=None):
+        """Add a course; with professor, also assign it to them in the same
+        transaction, so neither write happens without the other."""
+        if course_id in self.store.courses:
+            raise ServiceError(f"Course '{course_id}' already exists!")
+        course = {
+            'Course_id': course_id,
+            'Course_name': name,
+            'Credits': credits,
+            'Description': description
+        }
+        with self.store.transaction() as tx:
+            tx.insert('courses', course)
+            if professor is not None:
+                tx.update('professors', professor, {'Course.id': course_id})
+        return course
+
+    def delete_course(self, course_id, cascade=False):
+        """Delete a course. While students or professors still use it this
+        raises IntegrityError, unless cascade: then its students are deleted
+        and its professors unassigned. Returns {table: rows changed}."""
+        self.get_course(course_id)
+        return self.relations.delete('courses', course_id, cascade)
+
+    def course_stats(self, course_id):
+        stats = self.store.course_stats(course_id)
+        if not stats:
+            raise ServiceError("No students found for this course!")
+        return dict(stats, course_id=course_id)
+
+    def regrade(self, course_id=None):
+        return Grade.regrade(course_id, self.store)
+
+    # Rankings
+    @staticmethod
+    def _count(value, name):
+        text = str(value).strip()
+        if not (text.isdigit() and int(text) > 0):
+            raise ServiceError(f"{name} must be a positive whole number, got '{value}'!")
+        return int(text)
+
+    def top_students(self, course_id, k=10, lowest=False):
+        """The k best (or worst) marked students of a course."""
+        k = self._count(k, "Count")
+        return [dict(s) for s in self.store.top_students(k, course_id, lowest)]
+
+    def students_in_range(self, course_id, low, high):
+        low, high = self._marks(low), self._marks(high)
+        if low > high:
+            low, high = high, low
+        return [dict(s) for s in self.store.students_in_range(low, high, course_id)]
+
+    def student_rank(self, email, course_id=None):
+        self._student(email, course_id)
+        rank = self.store.student_rank(email, course_id)
+        if rank is None:
+            raise ServiceError("Student has no marks yet!")
+        return rank
+
+    def list_students(self, course_id, order='name', page=1, size=20):
+        """{'page', 'pages', 'total', 'students'} for one page of a course's
+        students sorted by marks, name or email."""
+        if order not in DataStore.ORDERS:
+            raise ServiceError(f"Unknown order '{order}'!")
+        page, size = self._count(page, "Page"), self._count(size, "Page size")
+        rows, total = self.store.students_page(order, (page - 1) * size, size, course_id)
+        return {'page': page, 'pages': max(1, math.ceil(total / size)), 'total': total,
+                'students': [dict(s) for s in rows]}
+
+    # Professors
+    def get_professor(self, email):
+        professor = self.store.professors.get(email)
+        if not professor:
+            raise NotFound("Professor not found!")
+        return dict(professor)
+
+    def professor_course(self, email):
+        """Course.id of the professor's own course."""
+        return self.professor_courses(email)[0]
+
+    def professor_courses(self, email):
+        """Course.id of every course the professor teaches, their own first."""
+        self.get_professor(email)
+        courses = self.store.courses_taught(email)
+        if not courses:
+            raise ServiceError("You must be assigned to a course first!")
+        return courses
+
+    def teach(self, email, course_id):
+        """Add a course to those the professor teaches. A professor without a
+        course (Course.id TBD) gets it as their own course instead."""
+        professor = self.get_professor(email)
+        if course_id not in self.store.courses:
+            raise IntegrityError(f"Course '{course_id}' does not exist!")
+        if course_id in self.store.courses_taught(email):
+            raise ServiceError(f"'{email}' already teaches {course_id}!")
+        if professor['Course.id'] in Relations.NO_COURSE:
+            self.store.professors.update(email, {'Course.id': course_id})
+        else:
+            with self.store.transaction() as tx:
+                tx.insert('teaching', {'Assignment id': DataStore.link_id(email, course_id),
+                                       'Professor_id': email, 'Course.id': course_id})
+        return self.store.courses_taught(email)
+
+    def add_professor(self, email, name, rank, course_id):
+        if email in self.store.professors:
+            raise ServiceError(f"Professor '{email}' already exists!")
+        professor = {
+            'Professor_id': email,
+            'Professor Name': name,
+            'Rank': rank,
+            'Course.id': course_id
+        }
+        with self.store.transaction() as tx:
+            tx.insert('professors', professor)
+            self._add_login(tx, email, "professor")
+        return professor
+
+    def assign_course(self, email, course_id):
+        """Change the professor's own course."""
+        self.get_professor(email)
+        if course_id not in self.store.courses:
+            raise ServiceError("Invalid course selection!")
+        if DataStore.link_id(email, course_id) in self.store.teaching:
+            raise ServiceError(f"'{email}' already teaches {course_id}!")
+        return dict(self.store.professors.update(email, {'Course.id': course_id}))
+
+    def delete_professor(self, email):
+        self.relations.delete('professors', email)
+        self.sessions.invalidate_user(email)
+
+class GradeServer:
+    """GradeService over HTTP/1.1 and JSON on asyncio streams, for many clients
+    at once. Reads are answered straight from the in-memory store on the event
+    loop; every mutation is queued to a single writer task, which runs it on a
+    worker thread so its file writes and fsync do not block the loop. Writes
+    are applied one at a time, and reads wait for the one in progress, so the
+    two never interleave. Password KDFs run on worker threads too, so a login
+    does not stall other requests. Errors the service raises map to a status
+    by their type; anything else is logged here and answered with a bare 500.
+
+    POST /login returns a session token; the other calls except GET /courses
+    send it as "Authorization: Bearer <token>".
+
+        POST /login                      {"email", "password"}
+        POST /logout
+        GET  /students/<email>
+        GET  /students/<email>/report
+        GET  /students/<email>/courses
+        PUT  /students/<email>/marks     {"marks", "course_id" (optional)}
+        GET  /courses
+        GET  /courses/<course_id>/stats
+        GET  /metrics                    (professors; see Metrics)
+    """
+    STATUS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden',
+              404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+              500: 'Internal Server Error'}
+    MAX_BODY = 64 * 1024
+    log = logging.getLogger('checkmygrade.server')
+
+    def __init__(self, store, host='127.0.0.1', port=8080):
+        self.service = GradeService(store)
+        self.host = host
+        self.port = port
+        self.server = None
+        self.writes = None
+
+    async def start(self):
+        """Listen and start the writer task; port 0 picks a free port."""
+        self.writes = asyncio.Queue()
+        self.idle = asyncio.Event()  # clear while a write runs
+        self.idle.set()
+        self._writer_task = asyncio.create_task(self._writer())
+        self.server = await asyncio.start_server(self._connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        print(f"Serving CheckMyGrade on http://{self.host}:{self.port}")
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self._writer_task.cancel()
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            func, args, future = await self.writes.get()
+            self.idle.clear()
+            try:
+                result = await loop.run_in_executor(None, func, *args)
+            except Exception as e:
+                settle = future.set_exception, e
+            else:
+                settle = future.set_result, result
+            finally:
+                self.idle.set()
+            if not future.cancelled():
+                settle[0](settle[1])
+
+    async def write(self, func, *args):
+        """Run func(*args) on the writer task and return its result."""
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((func, args, future))
+        return await future
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_head(reader)
+                if request is None:
+                    break
+                method, path, headers = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                length = int(headers.get('content-length') or 0)
+                if length > self.MAX_BODY:
+                    status, payload, keep_alive = 413, {'error': "Request body too large"}, False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    with Metrics.measure(f"http.{method} /{path.strip('/').split('/', 1)[0]}"):
+                        status, payload = await self.dispatch(method, path, body, headers)
+                data = json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {status} {self.STATUS[status]}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                             .encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_head(reader):
+        """(method, path, headers) of the next request, or None at EOF."""
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return method, target.split('?', 1)[0], headers
+
+    async def dispatch(self, method, path, body, headers=None):
+        """(status, payload) for one request."""
+        parts = [unquote(p) for p in path.strip('/').split('/')]
+        try:
+            data = json.loads(body) if body else {}
+            if not isinstance(data, dict):
+                raise ValueError("body must be a JSON object")
+        except ValueError as e:
+            return 400, {'error': f"Invalid JSON: {e}"}
+
+        service = self.service
+        auth = (headers or {}).get('authorization', '')
+        token = auth[7:] if auth.startswith('Bearer ') else ''
+        await self.idle.wait()
+        try:
+            if parts == ['login']:
+                if method != 'POST':
+                    return 405, {'error': "Use POST"}
+                return 200, await self.login(data.get('email', ''), data.get('password', ''))
+            if parts == ['courses'] and method == 'GET':
+                return 200, service.list_courses()
+
+            session = service.session(token)
+            if parts == ['logout'] and method == 'POST':
+                service.logout(token)
+                return 200, {}
+            if len(parts) == 3 and parts[0] == 'courses' and parts[2] == 'stats' and method == 'GET':
+                return 200, service.course_stats(parts[1])
+            if parts == ['metrics'] and method == 'GET':
+                if session.role != 'professor':
+                    raise AccessDenied("Only professors can read metrics!")
+                return 200, {'enabled': Metrics.enabled, 'operations': Metrics.snapshot()}
+            if len(parts) == 2 and parts[0] == 'students' and method == 'GET':
+                return 200, service.student_for(session, parts[1])
+            if len(parts) == 3 and parts[0] == 'students' and parts[2] == 'report' and method == 'GET':
+                service.student_for(session, parts[1])
+                return 200, service.grade_report(parts[1])
+            if len(parts) == 3 and parts[0] == 'students' and parts[2] == 'courses' and method == 'GET':
+                service.student_for(session, parts[1])
+                return 200, service.grade_reports(parts[1])
+            if len(parts) == 3 and parts[0] == 'students' and parts[2] == 'marks' and method == 'PUT':
+                if data.get('course_id') is None:
+                    course_id = service.shared_course(session, parts[1])
+                else:
+                    course_id = service.session_course(session, data['course_id'])
+                return 200, await self.write(service.set_marks, parts[1], data.get('marks'), course_id)
+        except SessionExpired as e:
+            return 401, {'error': str(e)}
+        except AccessDenied as e:
+            return 403, {'error': str(e)}
+        except NotFound as e:
+            return 404, {'error': str(e)}
+        except ServiceError as e:
+            return 400, {'error': str(e)}
+        except Exception:
+            self.log.exception("%s %s failed", method, path)
+            return 500, {'error': self.STATUS[500]}
+        return 404, {'error': f"No route for {method} {path}"}
+
+    async def login(self, email, password):
+        # Same rules as LoginUser.verify_password, with the KDF work moved off
+        # the event loop and the rehash written through the writer task.
+        loop = asyncio.get_running_loop()
+        user = self.service.store.login.get(email)
+        if not user:
+            raise ServiceError("Invalid email or password!")
+        stored = user['Password']
+        if not await loop.run_in_executor(None, LoginUser.check_password, email, password, stored):
+            raise ServiceError("Invalid email or password!")
+        if PasswordHasher.needs_rehash(stored):
+            stored = await loop.run_in_executor(None, PasswordHasher.hash, password)
+            await self.write(self.service.store.login.update, email, {'Password': stored})
+        LoginUser.verified.add(email, stored, password)
+        await self.idle.wait()
+        session = self.service.sessions.issue(email, user['Role'])
+        return session.to_dict(self.service.sessions.clock())
+
+class BulkLoader:
+    """Non-interactive import and export of students, professors and courses.
+    Input rows are streamed from CSV or JSONL, validated against the store's
+    indexes, and committed in one transaction with one batched write per
+    table, so an import's rows and their logins are written all or nothing."""
+    KINDS = {
+        'students': ('Email address', CSVHandler.STUDENT_FIELDS),
+        'professors': ('Professor_id', CSVHandler.PROFESSOR_FIELDS),
+        'courses': ('Course_id', CSVHandler.COURSE_FIELDS),
+    }
+    ROLES = {'students': 'student', 'professors': 'professor'}
+
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def read_rows(path):
+        with open(path, 'r', newline='') as f:
+            if path.endswith('.jsonl'):
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                yield from csv.DictReader(f)
+
+    def _validate(self, kind, row, seen):
+        key, _ = self.KINDS[kind]
+        value = (row.get(key) or '').strip()
+        if not value:
+            return f"missing {key}"
+        table = getattr(self.store, kind)
+        if value in seen or value in table:
+            return f"duplicate {key} '{value}'"
+
+        if kind == 'courses':
+            if not str(row.get('Credits', '')).isdigit():
+                return f"invalid Credits '{row.get('Credits')}'"
+            return None
+
+        course_id = row.get('Course.id')
+        if course_id not in self.store.courses:
+            return f"unknown Course.id '{course_id}'"
+        if kind == 'students':
+            marks = str(row.get('Marks', ''))
+            if not (marks.isdigit() and 0 <= int(marks) <= 100):
+                return f"marks out of range '{marks}'"
+        return None
+
+    def import_file(self, kind, path):
+        """Returns {'accepted', 'rejected': [(line, reason, row)], 'seconds'}."""
+        start = time.perf_counter()
+        key, fieldnames = self.KINDS[kind]
+        accepted, logins, rejected, seen = [], [], [], set()
+        first_line = 1 if path.endswith('.jsonl') else 2
+
+        for line, row in enumerate(self.read_rows(path), first_line):
+            reason = self._validate(kind, row, seen)
+            if reason:
+                rejected.append((line, reason, row))
+                continue
+            record = {f: str(row.get(f, '')).strip() for f in fieldnames}
+            if kind == 'students':
+                record['grades'] = Grade.calculate_grade(int(record['Marks']))
+            seen.add(record[key])
+            accepted.append(record)
+            if kind in self.ROLES and record[key] not in self.store.login:
+                logins.append({
+                    'User id': record[key],
+                    'Password': row.get('Password') or "default",
+                    'Role': self.ROLES[kind]
+                })
+
+        if logins:
+            self._hash_passwords(logins)
+        with self.store.transaction() as tx:
+            for record in accepted:
+                tx.insert(kind, record)
+            for login in logins:
+                tx.insert('login', login)
+        return {'accepted': len(accepted), 'rejected': rejected,
+                'seconds': time.perf_counter() - start}
+
+    @staticmethod
+    def _hash_passwords(logins):
+        # Every row gets its own salted hash, the public default password
+        # included, so equal hashes never show which accounts share one. The
+        # KDFs release the GIL, so hashing spreads across threads.
+        with ThreadPoolExecutor() as pool:
+            hashes = pool.map(PasswordHasher.hash, [login['Password'] for login in logins])
+            for login, hashed in zip(logins, hashes):
+                login['Password'] = hashed
+
+    def export_file(self, kind, path):
+        _, fieldnames = self.KINDS[kind]
+        rows = getattr(self.store, kind).all()
+        with open(path, 'w', newline='') as f:
+            if path.endswith('.jsonl'):
+                for row in rows:
+                    f.write(json.dumps(dict(row)) + '\n')
+            else:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(rows)
+        return len(rows)
+
+    @staticmethod
+    def print_report(kind, report, limit=20):
+        total = report['accepted'] + len(report['rejected'])
+        rate = total / report['seconds'] if report['seconds'] else 0
+        print(f"Imported {report['accepted']} {kind}, rejected {len(report['rejected'])} "
+              f"in {report['seconds']:.3f} seconds ({rate:,.0f} rows/s)")
+        for line, reason, _ in report['rejected'][:limit]:
+            print(f"  line {line}: {reason}")
+        if len(report['rejected']) > limit:
+            print(f"  ... {len(report['rejected']) - limit} more")
+
 class CheckMyGradeApp:
-    def __init__(self):
+    def __init__(self, backend=None, data_dir=''):
+        self.store = DataStore.open(backend, data_dir, lazy=True)
+        DataStore.active = self.store
+        self.service = GradeService(self.store)
+        self.session = None
         self.student = Student(self)
         self.course = Course(self)
         self.professor = Professor(self)
@@ -564,14 +4551,26 @@ class CheckMyGradeApp:
             
             if choice == '1':
                 role, email = LoginUser.login()
-                if role == 'student':
-                    self.student_menu(email)
-                elif role == 'professor':
-                    self.professor_menu(email)
+                if role is None:
+                    continue
+                self.session = self.service.sessions.issue(email, role)
+                try:
+                    if role == 'student':
+                        self.student_menu(email)
+                    elif role == 'professor':
+                        self.professor_menu(email)
+                finally:
+                    self.service.logout(self.session.token)
+                    self.session = None
             elif choice == '2':
                 break
             else:
                 print("Invalid choice!")
+        # Compact now rather than at exit, so the snapshot matches the CSVs
+        # the next start will find.
+        if isinstance(self.store, CSVStore):
+            self.store.compact()
+            self.store.save_snapshot()
 
     def student_menu(self, email):
         while True:
@@ -605,7 +4604,9 @@ class CheckMyGradeApp:
             print("5. Delete Student")
             print("6. Change Password")
             print("7. Manage Courses")
-            print("8. Logout")
+            print("8. Regrade My Course")
+            print("9. Rankings and Search")
+            print("10. Logout")
             choice = input("Select option: ")
             
             if choice == '1':
@@ -623,27 +4624,47 @@ class CheckMyGradeApp:
             elif choice == '7':
                 self.manage_courses_menu(email)           
             elif choice == '8':
+                self.regrade_course(email)
+            elif choice == '9':
+                self.rankings_menu(email)
+            elif choice == '10':
                 break
             else:
                 print("Invalid choice!")
+    def professor_course(self, professor_email):
+        # The logged-in professor's courses come from the session; calls for
+        # anyone else (tests, scripts) look them up. A professor teaching
+        # several courses picks one.
+        session = self.session and self.service.sessions.get(self.session.token)
+        if session and session.email == professor_email:
+            self.service.session_course(session)
+            courses = session.course_ids
+        else:
+            courses = self.service.professor_courses(professor_email)
+        if len(courses) == 1:
+            return courses[0]
+        course_id = input(f"Course ({', '.join(courses)}): ").strip()
+        if course_id not in courses:
+            raise ServiceError("Invalid course selection!")
+        return course_id
+
+    @Metrics.timed('menu.update_student_grade')
     def update_student_grade(self, professor_email):
-        professors = CSVHandler.load_professors()
-        prof = next((p for p in professors if p['Professor_id'] == professor_email), None)
-        if not prof or prof['Course.id'] == 'TBD':
-            print("You must be assigned to a course first!")
+        try:
+            course_id = self.professor_course(professor_email)
+        except ServiceError as e:
+            print(e)
             return
-            
-        course_id = prof['Course.id']
+
         student_email = input("Enter student email to update: ")
         
-        students = CSVHandler.load_students()
-        student = next((s for s in students if s['Email address'] == student_email), None)
-        
-        if student and student['Course.id'] == course_id:
-            new_marks = int(input(f"Enter new marks (0-100) for {student_email}: "))
-            student['Marks'] = new_marks
-            student['grades'] = Grade.calculate_grade(new_marks)
-            CSVHandler.save_students(students)
+        if self.store.enrollment(student_email, course_id):
+            new_marks = input(f"Enter new marks (0-100) for {student_email}: ")
+            try:
+                self.service.set_marks(student_email, new_marks, course_id)
+            except ServiceError as e:
+                print(e)
+                return
             print("Grades updated successfully!")
         else:
             print("Student not found in your course!")                
@@ -671,81 +4692,273 @@ class CheckMyGradeApp:
                 return
             else:
                 print("Invalid choice!")
-    def add_new_course_flow(self):
-        self.course.add_new_course()
-        new_courses = CSVHandler.load_courses()
-        if new_courses:
-            new_course_id = new_courses[-1]['Course_id']
-            print(f"Would you like to assign yourself to {new_course_id}?")
-            if input("(Y/N): ").lower() == 'y':
-                professors = CSVHandler.load_professors()
-                prof = next((p for p in professors if p['Professor_id'] == email), None)
-                if prof:
-                    prof['Course.id'] = new_course_id
-                    CSVHandler.save_professors(professors)
-                    print("Course assignment updated!")       
+    def add_new_course_flow(self, email):
+        """Add a course, then offer the professor `email` to take it as theirs."""
+        if not self.course.add_new_course():
+            return
+        new_course_id = self.store.courses.last()['Course_id']
+        print(f"Would you like to assign yourself to {new_course_id}?")
+        if input("(Y/N): ").lower() == 'y':
+            if self.store.professors.update(email, {'Course.id': new_course_id}):
+                print("Course assignment updated!")
+
+    @Metrics.timed('menu.show_course_statistics')
     def show_course_statistics(self, professor_email):
-        professors = CSVHandler.load_professors()
-        prof = next((p for p in professors if p['Professor_id'] == professor_email), None)
-        if not prof or not prof['Course.id']:
-            print("You must be assigned to a course first!")
+        try:
+            course_id = self.professor_course(professor_email)
+        except ServiceError as e:
+            print(e)
             return
             
-        Grade.get_course_statistics(prof['Course.id'])            
+        Grade.get_course_statistics(course_id)            
+
+    @Metrics.timed('menu.regrade_course')
+    def regrade_course(self, professor_email):
+        try:
+            course_id = self.professor_course(professor_email)
+        except ServiceError as e:
+            print(e)
+            return
+
+        changed = self.service.regrade(course_id)
+        print(f"Regraded {course_id}: {changed} grade(s) changed.")
+
+    @Metrics.timed('menu.rankings')
+    def rankings_menu(self, professor_email):
+        try:
+            course_id = self.professor_course(professor_email)
+        except ServiceError as e:
+            print(e)
+            return
+
+        while True:
+            print(f"\nRankings and Search ({course_id})")
+            print("1. Top Students")
+            print("2. Bottom Students")
+            print("3. Students in Marks Range")
+            print("4. Rank of a Student")
+            print("5. List Students")
+            print("6. Back")
+            choice = input("Select option: ")
+
+            try:
+                if choice in ('1', '2'):
+                    k = input("How many students: ")
+                    start = time.perf_counter()
+                    students = self.service.top_students(course_id, k, lowest=choice == '2')
+                    self.print_students(students, start)
+                elif choice == '3':
+                    low = input("Lowest marks: ")
+                    high = input("Highest marks: ")
+                    start = time.perf_counter()
+                    self.print_students(self.service.students_in_range(course_id, low, high), start)
+                elif choice == '4':
+                    rank = self.service.student_rank(input("Student email: "), course_id)
+                    print(f"Rank {rank['rank']} of {rank['count']} in {rank['course_id']} "
+                          f"with {rank['marks']} marks")
+                elif choice == '5':
+                    order = input("Order by (marks/name/email): ").lower() or 'name'
+                    page = 1
+                    while True:
+                        start = time.perf_counter()
+                        result = self.service.list_students(course_id, order, page)
+                        print(f"\nPage {result['page']} of {result['pages']} ({result['total']} students)")
+                        self.print_students(result['students'], start)
+                        if page >= result['pages'] or input("Next page? (Y/N): ").lower() != 'y':
+                            break
+                        page += 1
+                elif choice == '6':
+                    return
+                else:
+                    print("Invalid choice!")
+            except ServiceError as e:
+                print(e)
+
+    @staticmethod
+    def print_students(students, start):
+        for s in students:
+            print(f"{s['Email address']:<30} {s['First name']} {s['Last name']:<20} "
+                  f"{s['Marks']:>5} {s['grades']}")
+        print(f"{len(students)} student(s) in {time.perf_counter() - start:.6f} seconds")
 
+    @Metrics.timed('menu.delete_student')
     def delete_student(self, professor_email):
-        professors = CSVHandler.load_professors()
-        prof = next((p for p in professors if p['Professor_id'] == professor_email), None)
-        if not prof or not prof['Course.id']:
-            print("You must be assigned to a course first!")
+        try:
+            course_id = self.professor_course(professor_email)
+        except ServiceError as e:
+            print(e)
             return
         student_email = input("Enter student email to delete: ")
         
-        students = CSVHandler.load_students()
-        student = next((s for s in students if s['Email address'] == student_email and 
-                       s['Course.id'] == prof['Course.id']), None)
-        
-        if student:
-            self.student.delete_new_student(student_email)
-            login_data = CSVHandler.load_login()
-            login_data = [u for u in login_data if u['User id'] != student_email]
-            CSVHandler.save_login(login_data)
+        try:
+            removed = self.service.delete_student(student_email, course_id)
+        except ServiceError:
+            print("Student not found in your course!")
+            return
+        if removed:
             print("Student completely removed from system!")
         else:
-            print("Student not found in your course!")
+            print(f"Student dropped from {course_id}; their other courses are kept.")
 
+    @Metrics.timed('menu.add_student')
     def add_student_with_course_validation(self):
-     course_id = Course.select_course()
-     if not course_id:
-         print("Invalid course selection!")
-         return
+        course_id = Course.select_course()
+        if not course_id:
+            print("Invalid course selection!")
+            return
 
-         email = input("Student email: ")
-         students = CSVHandler.load_students()
-    
-         if any(s['Email address'] == email for s in students):
+        email = input("Student email: ")
+        if email in self.store.students:
             print(f"Student '{email}' already exists!")
-            return  
+            if input(f"Enroll them in {course_id} too? (Y/N): ").lower() != 'y':
+                return
+            marks = input("Initial marks (0-100, blank for none): ")
+            try:
+                self.service.enroll(email, course_id, marks)
+            except ServiceError as e:
+                print(e)
+                return
+            print(f"Student '{email}' enrolled in {course_id}!")
+            return
 
-         first = input("First name: ")
-         last = input("Last name: ")
-         marks = int(input("Initial marks (0-100): "))
-         grade = Grade.calculate_grade(marks)
+        first = input("First name: ")
+        last = input("Last name: ")
+        marks = input("Initial marks (0-100): ")
 
-         new_student = {
-            'Email address': email,
-            'First name': first,
-            'Last name': last,
-            'Course.id': course_id,
-            'grades': grade,
-            'Marks': marks
-         }
+        try:
+            self.service.add_student(email, first, last, course_id, marks)
+        except ServiceError as e:
+            print(e)
+            return
+        print(f"Student '{email}' added successfully!")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CheckMyGrade System")
+    parser.add_argument('--backend', choices=['csv', 'sqlite'],
+                        help=f"storage backend (default: ${DataStore.BACKEND_ENV} or csv)")
+    parser.add_argument('--data-dir', default='', help="directory holding the CSV files")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="run under cProfile, save the stats to FILE and print the top functions")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="trace allocations and print the peak and the top allocating lines")
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('run', help="interactive console (default)")
+    serve_parser = commands.add_parser('serve', help="HTTP/JSON API for concurrent clients")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    import_parser = commands.add_parser('import-sqlite',
+                                        help="load the CSV files into the SQLite database")
+    import_parser.add_argument('--db', help=f"database path (default: <data-dir>/{SQLiteStore.DB_NAME})")
+    commands.add_parser('analytics', help="statistics for every course (requires NumPy)")
+    commands.add_parser('integrity', help="list dangling course references and incomplete accounts")
+    regrade_parser = commands.add_parser('regrade',
+                                         help="recompute letter grades from marks")
+    regrade_parser.add_argument('--course', help="only this Course.id (default: all courses)")
+    reports_parser = commands.add_parser('reports', help="grade report files for every student")
+    reports_parser.add_argument('--out', default='reports', help="output directory (default: reports)")
+    reports_parser.add_argument('--format', choices=sorted(ReportBuilder.FORMATS), default='text')
+    reports_parser.add_argument('--workers', type=int, help="processes (default: CPU count)")
+    reports_parser.add_argument('--chunk-size', type=int, default=2000, help="students per work unit")
+    rotate_parser = commands.add_parser('rotate-key',
+                                        help="re-encrypt Caesar passwords in login.csv with a new shift")
+    rotate_parser.add_argument('--shift', type=int, required=True)
+    for name, help_text in (('import', "bulk load rows from a CSV or JSONL file"),
+                            ('export', "write a table to a CSV or JSONL file")):
+        bulk_parser = commands.add_parser(name, help=help_text)
+        bulk_parser.add_argument('kind', choices=sorted(BulkLoader.KINDS))
+        bulk_parser.add_argument('file')
+    commands.choices['import'].add_argument('--rejects', help="write rejected rows and reasons to this CSV")
+    metrics_parser = commands.add_parser('metrics', help=f"print metrics saved through ${Metrics.ENV}")
+    metrics_parser.add_argument('file', nargs='?', help=f"JSON metrics file (default: ${Metrics.ENV})")
+    args = parser.parse_args(argv)
+
+    with Metrics.profiled(args.profile, args.trace_memory):
+        run_command(args)
+
+
+def run_command(args):
+    if args.command == 'metrics':
+        path = args.file or os.environ.get(Metrics.ENV, '')
+        if path in ('', '0', '1'):
+            print(f"No metrics file given; run with {Metrics.ENV}=<file> to save one.")
+            return
+        with open(path) as f:
+            Metrics.display(json.load(f))
+        return
+
+    if args.command == 'import':
+        loader = BulkLoader(DataStore.open(args.backend, args.data_dir))
+        report = loader.import_file(args.kind, args.file)
+        BulkLoader.print_report(args.kind, report)
+        if args.rejects:
+            with open(args.rejects, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['line', 'reason', 'row'])
+                for line, reason, row in report['rejected']:
+                    writer.writerow([line, reason, json.dumps(row)])
+        return
+
+    if args.command == 'export':
+        count = BulkLoader(DataStore.open(args.backend, args.data_dir)).export_file(args.kind, args.file)
+        print(f"Exported {count} {args.kind} to {args.file}")
+        return
+
+    if args.command == 'serve':
+        server = GradeServer(DataStore.open(args.backend, args.data_dir), args.host, args.port)
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.command == 'rotate-key':
+        start = time.perf_counter()
+        rotated = LoginUser.rotate_cipher(args.shift, os.path.join(args.data_dir, 'login.csv'))
+        print(f"Re-encrypted {rotated} password(s) in {time.perf_counter() - start:.3f} seconds")
+        return
+
+    if args.command == 'integrity':
+        problems = Relations(DataStore.open(args.backend, args.data_dir)).violations()
+        for table, key, problem in problems:
+            print(f"{table}: {key}: {problem}")
+        print(f"{len(problems)} integrity problem(s) found")
+        return
+
+    if args.command == 'reports':
+        builder = ReportBuilder(DataStore.open(args.backend, args.data_dir), args.format,
+                                args.workers, args.chunk_size)
+        result = builder.build(args.out)
+        rate = result['students'] / result['seconds'] if result['seconds'] else 0
+        print(f"Wrote {result['students']} reports for {result['courses']} courses to {args.out} "
+              f"in {result['seconds']:.3f} seconds ({rate:,.0f} reports/s)")
+        return
+
+    if args.command == 'regrade':
+        DataStore.active = DataStore.open(args.backend, args.data_dir)
+        changed = Grade.regrade(args.course)
+        print(f"Regraded {args.course or 'all courses'}: {changed} grade(s) changed.")
+        return
+
+    if args.command == 'analytics':
+        if (args.backend or os.environ.get(DataStore.BACKEND_ENV, 'csv')) == 'csv':
+            analytics = GradeAnalytics.from_csv(os.path.join(args.data_dir, 'students.csv'),
+                                                os.path.join(args.data_dir, 'enrollments.csv'))
+        else:
+            store = DataStore.open(args.backend, args.data_dir)
+            analytics = GradeAnalytics.from_rows(store.all_enrollments())
+        GradeAnalytics.display(analytics.summary())
+        return
+
+    if args.command == 'import-sqlite':
+        store = SQLiteStore(args.db or os.path.join(args.data_dir, SQLiteStore.DB_NAME), args.data_dir)
+        counts = store.import_csv(args.data_dir)
+        store.close()
+        for name, count in counts.items():
+            print(f"Imported {count} rows into {name}")
+        return
 
-         students.append(new_student)
-         CSVHandler.save_students(students)
-         LoginUser.add_to_login(email, "student")
-         print(f"Student '{email}' added successfully!")
+    app = CheckMyGradeApp(args.backend, args.data_dir)
+    app.run()
 
 if __name__ == "__main__":
-    app = CheckMyGradeApp()
-    app.run()
\ No newline at end of file
+    main()
\ No newline at end of file
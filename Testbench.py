@@ -1,13 +1,57 @@
 import unittest
 from unittest.mock import patch
-from TOPMODULE import CheckMyGradeApp, CSVHandler, LoginUser, Grade
+from TOPMODULE import (CheckMyGradeApp, CSVHandler, LoginUser, Grade, GradeAnalytics,
+                       DataStore, CSVStore, SQLiteStore, BulkLoader, StudentRecord,
+                       PasswordHasher, TextSecurity, GradeService, ServiceError, SessionExpired, AccessDenied, NotFound,
+                       GradeServer, ReportBuilder, Relations, IntegrityError, Metrics, Table, OffsetIndex,
+                       Snapshot, main, np)
 import time
+import os
+import zlib
+import shutil
+import csv
+import json
+import tempfile
+import random
+import math
+import multiprocessing
+from collections import Counter
+import asyncio
+
+
+def _concurrent_writer(data_dir, worker, count):
+    store = CSVStore(data_dir)
+    for i in range(count):
+        store.students.insert({'Email address': f'w{worker}_{i}@mycsu.edu', 'First name': 'W',
+                               'Last name': str(worker), 'Course.id': 'DATA200',
+                               'grades': 'F', 'Marks': 0})
+        store.students.update('shared@mycsu.edu', {'First name' if worker else 'Last name': f'{worker}-{i}'})
+    CSVHandler.compact_all()
+
+def _transaction_writer(data_dir, worker, count):
+    service = GradeService(CSVStore(data_dir))
+    for i in range(count):
+        if worker:
+            service.teach('tx@mycsu.edu', f'T{i:02d}')
+        else:
+            service.add_course(f'N{i:02d}', 'New', 3)
+    CSVHandler.compact_all()
 
 class TestCheckMyGradeApp(unittest.TestCase):
 
     def setUp(self):
         self.app = CheckMyGradeApp()
 
+    def use_data_copy(self):
+        """Run the app on a temporary copy of the data files, for tests whose
+        logins rewrite login.csv (password hashes are migrated on login)."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(CSVHandler.compact_all)
+        for name in ('students.csv', 'professors.csv', 'courses.csv', 'login.csv'):
+            shutil.copy(name, tmp.name)
+        self.app = CheckMyGradeApp(data_dir=tmp.name)
+
     # Add two Professors 
     @patch('builtins.input', side_effect=[
         'prof_test@mycsu.edu', 'Dr. Test Prof', 'Senior', '1', # assuming DATA200 is the first course
@@ -59,6 +103,14 @@ class TestCheckMyGradeApp(unittest.TestCase):
         courses = CSVHandler.load_courses()
         self.assertTrue(any(c['Course_id'] == 'TEST100' for c in courses))
 
+    # Add a course and take it as the professor's own
+    @patch('builtins.input', side_effect=['FLOW100', 'Flow Course', '3', 'Flow', 'y'])
+    def test_add_new_course_flow(self, mock_input):
+        print("\nTesting adding a course and assigning it to its professor...")
+        self.use_data_copy()
+        self.app.add_new_course_flow('professor_0@mycsu.edu')
+        self.assertEqual(self.app.store.professors.get('professor_0@mycsu.edu')['Course.id'], 'FLOW100')
+
     # Delete course
     def test_delete_course(self):
         print("\nTesting deleting course 'TEST100'...")
@@ -94,6 +146,7 @@ class TestCheckMyGradeApp(unittest.TestCase):
     @patch('builtins.input', side_effect=['professor_0@mycsu.edu', 'ProfPass123', 'professor'])
     def test_existing_professor_login(self, mock_input):
         print("\nTesting existing professor login...")
+        self.use_data_copy()
         role, email = LoginUser.login()
         self.assertEqual(role, 'professor')
 
@@ -101,6 +154,7 @@ class TestCheckMyGradeApp(unittest.TestCase):
     @patch('builtins.input', side_effect=['student_0@mycsu.edu', 'StudentPass123', 'student'])
     def test_existing_student_login(self, mock_input):
         print("\nTesting existing student login...")
+        self.use_data_copy()
         role, email = LoginUser.login()
         self.assertEqual(role, 'student')
 
@@ -164,5 +218,1030 @@ class TestCheckMyGradeApp(unittest.TestCase):
         student = next(s for s in students if s['Email address'] == 'student_0@mycsu.edu')
         self.assertEqual(student['First name'], 'UpdatedName')
 
+    # Indexed data store lookups
+    def test_data_store_indexes(self):
+        print("\nTesting data store primary and course indexes...")
+        students = CSVHandler.load_students()
+        store = self.app.store
+        self.assertEqual(len(store.students), len(students))
+        self.assertEqual(store.students.get('student_0@mycsu.edu'),
+                         next(s for s in students if s['Email address'] == 'student_0@mycsu.edu'))
+        expected = [s for s in students if s['Course.id'] == 'MATH101']
+        self.assertEqual(store.students.find('Course.id', 'MATH101'), expected)
+        self.assertEqual(store.professors.get('professor_1@mycsu.edu')['Course.id'], 'MATH101')
+        self.assertIn('DATA200', store.courses)
+        self.assertIsNone(store.login.get('nobody@mycsu.edu'))
+    # Append-only inserts and journaled updates/deletes
+    def test_append_and_journal_compaction(self):
+        print("\nTesting appended inserts and change journal replay...")
+        fields = CSVHandler.COURSE_FIELDS
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'courses.csv')
+            for cid in ('C1', 'C2', 'C3'):
+                CSVHandler.append_row(filename, {'Course_id': cid, 'Course_name': cid,
+                                                 'Credits': 3, 'Description': ''}, fields, 'Course_id')
+            self.assertFalse(os.path.exists(CSVHandler.journal_path(filename)))
+
+            CSVHandler.log_change(filename, 'update', {'Course_id': 'C2', 'Course_name': 'Two',
+                                                       'Credits': 4, 'Description': ''}, 'Course_id', fields)
+            CSVHandler.log_change(filename, 'delete', {'Course_id': 'C1'}, 'Course_id', fields)
+            CSVHandler.append_row(filename, {'Course_id': 'C1', 'Course_name': 'Again',
+                                             'Credits': 1, 'Description': ''}, fields, 'Course_id')
+            expected = [('C2', 'Two'), ('C3', 'C3'), ('C1', 'Again')]
+            rows = CSVHandler.load_data(filename)
+            self.assertEqual([(r['Course_id'], r['Course_name']) for r in rows], expected)
+
+            CSVHandler.compact(filename, fields)
+            self.assertFalse(os.path.exists(CSVHandler.journal_path(filename)))
+            rows = CSVHandler.load_data(filename)
+            self.assertEqual([(r['Course_id'], r['Course_name']) for r in rows], expected)
+    # Several processes writing the same data directory
+    @unittest.skipUnless(hasattr(os, 'fork'), "requires fork")
+    def test_concurrent_processes_keep_all_updates(self):
+        print("\nTesting concurrent writers on one data directory...")
+        with tempfile.TemporaryDirectory() as tmp:
+            CSVHandler.save_data(os.path.join(tmp, 'students.csv'), [
+                {'Email address': 'shared@mycsu.edu', 'First name': 'A', 'Last name': 'B',
+                 'Course.id': 'DATA200', 'grades': 'F', 'Marks': 0}], CSVHandler.STUDENT_FIELDS)
+            ctx = multiprocessing.get_context('fork')
+            workers = [ctx.Process(target=_concurrent_writer, args=(tmp, w, 120)) for w in range(2)]
+            for p in workers:
+                p.start()
+            for p in workers:
+                p.join()
+                self.assertEqual(p.exitcode, 0)
+
+            students = CSVStore(tmp).students
+            self.assertEqual(len(students), 241)
+            shared = students.get('shared@mycsu.edu')
+            self.assertEqual(shared['First name'], '1-119')
+            self.assertEqual(shared['Last name'], '0-119')
+            self.assertFalse([f for f in os.listdir(tmp) if f.endswith('.tmp')])
+
+    def test_concurrent_transactions_on_other_tables(self):
+        print("\nTesting concurrent transactions on different tables...")
+        with tempfile.TemporaryDirectory() as tmp:
+            service = GradeService(CSVStore(tmp))
+            for i in range(30):
+                service.add_course(f'T{i:02d}', 'Taught', 3)
+            service.add_professor('tx@mycsu.edu', 'Dr. Tx', 'Senior', 'T29')
+            CSVHandler.compact_all()
+            ctx = multiprocessing.get_context('fork')
+            workers = [ctx.Process(target=_transaction_writer, args=(tmp, w, 29)) for w in range(2)]
+            for p in workers:
+                p.start()
+            for p in workers:
+                p.join()
+                self.assertEqual(p.exitcode, 0)
+
+            store = CSVStore(tmp)
+            self.assertEqual(len(store.courses), 59)
+            self.assertEqual(len(store.courses_taught('tx@mycsu.edu')), 30)
+            self.assertEqual(store.redo_paths(), [])
+    # SQLite backend answers like the CSV backend
+    def test_sqlite_backend_matches_csv(self):
+        print("\nTesting SQLite storage backend against CSV backend...")
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SQLiteStore(os.path.join(tmp, 'grades.db'))
+            csv_store = self.app.store
+            self.assertEqual(len(store.students), len(csv_store.students))
+            self.assertEqual(store.students.get('student_1@mycsu.edu'),
+                             csv_store.students.get('student_1@mycsu.edu'))
+            self.assertEqual(store.students.find('Course.id', 'ENG202'),
+                             csv_store.students.find('Course.id', 'ENG202'))
+            self.assertEqual(store.course_stats('MATH101'), csv_store.course_stats('MATH101'))
+            self.assertIsNone(store.course_stats('TBD'))
+
+            self.assertTrue(store.courses.insert({'Course_id': 'SQL100', 'Course_name': 'SQL',
+                                                  'Credits': 3, 'Description': ''}))
+            self.assertFalse(store.courses.insert({'Course_id': 'SQL100'}))
+            self.assertEqual(store.courses.update('SQL100', {'Credits': 4})['Credits'], '4')
+            self.assertEqual(store.courses.last()['Course_id'], 'SQL100')
+            store.courses.delete('SQL100')
+            self.assertNotIn('SQL100', store.courses)
+            store.close()
+    # Course statistics maintained incrementally on writes
+    def test_incremental_course_statistics(self):
+        print("\nTesting incrementally maintained course statistics...")
+        with tempfile.TemporaryDirectory() as tmp:
+            store = CSVStore(tmp)
+            for i, marks in enumerate([55, 91, 78, 78, 64]):
+                store.students.insert({'Email address': f's{i}@mycsu.edu', 'First name': 'S',
+                                       'Last name': str(i), 'Course.id': 'DATA200',
+                                       'grades': Grade.calculate_grade(marks), 'Marks': marks})
+            store.students.update('s1@mycsu.edu', {'Marks': 40, 'grades': 'F'})
+            store.students.update('s2@mycsu.edu', {'Course.id': 'MATH101'})
+            store.students.delete('s3@mycsu.edu')
+
+            for course_id in ('DATA200', 'MATH101'):
+                self.assertEqual(store.course_stats(course_id), DataStore.course_stats(store, course_id))
+            stats = store.course_stats('DATA200')
+            self.assertEqual((stats['min'], stats['max'], stats['count']), (40, 64, 3))
+            self.assertEqual(stats['grades'], {'F': 2, 'D': 1})
+            self.assertEqual(store.course_aggregates.get('DATA200').percentile(50), 55)
+            self.assertIsNone(store.course_stats('PHY303'))
+            CSVHandler.compact_all()
+    # Vectorized statistics for all courses
+    @unittest.skipIf(np is None, "NumPy not installed")
+    def test_vectorized_analytics_matches_course_statistics(self):
+        print("\nTesting vectorized analytics for every course...")
+        start = time.time()
+        summary = GradeAnalytics.from_rows(self.app.store.students.all()).summary()
+        print(f"All-course analytics took {time.time() - start:.6f} seconds")
+        for course_id, stats in summary.items():
+            expected = self.app.store.course_stats(course_id)
+            self.assertEqual((stats['count'], stats['median'], stats['min'], stats['max']),
+                             (expected['count'], expected['median'], expected['min'], expected['max']))
+            self.assertAlmostEqual(stats['mean'], expected['average'])
+            self.assertEqual(sum(stats['grades'].values()), stats['count'])
+        self.assertNotIn('TBD', summary)
+    # Table-driven grades and bulk regrading
+    def test_grade_table_and_regrade(self):
+        print("\nTesting grade lookup table and bulk regrade...")
+        for marks in list(range(0, 101)) + [-5, 101, 89.5]:
+            expected = next((gr['grade'] for gr in Grade.grade_ranges
+                             if gr['min'] <= marks <= gr['max']), 'F')
+            self.assertEqual(Grade.calculate_grade(marks), expected)
+
+        original = Grade.grade_ranges
+        with tempfile.TemporaryDirectory() as tmp:
+            store = DataStore.active = CSVStore(tmp)
+            for i, marks in enumerate([95, 85, 58]):
+                store.students.insert({'Email address': f's{i}@mycsu.edu', 'First name': 'S',
+                                       'Last name': str(i), 'Course.id': 'DATA200' if i else 'MATH101',
+                                       'grades': Grade.calculate_grade(marks), 'Marks': marks})
+            try:
+                Grade.set_grade_ranges([{"grade_id": 1, "grade": "A", "min": 85, "max": 100},
+                                        {"grade_id": 2, "grade": "P", "min": 55, "max": 84},
+                                        {"grade_id": 3, "grade": "F", "min": 0, "max": 54}])
+                self.assertEqual(Grade.regrade('DATA200'), 2)
+                self.assertEqual(store.students.get('s0@mycsu.edu')['grades'], 'A')
+                self.assertEqual(Grade.regrade(), 0)
+                rows = CSVHandler.load_data(os.path.join(tmp, 'students.csv'))
+                self.assertEqual([r['grades'] for r in rows], ['A', 'A', 'P'])
+            finally:
+                Grade.set_grade_ranges(original)
+                DataStore.active = self.app.store
+        self.assertEqual(Grade.calculate_grade(85), 'B')
+
+        # Editing a range in place is seen by the next lookup too.
+        try:
+            Grade.grade_ranges[0]['min'] = 85
+            self.assertEqual(Grade.calculate_grade(87), 'A')
+        finally:
+            Grade.grade_ranges[0]['min'] = 90
+        self.assertEqual(Grade.calculate_grade(87), 'B')
+    # Non-interactive bulk import with validation
+    def test_bulk_import_students(self):
+        print("\nTesting bulk student import...")
+        with tempfile.TemporaryDirectory() as tmp:
+            CSVHandler.save_data(os.path.join(tmp, 'courses.csv'), CSVHandler.load_courses(),
+                                 CSVHandler.COURSE_FIELDS)
+            store = CSVStore(tmp)
+            source = os.path.join(tmp, 'new_students.jsonl')
+            with open(source, 'w') as f:
+                for row in [
+                    {'Email address': 'a@mycsu.edu', 'First name': 'A', 'Last name': 'One',
+                     'Course.id': 'DATA200', 'Marks': 91},
+                    {'Email address': 'a@mycsu.edu', 'First name': 'A', 'Last name': 'Again',
+                     'Course.id': 'DATA200', 'Marks': 50},
+                    {'Email address': 'b@mycsu.edu', 'First name': 'B', 'Last name': 'Two',
+                     'Course.id': 'NOPE999', 'Marks': 70},
+                    {'Email address': 'c@mycsu.edu', 'First name': 'C', 'Last name': 'Three',
+                     'Course.id': 'MATH101', 'Marks': 140},
+                    {'Email address': 'd@mycsu.edu', 'First name': 'D', 'Last name': 'Four',
+                     'Course.id': 'MATH101', 'Marks': 65, 'Password': 'secret'},
+                ]:
+                    f.write(json.dumps(row) + '\n')
+
+            report = BulkLoader(store).import_file('students', source)
+            self.assertEqual(report['accepted'], 2)
+            self.assertEqual([line for line, _, _ in report['rejected']], [2, 3, 4])
+
+            reloaded = CSVStore(tmp)
+            self.assertEqual(reloaded.students.get('a@mycsu.edu')['grades'], 'A')
+            self.assertEqual(reloaded.students.get('d@mycsu.edu')['grades'], 'D')
+            self.assertTrue(LoginUser.verify_password(
+                'd@mycsu.edu', 'secret', reloaded.login.get('d@mycsu.edu')['Password']))
+            self.assertEqual(BulkLoader(reloaded).export_file('students', os.path.join(tmp, 'out.csv')), 2)
+
+            # A failed login write leaves no students without logins.
+            with open(source, 'w') as f:
+                for email in ('e@mycsu.edu', 'f@mycsu.edu'):
+                    f.write(json.dumps({'Email address': email, 'First name': 'E', 'Last name': 'Five',
+                                        'Course.id': 'MATH101', 'Marks': 75}) + '\n')
+            sqlite_dir = os.path.join(tmp, 'sqlite')
+            os.mkdir(sqlite_dir)
+            CSVHandler.save_data(os.path.join(sqlite_dir, 'courses.csv'), CSVHandler.load_courses(),
+                                 CSVHandler.COURSE_FIELDS)
+            for target in (reloaded, SQLiteStore(os.path.join(sqlite_dir, 'grades.db'), sqlite_dir)):
+                with patch.object(target.login, 'apply_changes', side_effect=OSError("disk full")):
+                    self.assertRaises(OSError, BulkLoader(target).import_file, 'students', source)
+                if isinstance(target, SQLiteStore):
+                    self.assertNotIn('e@mycsu.edu', target.students)
+                    target.close()
+                else:
+                    # The CSV store's redo log finishes the import when it is next opened.
+                    target = CSVStore(tmp)
+                    self.assertIn('e@mycsu.edu', target.students)
+                    # Each default password has a salt of its own.
+                    hashes = [target.login.get(email)['Password'] for email in ('e@mycsu.edu', 'f@mycsu.edu')]
+                    self.assertNotEqual(hashes[0], hashes[1])
+                    self.assertTrue(all(PasswordHasher.verify('default', h) for h in hashes))
+            CSVHandler.compact_all()
+    # Streaming reader with journal overlay, projection and early exit
+    def test_streaming_reader(self):
+        print("\nTesting streaming CSV reader...")
+        fields = CSVHandler.COURSE_FIELDS
+        course = lambda cid, name: {'Course_id': cid, 'Course_name': name,
+                                    'Credits': '3', 'Description': ''}
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'courses.csv')
+            CSVHandler.save_data(filename, [course(f'C{i}', f'n{i}') for i in range(5)], fields)
+            CSVHandler.log_change(filename, 'update', course('C1', 'one'), 'Course_id', fields)
+            CSVHandler.log_change(filename, 'delete', course('C0', ''), 'Course_id', fields)
+            CSVHandler.log_change(filename, 'delete', course('C2', ''), 'Course_id', fields)
+            CSVHandler.append_row(filename, course('C9', 'nine'), fields, 'Course_id')
+            CSVHandler.append_row(filename, course('C2', 'two'), fields, 'Course_id')
+
+            self.assertEqual(list(CSVHandler.iter_columns(filename, ['Course_id', 'Course_name'])),
+                             [('C1', 'one'), ('C3', 'n3'), ('C4', 'n4'), ('C9', 'nine'), ('C2', 'two')])
+            self.assertEqual(CSVHandler.load_data(filename)[0], course('C1', 'one'))
+            self.assertEqual(CSVHandler.find_first(filename, lambda r: r['Course_name'] == 'n4'),
+                             course('C4', 'n4'))
+            self.assertIsNone(CSVHandler.find_first(filename, lambda r: r['Course_id'] == 'C0'))
+            CSVHandler.compact(filename, fields)
+            self.assertEqual([r['Course_id'] for r in CSVHandler.iter_rows(filename)],
+                             ['C1', 'C3', 'C4', 'C9', 'C2'])
+    # Compact slotted records behave like the CSV row dicts
+    def test_student_record_acts_like_row(self):
+        print("\nTesting compact student records...")
+        row = {'Email address': 'r@mycsu.edu', 'First name': 'R', 'Last name': 'Ec',
+               'Course.id': 'DATA' + '200', 'grades': 'B', 'Marks': '85'}
+        record = StudentRecord.from_mapping(row)
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertEqual(record, row)
+        self.assertEqual(dict(record), row)
+        self.assertIs(record['Course.id'], StudentRecord.from_mapping(dict(row))['Course.id'])
+        record.update({'Marks': 60, 'grades': 'D'})
+        self.assertEqual((record['Marks'], record.get('grades'), record.get('nope')), (60, 'D', None))
+        with self.assertRaises(KeyError):
+            record['nope']
+        self.assertIsInstance(self.app.store.students.get('student_0@mycsu.edu'), StudentRecord)
+    # Salted password hashes, legacy migration and verification cache
+    def test_password_hash_migration(self):
+        print("\nTesting hashed passwords and Caesar migration...")
+        hashed = PasswordHasher.hash('Secret1')
+        self.assertNotEqual(hashed, PasswordHasher.hash('Secret1'))
+        self.assertTrue(PasswordHasher.verify('Secret1', hashed))
+        self.assertFalse(PasswordHasher.verify('secret1', hashed))
+        self.assertFalse(PasswordHasher.needs_rehash(hashed))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = DataStore.active = CSVStore(tmp)
+            try:
+                store.login.insert({'User id': 'old@mycsu.edu', 'Role': 'student',
+                                    'Password': LoginUser.encrypt_password('Legacy9')})
+                legacy = store.login.get('old@mycsu.edu')['Password']
+                self.assertFalse(LoginUser.verify_password('old@mycsu.edu', 'wrong', legacy))
+                self.assertEqual(store.login.get('old@mycsu.edu')['Password'], legacy)
+
+                self.assertTrue(LoginUser.verify_password('old@mycsu.edu', 'Legacy9', legacy))
+                migrated = CSVStore(tmp).login.get('old@mycsu.edu')['Password']
+                self.assertTrue(PasswordHasher.is_hashed(migrated))
+                self.assertIn(('old@mycsu.edu', migrated), LoginUser.verified.entries)
+
+                with patch.object(PasswordHasher, 'verify', side_effect=AssertionError):
+                    self.assertTrue(LoginUser.verify_password('old@mycsu.edu', 'Legacy9', migrated))
+                self.assertFalse(LoginUser.verify_password('old@mycsu.edu', 'Legacy8', migrated))
+            finally:
+                DataStore.active = self.app.store
+                CSVHandler.compact_all()
+
+    def test_cipher_translate_and_rotation(self):
+        print("\nTesting Caesar translate tables and key rotation...")
+        cipher = TextSecurity(3)
+        self.assertEqual(cipher.encrypt('Abc-xyZ 9'), 'Def-abC 9')
+        self.assertEqual(list(cipher.decrypt_many(cipher.encrypt_many(['Pass1', 'zZ']))), ['Pass1', 'zZ'])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = DataStore.active = CSVStore(tmp)
+            path = os.path.join(tmp, 'login.csv')
+            try:
+                hashed = PasswordHasher.hash('Kept1')
+                store.login.insert_many([
+                    {'User id': 'old@mycsu.edu', 'Role': 'student',
+                     'Password': LoginUser.encrypt_password('Legacy9')},
+                    {'User id': 'new@mycsu.edu', 'Role': 'student', 'Password': hashed}])
+                self.assertEqual(LoginUser.rotate_cipher(10, path), 1)
+                store.login.refresh()
+                rotated = store.login.get('old@mycsu.edu')['Password']
+                self.assertEqual(rotated, 'caesar$10$' + TextSecurity(10).encrypt('Legacy9'))
+                self.assertEqual(store.login.get('new@mycsu.edu')['Password'], hashed)
+                self.assertTrue(LoginUser.verify_password('old@mycsu.edu', 'Legacy9', rotated))
+            finally:
+                DataStore.active = self.app.store
+                CSVHandler.compact_all()
+
+    def test_service_layer_without_console(self):
+        print("\nTesting the service layer without input()...")
+        with tempfile.TemporaryDirectory() as tmp:
+            service = GradeService(CSVStore(tmp))
+            service.add_course('SVC100', 'Services', 3, 'No prompts')
+            with patch('builtins.input', side_effect=AssertionError):
+                student = service.add_student('svc@mycsu.edu', 'Ser', 'Vice', 'SVC100', '72')
+                self.assertEqual(student['grades'], 'C')
+                self.assertEqual(service.set_marks('svc@mycsu.edu', 95, 'SVC100')['grades'], 'A')
+                self.assertEqual(service.update_student('svc@mycsu.edu', first_name='Serv')['First name'], 'Serv')
+                self.assertEqual(service.authenticate('svc@mycsu.edu', 'default'),
+                                 {'email': 'svc@mycsu.edu', 'role': 'student'})
+                stats = service.course_stats('SVC100')
+                self.assertEqual((stats['count'], stats['max']), (1, 95))
+
+                for call in (lambda: service.add_student('svc@mycsu.edu', 'A', 'B', 'SVC100', 50),
+                             lambda: service.add_student('x@mycsu.edu', 'A', 'B', 'NOPE', 50),
+                             lambda: service.set_marks('svc@mycsu.edu', 101),
+                             lambda: service.set_marks('svc@mycsu.edu', 50, 'OTHER'),
+                             lambda: service.authenticate('svc@mycsu.edu', 'wrong'),
+                             lambda: service.update_student('svc@mycsu.edu', grades='A')):
+                    self.assertRaises(ServiceError, call)
+
+                service.delete_student('svc@mycsu.edu')
+                self.assertNotIn('svc@mycsu.edu', service.store.login)
+                self.assertRaises(ServiceError, service.course_stats, 'SVC100')
+            CSVHandler.compact_all()
+
+    def test_http_server_endpoints(self):
+        print("\nTesting the asyncio HTTP/JSON server...")
+
+        async def call(port, method, path, body=None, token=''):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            data = json.dumps(body).encode() if body is not None else b''
+            writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\n"
+                         f"Authorization: Bearer {token}\r\nConnection: close\r\n\r\n".encode() + data)
+            head, _, payload = (await reader.read()).partition(b'\r\n\r\n')
+            writer.close()
+            return int(head.split()[1]), json.loads(payload)
+
+        async def scenario(store):
+            server = await GradeServer(store, port=0).start()
+            try:
+                port = server.port
+                status, session = await call(port, 'POST', '/login',
+                                             {'email': 'web@mycsu.edu', 'password': 'default'})
+                self.assertEqual((status, session['role']), (200, 'student'))
+                status, _ = await call(port, 'POST', '/login', {'email': 'web@mycsu.edu', 'password': 'x'})
+                self.assertEqual(status, 400)
+                student = session['token']
+                _, prof = await call(port, 'POST', '/login', {'email': 'webprof@mycsu.edu',
+                                                              'password': 'default'})
+                prof = prof['token']
+
+                self.assertEqual((await call(port, 'GET', '/students/web@mycsu.edu'))[0], 401)
+                self.assertEqual((await call(port, 'PUT', '/students/web@mycsu.edu/marks',
+                                             {'marks': 10}, student))[0], 403)
+                results = await asyncio.gather(*(call(port, 'PUT', '/students/web%40mycsu.edu/marks',
+                                                      {'marks': m}, prof) for m in (55, 65, 85)))
+                self.assertTrue(all(status == 200 for status, _ in results))
+                status, report = await call(port, 'GET', '/students/web@mycsu.edu/report', token=student)
+                self.assertEqual(status, 200)
+                self.assertIn((str(report['Marks']), report['grades']), {('55', 'F'), ('65', 'D'), ('85', 'B')})
+                status, stats = await call(port, 'GET', '/courses/WEB100/stats', token=student)
+                self.assertEqual((status, stats['count']), (200, 1))
+                self.assertEqual((await call(port, 'GET', '/students/nobody@mycsu.edu', token=prof))[0], 404)
+                self.assertEqual((await call(port, 'GET', '/nowhere', token=prof))[0], 404)
+
+                # Statuses follow the exception type; a crash tells the client nothing.
+                with patch.object(server.service, 'list_courses', side_effect=NotFound("Gone!")):
+                    self.assertEqual((await call(port, 'GET', '/courses'))[0], 404)
+                with patch.object(server.service, 'list_courses', side_effect=ServiceError("not found")):
+                    self.assertEqual((await call(port, 'GET', '/courses'))[0], 400)
+                with patch.object(server.service, 'list_courses', side_effect=RuntimeError("/srv/secret")), \
+                        self.assertLogs('checkmygrade.server', 'ERROR') as logs:
+                    self.assertEqual(await call(port, 'GET', '/courses'), (500, {'error': 'Internal Server Error'}))
+                self.assertEqual(str(logs.records[0].exc_info[1]), "/srv/secret")
+
+                # A slow write runs on a worker thread and leaves the event loop free.
+                set_marks = server.service.set_marks
+
+                def slow_set_marks(*args):
+                    time.sleep(0.5)
+                    return set_marks(*args)
+
+                loop = asyncio.get_running_loop()
+                with patch.object(server.service, 'set_marks', side_effect=slow_set_marks):
+                    put = asyncio.ensure_future(call(port, 'PUT', '/students/web@mycsu.edu/marks',
+                                                     {'marks': 75}, prof))
+                    await asyncio.sleep(0.1)
+                    start = loop.time()
+                    await asyncio.sleep(0.01)
+                    self.assertLess(loop.time() - start, 0.3)
+                    self.assertEqual((await put)[0], 200)
+                await call(port, 'POST', '/logout', token=student)
+                self.assertEqual((await call(port, 'GET', '/students/web@mycsu.edu', token=student))[0], 401)
+            finally:
+                await server.close()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = CSVStore(tmp)
+            service = GradeService(store)
+            service.add_course('WEB100', 'Web', 3)
+            service.add_student('web@mycsu.edu', 'We', 'B', 'WEB100', 40)
+            service.add_professor('webprof@mycsu.edu', 'Dr. Web', 'Senior', 'WEB100')
+            try:
+                asyncio.run(scenario(store))
+            finally:
+                CSVHandler.compact_all()
+
+    def test_sessions_cache_authorization(self):
+        print("\nTesting session tokens, expiry and invalidation...")
+        with tempfile.TemporaryDirectory() as tmp:
+            store = CSVStore(tmp)
+            service = GradeService(store)
+            now = [0]
+            service.sessions.clock = lambda: now[0]
+            try:
+                service.add_course('SES100', 'Sessions', 3)
+                service.add_course('SES200', 'More sessions', 3)
+                service.add_professor('ses@mycsu.edu', 'Dr. Session', 'Senior', 'SES100')
+                session = service.login('ses@mycsu.edu', 'default')
+                self.assertEqual((session.role, session.course_id), ('professor', 'SES100'))
+
+                with patch.object(CSVHandler, 'file_version', side_effect=AssertionError):
+                    self.assertIs(service.session(session.token), session)
+                    self.assertEqual(service.session_course(session), 'SES100')
+
+                # Another process's write is seen once the recheck interval is up.
+                CSVStore(tmp).professors.update('ses@mycsu.edu', {'Course.id': 'SES200'})
+                self.assertEqual(service.session(session.token).course_id, 'SES100')
+                now[0] = 1
+                self.assertEqual(service.session(session.token).course_id, 'SES200')
+
+                service.sessions.ttl = 90
+                short = service.login('ses@mycsu.edu', 'default')
+                now[0] = 61
+                self.assertIs(service.session(short.token), short)
+                now[0] = 121
+                self.assertRaises(SessionExpired, service.session, short.token)
+
+                service.delete_professor('ses@mycsu.edu')
+                self.assertRaises(SessionExpired, service.session, session.token)
+            finally:
+                CSVHandler.compact_all()
+
+    def test_load_cache_tracks_file_changes(self):
+        print("\nTesting the load_data cache and its invalidation...")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'courses.csv')
+            fields = CSVHandler.COURSE_FIELDS
+            CSVHandler.save_data(path, [{'Course_id': 'C1', 'Course_name': 'One', 'Credits': 3,
+                                         'Description': ''}], fields)
+            CSVHandler.clear_cache()
+            first = CSVHandler.load_data(path)
+            first[0]['Course_name'] = 'Changed by caller'
+            self.assertEqual(CSVHandler.load_data(path)[0]['Course_name'], 'One')
+            self.assertEqual(CSVHandler.cache_stats()['hits'], 1)
+
+            CSVHandler.append_row(path, {'Course_id': 'C2', 'Course_name': 'Two', 'Credits': 3,
+                                         'Description': ''}, fields, 'Course_id')
+            self.assertEqual(len(CSVHandler.load_data(path)), 2)
+
+            with open(path, 'a') as f:  # another program editing the file
+                f.write('C3,Three,4,\n')
+            self.assertEqual([r['Course_id'] for r in CSVHandler.load_data(path)], ['C1', 'C2', 'C3'])
+            self.assertEqual(CSVHandler.cache_stats(), {'hits': 1, 'misses': 3, 'files': 1})
+            CSVHandler.clear_cache()
+
+            # Reading takes no lock file of its own.
+            missing = os.path.join(tmp, 'enrollments.csv')
+            self.assertEqual(CSVHandler.load_data(missing), [])
+            self.assertFalse(os.path.exists(missing + '.lock'))
+
+            # The load_* helpers read through the same cache.
+            cwd = os.getcwd()
+            shutil.copy('students.csv', tmp)
+            os.chdir(tmp)
+            try:
+                students = CSVHandler.load_students()
+                self.assertEqual(CSVHandler.load_students(), students)
+                self.assertEqual(CSVHandler.cache_stats()['hits'], 1)
+                CSVHandler.save_students(students[:1])
+                self.assertEqual(len(CSVHandler.load_students()), 1)
+                with open('students.csv', 'a') as f:  # another program adding a row
+                    f.write('extra@mycsu.edu,Ex,Tra,DATA200,A,95\n')
+                self.assertEqual(len(CSVHandler.load_students()), 2)
+                self.assertEqual(CSVHandler.cache_stats()['hits'], 1)
+            finally:
+                os.chdir(cwd)
+                CSVHandler.clear_cache()
+
+    def test_batch_reports_per_course(self):
+        print("\nTesting batch report generation...")
+        with tempfile.TemporaryDirectory() as tmp:
+            service = GradeService(CSVStore(tmp))
+            try:
+                for course_id in ('REP100', 'REP/200'):
+                    service.add_course(course_id, course_id, 3)
+                for i, marks in enumerate((90, 70, 50, 80, 60)):
+                    service.add_student(f'rep{i}@mycsu.edu', 'Rep', str(i),
+                                        'REP100' if i % 2 == 0 else 'REP/200', marks)
+
+                serial = ReportBuilder(service.store, 'json', workers=1).build(
+                    os.path.join(tmp, 'serial'), progress=False)
+                parallel = ReportBuilder(service.store, 'json', workers=2, chunk_size=1).build(
+                    os.path.join(tmp, 'parallel'), progress=False)
+                self.assertEqual((parallel['students'], parallel['courses']), (5, 2))
+                for a, b in zip(serial['files'], parallel['files']):
+                    with open(a) as fa, open(b) as fb:
+                        self.assertEqual(fa.read(), fb.read())
+                self.assertEqual([os.path.basename(p) for p in parallel['files']],
+                                 ['REP100.jsonl', 'REP_200.jsonl'])
+                with open(parallel['files'][0]) as f:
+                    reports = [json.loads(line) for line in f]
+                self.assertEqual([(r['Email address'], r['Percentile'], r['Course median'])
+                                  for r in reports],
+                                 [('rep0@mycsu.edu', 66.7, 60), ('rep2@mycsu.edu', 0.0, 60),
+                                  ('rep4@mycsu.edu', 33.3, 60)])
+
+                result = ReportBuilder(service.store, 'csv', workers=1).build(
+                    os.path.join(tmp, 'csv'), progress=False)
+                with open(result['files'][1]) as f:
+                    rows = list(csv.DictReader(f))
+                self.assertEqual([(r['Marks'], r['Course average']) for r in rows],
+                                 [('70', '75.0'), ('80', '75.0')])
+
+                # Course ids that clean up to the same name still get a file each.
+                service.add_course('REP_200', 'REP_200', 3)
+                service.add_student('rep5@mycsu.edu', 'Rep', '5', 'REP_200', 75)
+                result = ReportBuilder(service.store, 'json', workers=1).build(
+                    os.path.join(tmp, 'clash'), progress=False)
+                courses = []
+                for path in result['files']:
+                    with open(path) as f:
+                        courses.append(sorted({json.loads(line)['Course.id'] for line in f}))
+                self.assertEqual(len(set(result['files'])), 3)
+                self.assertEqual(sorted(courses), [['REP/200'], ['REP100'], ['REP_200']])
+            finally:
+                CSVHandler.compact_all()
+
+    def test_sorted_indexes_and_range_queries(self):
+        print("\nTesting sorted indexes, top-k, rank, range and paging...")
+        rng = random.Random(7)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = CSVStore(tmp)
+            try:
+                store.students.insert_many([{
+                    'Email address': f's{i:03d}@mycsu.edu', 'First name': rng.choice('ABC'),
+                    'Last name': rng.choice(['Lee', 'Diaz', 'Kim', 'Ng']),
+                    'Course.id': rng.choice(['R1', 'R2']), 'grades': '',
+                    'Marks': rng.choice([str(rng.randint(0, 100)), 'Unavailable'])} for i in range(300)])
+                for i in range(0, 300, 7):
+                    store.students.update(f's{i:03d}@mycsu.edu', {'Marks': rng.randint(0, 100)})
+                for i in range(0, 300, 11):
+                    store.students.delete(f's{i:03d}@mycsu.edu')
+                sqlite_store = SQLiteStore(os.path.join(tmp, 'rank.db'), tmp)
+
+                def emails(rows):
+                    return [r['Email address'] for r in rows]
+
+                for target in (store, sqlite_store):
+                    for course in ('R1', None):
+                        for order in DataStore.ORDERS:
+                            for reverse in (False, True):
+                                got, total = target.students_page(order, 5, 17, course, reverse)
+                                want, want_total = DataStore.students_page(store, order, 5, 17, course, reverse)
+                                self.assertEqual((emails(got), total), (emails(want), want_total))
+                        self.assertEqual(emails(target.students_in_range(60, 69, course)),
+                                         emails(DataStore.students_in_range(store, 60, 69, course)))
+                        self.assertEqual(emails(target.top_students(5, course, lowest=True)),
+                                         emails(DataStore.top_students(store, 5, course, lowest=True)))
+                    for email in ('s001@mycsu.edu', 's007@mycsu.edu', 's150@mycsu.edu'):
+                        self.assertEqual(target.student_rank(email), DataStore.student_rank(store, email))
+                sqlite_store.close()
+
+                top = store.top_students(3, 'R2')
+                self.assertEqual([int(s['Marks']) for s in top],
+                                 sorted((int(s['Marks']) for s in store.students.find('Course.id', 'R2')
+                                         if str(s['Marks']).isdigit()), reverse=True)[:3])
+                self.assertTrue(all(60 <= int(s['Marks']) <= 69 for s in store.students_in_range(60, 69)))
+                page = GradeService(store).list_students('R1', 'email', page=2, size=10)
+                self.assertEqual(page['pages'], math.ceil(page['total'] / 10))
+            finally:
+                CSVHandler.compact_all()
+
+    def test_relations_cascade_in_one_pass(self):
+        print("\nTesting foreign keys and cascading deletes...")
+        with tempfile.TemporaryDirectory() as tmp:
+            service = GradeService(CSVStore(tmp))
+            store = service.store
+            try:
+                service.add_course('REL100', 'Relations', 3)
+                service.add_course('REL200', 'Other', 3)
+                for i in range(3):
+                    service.add_student(f'rel{i}@mycsu.edu', 'Rel', str(i), 'REL100', 70)
+                service.add_student('keep@mycsu.edu', 'Keep', 'Me', 'REL200', 70)
+                service.add_professor('relprof@mycsu.edu', 'Dr. Rel', 'Senior', 'REL100')
+                self.assertRaises(IntegrityError, service.add_professor, 'x@mycsu.edu', 'X', 'Junior', 'NOPE')
+                self.assertRaises(IntegrityError, service.update_student, 'keep@mycsu.edu', course_id='NOPE')
+                self.assertEqual(service.relations.violations(), [])
+
+                with self.assertRaises(IntegrityError):
+                    service.delete_course('REL100')
+                self.assertIn('REL100', store.courses)
+
+                writes = Counter()
+                real_log, real_save = CSVHandler.log_ops, CSVHandler.save_data
+                with patch.object(CSVHandler, 'log_ops', side_effect=lambda f, *a: (
+                                      writes.update([os.path.basename(f)]), real_log(f, *a))), \
+                     patch.object(CSVHandler, 'save_data', side_effect=lambda f, *a: (
+                                      writes.update([os.path.basename(f)]), real_save(f, *a))):
+                    changed = service.delete_course('REL100', cascade=True)
+                self.assertEqual(changed, {'students': 3, 'professors': 1, 'login': 3, 'courses': 1})
+                self.assertEqual(set(writes.values()), {1})
+                self.assertEqual(len(writes), 4)
+
+                store = CSVStore(tmp)
+                self.assertEqual(store.students.keys(), ['keep@mycsu.edu'])
+                self.assertEqual(store.professors.get('relprof@mycsu.edu')['Course.id'], 'TBD')
+                self.assertNotIn('rel0@mycsu.edu', store.login)
+
+                store.students.insert({'Email address': 'ghost@mycsu.edu', 'First name': 'G',
+                                       'Last name': 'H', 'Course.id': 'GONE', 'grades': '', 'Marks': ''})
+                self.assertEqual(sorted(Relations(store).violations()),
+                                 [('students', 'ghost@mycsu.edu', "Course.id 'GONE' is not in courses"),
+                                  ('students', 'ghost@mycsu.edu', 'no login')])
+                Relations(store).delete('login', 'keep@mycsu.edu')
+                self.assertNotIn('keep@mycsu.edu', store.students)
+            finally:
+                CSVHandler.compact_all()
+
+    def test_unit_of_work_all_or_nothing(self):
+        print("\nTesting transactions across tables...")
+        with tempfile.TemporaryDirectory() as tmp:
+            service = GradeService(CSVStore(tmp))
+            store = service.store
+            try:
+                service.add_course('TX100', 'Transactions', 3)
+                writes = Counter()
+                real_log = CSVHandler.log_ops
+                with patch.object(CSVHandler, 'log_ops', side_effect=lambda f, *a: (
+                                      writes.update([os.path.basename(f)]), real_log(f, *a))):
+                    service.add_student('tx@mycsu.edu', 'Tx', 'One', 'TX100', 88)
+                self.assertEqual(writes, Counter({'students.csv': 1, 'login.csv': 1}))
+                self.assertIn('tx@mycsu.edu', store.login)
+
+                with self.assertRaises(RuntimeError):
+                    with store.transaction() as tx:
+                        tx.update('students', 'tx@mycsu.edu', {'Marks': '10'})
+                        tx.delete('courses', 'TX100')
+                        raise RuntimeError("abort")
+                self.assertEqual(str(store.students.get('tx@mycsu.edu')['Marks']), '88')
+                with self.assertRaises(IntegrityError):
+                    with store.transaction() as tx:
+                        tx.delete('courses', 'TX100')
+                self.assertIn('TX100', store.courses)
+
+                service.add_professor('txprof@mycsu.edu', 'Dr. Tx', 'Senior', 'TBD')
+                with patch.object(DataStore, 'commit_changes', side_effect=RuntimeError("crash")):
+                    self.assertRaises(RuntimeError, service.add_course, 'TX200', 'Crash', 3,
+                                      professor='txprof@mycsu.edu')
+                self.assertEqual(len(store.redo_paths()), 1)
+                store = CSVStore(tmp)
+                self.assertEqual(store.redo_paths(), [])
+                self.assertIn('TX200', store.courses)
+                self.assertEqual(store.professors.get('txprof@mycsu.edu')['Course.id'], 'TX200')
+            finally:
+                CSVHandler.compact_all()
+
+    def test_benchmark_suite_results(self):
+        print("\nTesting the benchmark suite on synthetic data...")
+        import Benchmark
+        with patch('sys.stdout'):
+            results = Benchmark.bench_suite([300], repeat=2, warmup=1, batch=50)
+        self.assertEqual([r['operation'] for r in results['results']],
+                         ['login', 'display_records', 'display_grade_report', 'get_course_statistics',
+                          'add_student', 'delete_student', 'bulk_update_50'])
+        for r in results['results']:
+            self.assertEqual(r['rows'], 300)
+            self.assertTrue(0 < r['min'] <= r['median'] <= r['max'])
+        json.dumps(results)
+
+        slower = json.loads(json.dumps(results))
+        slower['results'][3]['median'] *= 2
+        rows, regressions = Benchmark.compare_results(results, slower, threshold=1.5)
+        self.assertEqual(len(rows), 7)
+        self.assertEqual([r[0] for r in regressions], ['get_course_statistics'])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            Benchmark.write_data_dir(tmp, 500)
+            store = CSVStore(tmp)
+            try:
+                store.top_students(5)
+                rng = random.Random(3)
+                store.students.update_many({f"student_{rng.randrange(500)}@mycsu.edu": {'Marks': m}
+                                            for m in range(100)})
+                expected = sorted(store.students.all(), key=lambda s: (-int(s['Marks']), s['Email address']))
+                self.assertEqual([s['Email address'] for s in store.top_students(20)],
+                                 [s['Email address'] for s in expected[:20]])
+            finally:
+                CSVHandler.compact_all()
+
+    def test_metrics_instrumentation(self):
+        print("\nTesting metrics and profiling...")
+        Metrics.reset()
+        CSVHandler.load_data('students.csv')
+        self.assertEqual(Metrics.snapshot(), {})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            Metrics.enabled = True
+            try:
+                service = GradeService(CSVStore(tmp))
+                service.add_course('MET100', 'Metrics', 3)
+                service.add_student('met@mycsu.edu', 'Met', 'Rics', 'MET100', 90)
+                CSVHandler.compact_all()
+                CSVHandler.clear_cache()
+                self.assertTrue(LoginUser.check_password('met@mycsu.edu', 'default',
+                                                         service.store.login.get('met@mycsu.edu')['Password']))
+                scanned = Metrics.snapshot()['csv.scan']
+                rows = CSVHandler.load_data(os.path.join(tmp, 'students.csv'))
+                with self.assertRaises(KeyError):
+                    with Metrics.measure('test.block'):
+                        raise KeyError('x')
+            finally:
+                Metrics.enabled = False
+                CSVHandler.compact_all()
+
+            ops = Metrics.snapshot()
+            self.assertEqual(ops['csv.log_ops']['count'], 3)  # courses, students, login
+            self.assertEqual(ops['csv.log_ops']['rows'], 3)
+            self.assertGreater(ops['csv.log_ops']['bytes_written'], 0)
+            self.assertEqual(ops['csv.load_data']['count'], 1)
+            self.assertEqual(ops['csv.scan']['rows'] - scanned['rows'], len(rows))
+            self.assertEqual(ops['csv.scan']['bytes_read'] - scanned['bytes_read'],
+                             os.path.getsize(os.path.join(tmp, 'students.csv')))
+            self.assertGreater(ops['csv.save_data']['bytes_written'], 0)
+            self.assertEqual(ops['auth.hash']['count'], 1)
+            self.assertEqual(ops['auth.check_password']['count'], 1)
+            self.assertEqual(ops['test.block']['errors'], 1)
+            for op in ops.values():
+                self.assertEqual(sum(op['histogram'].values()), op['count'])
+
+            dump = os.path.join(tmp, 'metrics.json')
+            Metrics.dump(dump)
+            profile = os.path.join(tmp, 'run.prof')
+            with patch('builtins.print') as printed:
+                main(['--profile', profile, 'metrics', dump])
+            self.assertTrue(os.path.getsize(profile) > 0)
+            self.assertIn('csv.log_ops', ''.join(str(c) for c in printed.call_args_list))
+        Metrics.reset()
+
+    def test_snapshot_cold_start(self):
+        print("\nTesting the binary snapshot...")
+        import Benchmark
+        with tempfile.TemporaryDirectory() as tmp:
+            Benchmark.write_data_dir(tmp, 2000)
+            try:
+                parsed = CSVStore(tmp)
+                parsed.students.update('student_7@mycsu.edu', {'Marks': 'Unavailable', 'grades': 'Unavailable'})
+                parsed.save_snapshot()
+                path = parsed.snapshot_path()
+                self.assertTrue(os.path.exists(path))
+
+                with patch.object(CSVHandler, 'iter_rows', side_effect=AssertionError("parsed a CSV")):
+                    loaded = CSVStore(tmp)
+                for name in ('students', 'professors', 'courses', 'login'):
+                    self.assertEqual([r.to_dict() for r in getattr(loaded, name).all()],
+                                     [r.to_dict() for r in getattr(parsed, name).all()])
+                self.assertEqual(loaded.students.get('student_7@mycsu.edu')['Marks'], 'Unavailable')
+                self.assertEqual(sorted(loaded.students.values('Course.id')),
+                                 sorted(parsed.students.values('Course.id')))
+                for course_id in ('C000', 'C017'):
+                    self.assertEqual(loaded.course_stats(course_id), parsed.course_stats(course_id))
+                    for order in DataStore.ORDERS:
+                        self.assertEqual(loaded.students_page(order, 5, 20, course_id),
+                                         parsed.students_page(order, 5, 20, course_id))
+                self.assertEqual(loaded.top_students(10), parsed.top_students(10))
+
+                # A write makes the snapshot stale: the next start parses and rewrites it.
+                loaded.students.update('student_8@mycsu.edu', {'Marks': '100'})
+                CSVHandler.compact_all()
+                stale = os.path.getmtime(path)
+                fresh = CSVStore(tmp)
+                self.assertEqual(str(fresh.students.get('student_8@mycsu.edu')['Marks']), '100')
+                self.assertEqual(fresh.top_students(1)[0]['Marks'], '100')
+                self.assertGreaterEqual(os.path.getmtime(path), stale)
+
+                # A lazy session checks the CRC32 once, and its snapshot copies
+                # the tables it never loaded instead of parsing them.
+                Snapshot._verified.clear()
+                lazy = CSVStore(tmp, lazy=True)
+                with patch.object(zlib, 'crc32', wraps=zlib.crc32) as crc32:
+                    lazy.professors.all()
+                    lazy.courses.update('C000', {'Credits': '5'})
+                self.assertEqual(crc32.call_count, 1)
+                lazy.compact()
+                with patch.object(CSVHandler, 'iter_rows', side_effect=AssertionError("parsed a CSV")):
+                    self.assertTrue(lazy.save_snapshot())
+                    again = CSVStore(tmp)
+                self.assertEqual(str(again.courses.get('C000')['Credits']), '5')
+                self.assertEqual(again.course_stats('C017'), fresh.course_stats('C017'))
+                self.assertEqual(again.students_page('name', 5, 20), fresh.students_page('name', 5, 20))
+
+                # A damaged snapshot is ignored.
+                with open(path, 'r+b') as f:
+                    f.seek(-10, os.SEEK_END)
+                    f.write(b'\xff' * 10)
+                with patch.object(Table, 'reload', autospec=True, side_effect=Table.reload) as reload:
+                    CSVStore(tmp)
+                self.assertEqual(reload.call_count, 6)
+            finally:
+                CSVHandler.compact_all()
+
+    def test_offset_index_lookup(self):
+        print("\nTesting single-row lookups through the offset index...")
+        import Benchmark
+        with tempfile.TemporaryDirectory() as tmp:
+            Benchmark.write_data_dir(tmp, 500)
+            filename = os.path.join(tmp, 'students.csv')
+            key = 'Email address'
+            expected = {row[key]: row for row in CSVHandler.iter_rows(filename)}
+            self.assertTrue(os.path.exists(OffsetIndex.path(filename)))
+            try:
+                with patch.object(OffsetIndex, '_rebuild', side_effect=AssertionError("scanned the CSV")):
+                    for email in ('student_0@mycsu.edu', 'student_250@mycsu.edu', 'student_499@mycsu.edu'):
+                        self.assertEqual(CSVHandler.lookup(filename, key, email), expected[email])
+                    self.assertIsNone(CSVHandler.lookup(filename, key, 'nobody@mycsu.edu'))
+
+                    # A lazy store answers get() and `in` without loading its tables.
+                    store = CSVStore(tmp, lazy=True)
+                    self.assertEqual(store.students.get('student_7@mycsu.edu').to_dict(),
+                                     expected['student_7@mycsu.edu'])
+                    self.assertIn('student_7@mycsu.edu', store.login)
+                    self.assertNotIn('nobody@mycsu.edu', store.students)
+                    self.assertIsNone(store.students.rows)
+                    self.assertIsNone(store.login.rows)
+
+                    # Appended rows are found in the tail, journal entries are applied.
+                    added = {key: 'new@mycsu.edu', 'First name': 'Two\nLines, "quoted"', 'Last name': 'N',
+                             'Course.id': 'C001', 'grades': 'A', 'Marks': '95'}
+                    CSVHandler.append_rows(filename, [added], CSVHandler.STUDENT_FIELDS, key)
+                    self.assertEqual(CSVHandler.lookup(filename, key, 'new@mycsu.edu'), added)
+                    store.students.update('student_3@mycsu.edu', {'Marks': '1', 'grades': 'F'})
+                    store.students.delete('student_4@mycsu.edu')
+                    self.assertEqual(CSVHandler.lookup(filename, key, 'student_3@mycsu.edu')['Marks'], '1')
+                    self.assertIsNone(CSVHandler.lookup(filename, key, 'student_4@mycsu.edu'))
+
+                    # Compaction rewrites the CSV and its index.
+                    CSVHandler.compact_all()
+                    self.assertEqual(CSVHandler.lookup(filename, key, 'new@mycsu.edu'), added)
+                    self.assertEqual(CSVHandler.lookup(filename, key, 'student_3@mycsu.edu')['Marks'], '1')
+                    self.assertIsNone(CSVHandler.lookup(filename, key, 'student_4@mycsu.edu'))
+
+                # A CSV edited behind the index's back is scanned once and re-indexed.
+                with open(filename, 'w', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=CSVHandler.STUDENT_FIELDS)
+                    writer.writeheader()
+                    writer.writerow({**expected['student_9@mycsu.edu'], 'Marks': '42'})
+                self.assertEqual(CSVHandler.lookup(filename, key, 'student_9@mycsu.edu')['Marks'], '42')
+                self.assertIsNone(CSVHandler.lookup(filename, key, 'student_0@mycsu.edu'))
+                with patch.object(OffsetIndex, '_rebuild', side_effect=AssertionError("scanned the CSV")):
+                    self.assertEqual(CSVHandler.lookup(filename, key, 'student_9@mycsu.edu')['Marks'], '42')
+            finally:
+                CSVHandler.compact_all()
+
+    def test_multi_course_enrollments(self):
+        print("\nTesting students and professors in several courses...")
+        with tempfile.TemporaryDirectory() as tmp:
+            sqlite_dir = os.path.join(tmp, 'sqlite')
+            os.mkdir(sqlite_dir)
+            try:
+                for store in (CSVStore(tmp), SQLiteStore(os.path.join(sqlite_dir, 'grades.db'), sqlite_dir)):
+                    service = GradeService(store)
+                    for course_id in ('MC100', 'MC200', 'MC300'):
+                        service.add_course(course_id, course_id, 3)
+                    service.add_student('both@mycsu.edu', 'Both', 'Courses', 'MC100', 60)
+                    service.add_student('one@mycsu.edu', 'One', 'Course', 'MC200', 90)
+                    self.assertEqual(service.enroll('both@mycsu.edu', 'MC200', 80)['grades'], 'B')
+                    self.assertRaises(ServiceError, service.enroll, 'both@mycsu.edu', 'MC200')
+                    self.assertRaises(ServiceError, service.update_student, 'both@mycsu.edu',
+                                      course_id='MC200')
+
+                    self.assertEqual([c['Course.id'] for c in service.student_courses('both@mycsu.edu')],
+                                     ['MC100', 'MC200'])
+                    self.assertEqual(sorted(s['Email address'] for s in store.roster('MC200')),
+                                     ['both@mycsu.edu', 'one@mycsu.edu'])
+                    self.assertEqual(str(service.set_marks('both@mycsu.edu', 95, 'MC200')['Marks']), '95')
+                    self.assertEqual(str(store.students.get('both@mycsu.edu')['Marks']), '60')
+                    stats = store.course_stats('MC200')
+                    self.assertEqual((stats['count'], stats['min'], stats['max']), (2, 90, 95))
+                    self.assertEqual([s['Email address'] for s in store.top_students(2, 'MC200')],
+                                     ['both@mycsu.edu', 'one@mycsu.edu'])
+                    self.assertEqual(store.student_rank('both@mycsu.edu', 'MC200')['rank'], 1)
+                    self.assertEqual(store.student_rank('both@mycsu.edu')['course_id'], 'MC100')
+                    self.assertEqual([r['Course.id'] for r in service.grade_reports('both@mycsu.edu')],
+                                     ['MC100', 'MC200'])
+
+                    # A professor sees and grades students of every course they teach.
+                    service.register('multi@mycsu.edu', 'pw', 'professor', 'Dr. Multi', rank='Senior',
+                                     course_id='MC100')
+                    session = service.login('multi@mycsu.edu', 'pw')
+                    self.assertRaises(AccessDenied, service.student_for, session, 'one@mycsu.edu')
+                    self.assertEqual(service.teach('multi@mycsu.edu', 'MC200'), ['MC100', 'MC200'])
+                    self.assertEqual(service.session(session.token).course_ids, ('MC100', 'MC200'))
+                    self.assertEqual(service.student_for(session, 'one@mycsu.edu')['Course.id'], 'MC200')
+                    self.assertEqual(service.shared_course(session, 'one@mycsu.edu'), 'MC200')
+                    self.assertRaises(AccessDenied, service.session_course, session, 'MC300')
+
+                    # Dropping the home course moves the next one onto the student's row.
+                    self.assertFalse(service.delete_student('both@mycsu.edu', 'MC100'))
+                    self.assertEqual(store.students.get('both@mycsu.edu')['Course.id'], 'MC200')
+                    self.assertEqual(len(store.enrollments), 0)
+                    service.enroll('both@mycsu.edu', 'MC300')
+                    self.assertRaises(IntegrityError, service.delete_course, 'MC300')
+                    self.assertEqual(service.delete_course('MC200', cascade=True),
+                                     {'students': 2, 'login': 1, 'enrollments': 1, 'teaching': 1,
+                                      'courses': 1})
+                    self.assertEqual(store.courses_taught('multi@mycsu.edu'), ['MC100'])
+                    self.assertEqual([s['Email address'] for s in store.roster('MC300')], ['both@mycsu.edu'])
+                    self.assertNotIn('one@mycsu.edu', store.login)
+                    self.assertEqual(service.relations.violations(), [])
+                    if isinstance(store, SQLiteStore):
+                        store.close()
+            finally:
+                CSVHandler.compact_all()
+
+    def test_cascade_keeps_other_courses(self):
+        print("\nTesting cascading course deletes for people in several courses...")
+        with tempfile.TemporaryDirectory() as tmp:
+            service = GradeService(CSVStore(tmp))
+            store = service.store
+            try:
+                for course_id in ('CS1', 'MA1', 'PH1'):
+                    service.add_course(course_id, course_id, 3)
+                service.add_student('a@mycsu.edu', 'A', 'Home', 'CS1', 70)
+                service.enroll('a@mycsu.edu', 'MA1', 85)
+                service.add_student('b@mycsu.edu', 'B', 'Other', 'MA1', 60)
+                service.enroll('b@mycsu.edu', 'CS1', 65)
+                service.add_student('c@mycsu.edu', 'C', 'Only', 'CS1', 50)
+                service.add_professor('p@mycsu.edu', 'Dr. P', 'Senior', 'CS1')
+                service.teach('p@mycsu.edu', 'PH1')
+                service.add_professor('q@mycsu.edu', 'Dr. Q', 'Junior', 'CS1')
+
+                changed = service.delete_course('CS1', cascade=True)
+                self.assertEqual(changed, {'students': 2, 'login': 1, 'enrollments': 2, 'professors': 2,
+                                           'teaching': 1, 'courses': 1})
+                store = CSVStore(tmp)
+                a = store.students.get('a@mycsu.edu')
+                self.assertEqual((a['Course.id'], a['grades'], a['Marks']), ('MA1', 'B', '85'))
+                self.assertIn('a@mycsu.edu', store.login)
+                self.assertEqual([s['Course.id'] for s in store.enrollments_of('b@mycsu.edu')], ['MA1'])
+                self.assertNotIn('c@mycsu.edu', store.students)
+                self.assertNotIn('c@mycsu.edu', store.login)
+                self.assertEqual(store.courses_taught('p@mycsu.edu'), ['PH1'])
+                self.assertEqual(store.professors.get('q@mycsu.edu')['Course.id'], 'TBD')
+                self.assertEqual(len(store.enrollments) + len(store.teaching), 0)
+                self.assertEqual(Relations(store).violations(), [])
+            finally:
+                CSVHandler.compact_all()
+
+    def test_enrollments_in_course_queries(self):
+        print("\nTesting course queries over students and enrollments together...")
+        with tempfile.TemporaryDirectory() as tmp:
+            sqlite_dir = os.path.join(tmp, 'sqlite')
+            os.mkdir(sqlite_dir)
+            rng = random.Random(25)
+            try:
+                for store in (CSVStore(tmp), SQLiteStore(os.path.join(sqlite_dir, 'grades.db'), sqlite_dir)):
+                    service = GradeService(store)
+                    for course_id in ('EN1', 'EN2', 'EN3'):
+                        service.add_course(course_id, course_id, 3)
+                    store.students.insert_many([{
+                        'Email address': f'e{i:02d}@mycsu.edu', 'First name': f'F{i % 3}', 'Last name': f'L{i % 5}',
+                        'Course.id': 'EN1' if i < 20 else 'EN2', 'grades': '',
+                        'Marks': rng.choice([str(rng.randint(60, 70)), 'Unavailable'])} for i in range(40)])
+                    for i in range(0, 40, 3):
+                        service.enroll(f'e{i:02d}@mycsu.edu', 'EN2' if i < 20 else 'EN1', rng.randint(60, 70))
+                    for i in range(0, 40, 4):
+                        service.enroll(f'e{i:02d}@mycsu.edu', 'EN3', rng.randint(60, 70))
+                    service.update_student('e03@mycsu.edu', last_name='Aaron')
+
+                    calls = []
+                    for course_id in ('EN1', 'EN2', 'EN3', None):
+                        if course_id:
+                            calls.append(('course_stats', (course_id,)))
+                        calls += [('students_page', (order, 5, 10, course_id, reverse))
+                                  for order in ('marks', 'name', 'email') for reverse in (False, True)]
+                        calls += [('students_in_range', (62, 66, course_id)),
+                                  ('top_students', (7, course_id))]
+                    calls += [('student_rank', ('e06@mycsu.edu', course_id)) for course_id in (None, 'EN3', 'EN1')]
+                    expected = [getattr(DataStore, name)(store, *args) for name, args in calls]
+                    # The stores answer from their own indexes, never the base full scan.
+                    with patch.object(DataStore, '_ordered_students', side_effect=AssertionError):
+                        self.assertEqual([getattr(store, name)(*args) for name, args in calls], expected)
+                    if isinstance(store, SQLiteStore):
+                        store.close()
+            finally:
+                CSVHandler.compact_all()
+
 if __name__ == '__main__':
     unittest.main()